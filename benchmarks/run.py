@@ -0,0 +1,216 @@
+# End-to-end benchmark of the spectra -> embedding -> fingerprint pipeline on synthetic data
+# Every stage is timed on its own for every dataset size, the results (seconds, throughput and peak memory) are
+# appended together with the git commit to a JSON history so runs of different commits can be compared
+# Stages whose dependencies are not installed (e.g. scyjava for the fingerprints) are recorded as skipped
+#
+# Run from the repository root:
+#   python -m benchmarks.run --sizes 1000 5000 20000
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks import synthetic
+from mass_spectra.instrumentation import peak_memory_mb
+
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.json')
+
+STAGES = ['load_mgf', 'metadata_processing', 'peak_processing', 'convert_to_document', 'preprocess_spectra',
+          'word2vec', 'calc_vector', 'embed', 'fingerprint', 'similarity_voting_fit', 'similarity_voting_predict_proba',
+          'model_fit', 'model_predict']
+
+# Stages every stage needs the output of, a stage is skipped when one of them did not run
+REQUIRES = {
+    'metadata_processing': ['load_mgf'],
+    'peak_processing': ['metadata_processing'],
+    'convert_to_document': ['peak_processing'],
+    'preprocess_spectra': ['load_mgf'],
+    'word2vec': ['convert_to_document'],
+    'calc_vector': ['word2vec'],
+    'embed': ['word2vec'],
+    'similarity_voting_fit': ['word2vec'],
+    'similarity_voting_predict_proba': ['similarity_voting_fit'],
+    'model_fit': ['embed'],
+    'model_predict': ['model_fit'],
+}
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Benchmark:
+    def __init__(self, stages=None):
+        self.stages = set(STAGES if stages is None else stages)
+        self.results = {}
+        self.outputs = {}
+
+    # Run function(), record its time, throughput (items per second) and the peak memory after it
+    # Returns the result of function, or None if the stage was skipped
+    def run(self, name, items, function):
+        missing = [r for r in REQUIRES.get(name, []) if r not in self.outputs]
+        if name not in self.stages:
+            self.results[name] = {'skipped': 'not selected'}
+        elif missing:
+            self.results[name] = {'skipped': f'requires {", ".join(missing)}'}
+        else:
+            try:
+                start = time.perf_counter()
+                output = function()
+                seconds = time.perf_counter() - start
+            except ImportError as e:
+                self.results[name] = {'skipped': f'missing dependency: {e.name or e}'}
+            else:
+                self.outputs[name] = output
+                self.results[name] = {
+                    'seconds': seconds,
+                    'items': items,
+                    'items_per_second': items / seconds if seconds > 0 else None,
+                    'peak_rss_mb': peak_memory_mb(),
+                    'peak_rss_children_mb': peak_memory_mb(children=True),
+                }
+        print(f'  {name:<32} {format_result(self.results[name])}')
+        return self.outputs.get(name)
+
+def format_result(result):
+    if 'skipped' in result:
+        return f'skipped ({result["skipped"]})'
+    throughput = f'{result["items_per_second"]:.1f}/s' if result['items_per_second'] else '-'
+    memory = f'{result["peak_rss_mb"]:.0f} MB' if result['peak_rss_mb'] is not None else '-'
+    return f'{result["seconds"]:9.3f} s  {throughput:>14}  {memory:>8}'
+
+def benchmark_size(n, folder, args):
+    from wrappers.multilabel import MultiLabel
+
+    from mass_spectra import train_spec2vec
+    from mass_spectra.embedding import embed_documents
+    from mass_spectra.similarity_voting import SimilarityVoting
+
+    print(f'Size {n}')
+    synthetic.write_mgf(folder, n, random_state=args.seed)
+    benchmark = Benchmark(args.stages)
+
+    spectra = benchmark.run('load_mgf', n, lambda: list(train_spec2vec.load_from_mgf_files(folder, file_name_ending='TBDMS_RAW')))
+    processed = benchmark.run('metadata_processing', n, lambda: [train_spec2vec.metadata_processing(s) for s in spectra])
+    processed = benchmark.run('peak_processing', n, lambda: [s for s in map(train_spec2vec.peak_processing, processed or []) if s is not None])
+    documents = benchmark.run('convert_to_document', len(processed or []), lambda: [train_spec2vec.convert_to_document(s) for s in processed])
+    benchmark.run('preprocess_spectra', n, lambda: list(train_spec2vec.preprocess_spectra(spectra, workers=args.workers)))
+
+    # Word2vec throughput is counted in documents times epochs
+    model_file = os.path.join(folder, 'spec2vec.model')
+    def train():
+        from spec2vec.model_building import train_new_word2vec_model
+        return train_new_word2vec_model(documents, iterations=[args.epochs], filename=model_file, progress_logger=False,
+                                        vector_size=args.vector_size, workers=args.workers)
+    model = benchmark.run('word2vec', len(documents or []) * args.epochs, train)
+
+    # Baseline of embed: one spec2vec.calc_vector call per document
+    def calc_vectors():
+        from spec2vec.vector_operations import calc_vector
+        return np.array([calc_vector(model, d) for d in documents])
+    benchmark.run('calc_vector', len(documents or []), calc_vectors)
+    X = benchmark.run('embed', len(documents or []), lambda: embed_documents(model, documents))
+
+    inchis = synthetic.generate_inchis(n)
+    def fingerprint():
+        from mass_spectra.to_fingerprint import generate_fingerprint
+        return generate_fingerprint(args.fingerprint, inchis, workers=args.workers)
+    benchmark.run('fingerprint', n, fingerprint)
+
+    # Targets are the synthetic fingerprints of the compounds of the documents, the first half is used for training
+    compound_of_key = {inchikey: i for i, (_, inchikey, _) in enumerate(synthetic.KNOWN_COMPOUNDS)}
+    y = synthetic.generate_fingerprints([compound_of_key[d.metadata['inchikey']] for d in documents or []], random_state=args.seed)
+    half = len(y) // 2
+
+    voting = benchmark.run('similarity_voting_fit', half, lambda: SimilarityVoting(model_file).fit(documents[:half], y[:half]))
+    benchmark.run('similarity_voting_predict_proba', len(y) - half, lambda: voting.predict_proba(documents[half:]))
+
+    clf = benchmark.run('model_fit', half, lambda: MultiLabel(n_estimators=50, random_state=args.seed).fit(X[:half], y[:half]))
+    benchmark.run('model_predict', len(y) - half, lambda: clf.predict(X[half:]))
+
+    return benchmark.results
+
+# Seconds of every stage by dataset size, with the exponent of a power law fitted through them
+# (1 is linear scaling, 2 quadratic), stages with fewer than two timed sizes get no exponent
+def scaling(results):
+    curves = {}
+    for stage in STAGES:
+        points = [(int(n), r[stage]['seconds']) for n, r in results.items() if 'seconds' in r.get(stage, {})]
+        if not points:
+            continue
+        curves[stage] = {'sizes': [n for n, _ in points], 'seconds': [t for _, t in points], 'exponent': None}
+        sizes, seconds = np.log([n for n, _ in points]), np.log([max(t, 1e-9) for _, t in points])
+        if len(set(sizes)) > 1:
+            curves[stage]['exponent'] = float(np.polyfit(sizes, seconds, 1)[0])
+    return curves
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+def save_history(path, history):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(history, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on synthetic spectra')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000],
+                        help='Numbers of spectra (and InChIs) to benchmark, one run per size (default: 1000 5000)')
+    parser.add_argument('--stages', type=str, nargs='+', default=None, choices=STAGES,
+                        help='Stages to run (default: all), stages needing the output of an unselected stage are skipped')
+    parser.add_argument('--epochs', type=int, default=5,
+                        help='Number of word2vec epochs (default: 5)')
+    parser.add_argument('--vector_size', type=int, default=300,
+                        help='Size of the word2vec vectors (default: 300)')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='Number of workers for preprocessing, training and fingerprints (default: number of CPUs)')
+    parser.add_argument('--fingerprint', type=str, nargs='+', default=['MACCSFingerprinter'],
+                        help='Fingerprints to generate (default: MACCSFingerprinter)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the synthetic data')
+    parser.add_argument('--history', type=str, default=HISTORY_FILE,
+                        help='JSON file the results are appended to (default: benchmarks/history.json)')
+    parser.add_argument('--no_history', action='store_true',
+                        help='Only print the results')
+
+    args = parser.parse_args()
+
+    results = {}
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            results[str(n)] = benchmark_size(n, folder, args)
+
+    entry = {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'settings': {'sizes': args.sizes, 'epochs': args.epochs, 'vector_size': args.vector_size,
+                     'workers': args.workers, 'fingerprint': args.fingerprint, 'seed': args.seed},
+        'results': results,
+        'scaling': scaling(results),
+    }
+    for stage, curve in entry['scaling'].items():
+        if curve['exponent'] is not None:
+            print(f'  {stage:<32} scales with n^{curve["exponent"]:.2f}')
+    if not args.no_history:
+        history = load_history(args.history)
+        history.append(entry)
+        save_history(args.history, history)
+        print(f'Results appended to {args.history}')
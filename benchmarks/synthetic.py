@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+from matchms import Spectrum
+from matchms.exporting import save_as_mgf
+
+# Synthetic datasets for the benchmarks
+# Spectra are generated around a fixed set of known compounds, every compound has its own characteristic peaks so the
+# spectra of a compound are similar to each other (like replicate measurements) and word2vec has structure to learn
+
+# (InChI, InChIKey, name) of small molecules every CDK/RDKit version can parse
+KNOWN_COMPOUNDS = [
+    ("InChI=1S/CH4/h1H4", "VNWKTOKETHGBQD-UHFFFAOYSA-N", "Methane"),
+    ("InChI=1S/C2H6O/c1-2-3/h3H,2H2,1H3", "LFQSCWFLJHTTHZ-UHFFFAOYSA-N", "Ethanol"),
+    ("InChI=1S/C6H6/c1-2-4-6-5-3-1/h1-6H", "UHOVQNZJYSORNB-UHFFFAOYSA-N", "Benzene"),
+    ("InChI=1S/C2H4O2/c1-2(3)4/h1H3,(H,3,4)", "QTBSBXVTEAMEQO-UHFFFAOYSA-N", "Acetic acid"),
+    ("InChI=1S/C2H5NO2/c3-1-2(4)5/h1,3H2,(H,4,5)", "DHMQDGOQFOQNFH-UHFFFAOYSA-N", "Glycine"),
+    ("InChI=1S/CH4N2O/c2-1(3)4/h(H4,2,3,4)", "XSQUKJJJFZCRTK-UHFFFAOYSA-N", "Urea"),
+    ("InChI=1S/C8H10N4O2/c1-10-4-9-6-5(10)7(13)12(3)8(14)11(6)2/h4H,1-3H3", "RYYVLZVUVIJVGH-UHFFFAOYSA-N", "Caffeine"),
+    ("InChI=1S/C6H6O/c7-6-4-2-1-3-5-6/h1-5,7H", "ISWSIDIOOBJBQZ-UHFFFAOYSA-N", "Phenol"),
+    ("InChI=1S/C7H6O2/c8-7(9)6-4-2-1-3-5-6/h1-5H,(H,8,9)", "WPYMKLBDIGXBTP-UHFFFAOYSA-N", "Benzoic acid"),
+    ("InChI=1S/C3H6O/c1-3(2)4/h1-2H3", "CSCPPACGZOOCGX-UHFFFAOYSA-N", "Acetone"),
+]
+
+# n InChIs cycling through the known compounds
+def generate_inchis(n):
+    return [KNOWN_COMPOUNDS[i % len(KNOWN_COMPOUNDS)][0] for i in range(n)]
+
+# Random fingerprint bits of every known compound, rows of the returned (n, n_bits) matrix follow compounds
+def generate_fingerprints(compounds, n_bits=166, random_state=0):
+    rng = np.random.default_rng(random_state)
+    bits = (rng.random((len(KNOWN_COMPOUNDS), n_bits)) < 0.3).astype(np.uint8)
+    return bits[np.asarray(compounds, dtype=np.int64)]
+
+# n spectra, spectrum i belongs to compound i % len(KNOWN_COMPOUNDS) which is also returned
+# Titles follow the NIST export ("InChiKey: ... Name: ...") parsed by train_spec2vec.metadata_processing
+def generate_spectra(n, n_peaks=40, mz_from=30, mz_to=600, random_state=0):
+    rng = np.random.default_rng(random_state)
+    characteristic = [np.sort(rng.uniform(mz_from, mz_to, n_peaks)) for _ in KNOWN_COMPOUNDS]
+
+    spectra = []
+    compounds = np.arange(n) % len(KNOWN_COMPOUNDS)
+    for i, compound in enumerate(compounds):
+        inchi, inchikey, name = KNOWN_COMPOUNDS[compound]
+        # Drop some characteristic peaks, shift the rest slightly and add noise peaks
+        keep = rng.random(n_peaks) < 0.8
+        mz = characteristic[compound][keep] + rng.normal(0, 0.002, keep.sum())
+        mz = np.sort(np.concatenate([mz, rng.uniform(mz_from, mz_to, n_peaks // 4)]))
+        intensities = rng.uniform(0.01, 1, len(mz))
+        spectra.append(Spectrum(mz=mz, intensities=intensities, metadata={
+            "title": f"Spectrum {i} InChiKey: {inchikey} Name: {name}",
+            "inchi": inchi,
+            "precursor_mz": float(mz_to),
+        }))
+    return spectra, compounds
+
+# Write n synthetic spectra to {folder}/synthetic_{n}_{file_name_ending}.mgf, returns the path and the compounds
+def write_mgf(folder, n, file_name_ending="TBDMS_RAW", random_state=0):
+    spectra, compounds = generate_spectra(n, random_state=random_state)
+    path = os.path.join(folder, f"synthetic_{n}_{file_name_ending}.mgf")
+    if os.path.exists(path):
+        os.remove(path) # save_as_mgf appends to existing files
+    save_as_mgf(spectra, path)
+    return path, compounds
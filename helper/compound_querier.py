@@ -3,22 +3,46 @@ import re
 import sys
 
 import pandas as pd
-import requests
+
+from helper import validation
+from helper.compound_store import CompoundStore
+from mass_spectra.resolution_cache import Resolver, create_session
 
 MAIN_DATA_SOURCE = "./source/compounds/compounds.pkl"
+STORE_SOURCE = "./source/compounds/compounds.sqlite"
 COLUMNS = ['smiles', 'inchi', 'inchi_key']
-DATA_FRAME = pd.DataFrame(columns=COLUMNS)
-EXPECTED_KEYS = set(DATA_FRAME.columns)
-
-if not os.path.exists(MAIN_DATA_SOURCE):
-    os.makedirs(os.path.dirname(MAIN_DATA_SOURCE), exist_ok=True)
-    DATA_FRAME.to_pickle(MAIN_DATA_SOURCE)
-
-# Make sure that stored data frame has the same columns as the new data frame
-stored_data = pd.read_pickle(MAIN_DATA_SOURCE)
-DATA_FRAME = pd.concat([DATA_FRAME, stored_data], ignore_index=True)
+EXPECTED_KEYS = set(COLUMNS)
+
+# Compounds are kept in an indexed store, compounds.pkl is exported from it for the notebooks by add_compounds
+# The store is opened on first use, importing the module does not create or read any file
+_store = None
+def get_store():
+    global _store
+    if _store is None:
+        _store = CompoundStore(STORE_SOURCE, COLUMNS)
+        # Import compounds from the pickle written by earlier versions
+        if len(_store) == 0 and os.path.exists(MAIN_DATA_SOURCE):
+            for c in pd.read_pickle(MAIN_DATA_SOURCE).to_dict('records'):
+                _store.add(c)
+            _store.flush()
+    return _store
+
+def __getattr__(name):
+    # STORE and DATA_FRAME are built on access, for code written against the old module globals
+    if name == "STORE":
+        return get_store()
+    if name == "DATA_FRAME":
+        return get_store().to_frame()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 host = "https://www.chemspider.com"
+def get_host():
+    """
+    Get the chemspider host, the CHEMSPIDER_HOST environment variable (read on every call) points the lookups to another server
+    :return: host url
+    """
+    return os.environ.get("CHEMSPIDER_HOST", host)
+
 query_urls = {
     "inchi_key_to_inchi": "{}/InChI.asmx/InChIKeyToInChI?inchi_key={}",
     "inchi_to_inchi_key": "{}/InChI.asmx/InChIToInChIKey?inchi={}",
@@ -27,71 +51,84 @@ query_urls = {
 }
 response_value = r"<string .*>(.*)</string>"
 
+def parse_response(response):
+    values = re.findall(response_value, response.text)
+    if len(values) == 0:
+        print(f"Warning: no value found for {response.url}")
+        return None
+    if len(values) > 1:
+        print(f"Warning: multiple values found for {response.url}")
+        print(values)
+    return values[0]
+
+def create_resolver(url_format, host=None, **kwargs):
+    """
+    Create a resolver for a query type, chemspider answers invalid input with status 500 so it is treated as a miss
+    :param url_format: url format
+    :param host: host url (get_host() if None)
+    :param kwargs: further arguments of Resolver (session, timeout, ...)
+    :return: resolver
+    """
+    url = query_urls[url_format].format(get_host() if host is None else host, "{key}")
+    return Resolver(f"chemspider_{url_format}", url, parse_response, miss_statuses=(400, 404, 500), **kwargs)
+
+resolvers = {}
+def get_resolver(url_format, host=None):
+    """
+    Get the cached resolver for a query type
+    :param url_format: url format
+    :param host: host url (get_host() if None)
+    :return: resolver
+    """
+    host = get_host() if host is None else host
+    if (url_format, host) not in resolvers:
+        resolvers[(url_format, host)] = create_resolver(url_format, host)
+    return resolvers[(url_format, host)]
+
 def query(url_format, input_value):
     """
-    Query the chemspider API
+    Query the chemspider API (results are cached on disk)
     :param url_format: url format
     :param input_value: input value
     :return: response
     """
     if url_format not in query_urls:
         return None
-    
-    url = query_urls[url_format].format(host, input_value)
-    response = requests.get(url)
-    if response.status_code != 200:
-        return None
-    
-    values = re.findall(response_value, response.text)
-    if len(values) == 0:
-        print(f"Warning: no value found for {url}")
-        return None
-    if len(values) > 1:
-        print(f"Warning: multiple values found for {url}")
-        print(values)
-    return values[0]
+    return get_resolver(url_format).resolve(input_value)
 
-def validate(data_frame, samples=None, log=False, progress=None):
-    if samples is None:
-        samples = len(data_frame)
+def query_many(url_format, input_values):
+    """
+    Query the chemspider API for many values at once, only values missing from the cache are requested
+    :param url_format: url format
+    :param input_values: input values
+    :return: dictionary of input value to response
+    """
+    if url_format not in query_urls:
+        return {v: None for v in input_values}
+    return get_resolver(url_format).resolve_many(input_values)
+
+def validate(data_frame, samples=None, log=False, progress=None, concurrency=16, rate=None, timeout=30, retries=1, checkpoint=None):
+    """
+    Validate compounds against chemspider, lookups of many rows run concurrently
+    The timeout and retries are set on the HTTP session, so a lookup that times out stops instead of running on in the background
+    :param data_frame: data frame with smiles, inchi and inchi_key columns
+    :param samples: number of rows to validate (all rows if None)
+    :param log: print mismatches
+    :param progress: progress bar function such as tqdm
+    :param concurrency: maximum number of lookups in flight
+    :param rate: maximum number of lookups started per second
+    :param timeout: timeout of a single request in seconds, a lookup takes at most about (retries + 1) * timeout and counts as no result when it timed out
+    :param retries: number of times a rate limited or failed request is retried
+    :param checkpoint: csv file to resume an interrupted validation from
+    :return: data frame of rows with mismatches
+    """
+    session = create_session(retries=retries, pool_size=concurrency)
+    lookup_resolvers = {q: create_resolver(q, session=session, timeout=timeout) for q in validation.LOOKUPS}
+    def lookup(url_format, value):
+        return lookup_resolvers[url_format].resolve(value)
+    return validation.run(validation.validate_async(lookup, data_frame, samples=samples, concurrency=concurrency, rate=rate,
+                                                    checkpoint=checkpoint, log=log, progress=progress))
 
-    generator = data_frame.sample(samples).iterrows()
-    if progress is not None:
-        generator = progress(generator, total=samples)
-
-    invalid = []
-    for i, row in generator:
-        inchi_key_to_inchi = query("inchi_key_to_inchi", row['inchi_key'])
-        inchi_to_inchi_key = query("inchi_to_inchi_key", row['inchi'])
-        inchi_to_smiles = query("inchi_to_smiles", row['inchi'])
-        smiles_to_inchi_key = query("smiles_to_inchi_key", row['smiles'])
-
-        inchi_key_valid = True
-        if inchi_to_inchi_key is not None:
-            inchi_key_valid = inchi_key_valid and inchi_to_inchi_key == row['inchi_key']
-        if smiles_to_inchi_key is not None:
-            inchi_key_valid = inchi_key_valid and smiles_to_inchi_key == row['inchi_key']
-        
-        inchi_valid = True
-        if inchi_key_to_inchi is not None:
-            inchi_valid = inchi_valid and inchi_key_to_inchi == row['inchi']
-        
-        smiles_valid = True
-        if inchi_to_smiles is not None:
-            smiles_valid = smiles_valid and inchi_to_smiles == row['smiles']
-        
-        if log:
-            if any([not inchi_key_valid, not inchi_valid, not smiles_valid]):
-                print(f"Row {i} is invalid")
-            if not inchi_key_valid:
-                print(f"  Expected inchi key: {row['inchi_key']}; got {inchi_to_inchi_key} and {smiles_to_inchi_key}")
-            if not inchi_valid:
-                print(f"  Expected inchi: {row['inchi']}; got {inchi_key_to_inchi}")    
-            if not smiles_valid:
-                print(f"  Expected smiles: {row['smiles']}; got {inchi_to_smiles}")
-        invalid.append(row)
-    return invalid
-        
 
 def get_compound(inchi_key):
     """
@@ -99,17 +136,19 @@ def get_compound(inchi_key):
     :param inchi_key: inchi key
     :return: compound
     """
-    global DATA_FRAME
-    v = DATA_FRAME.loc[DATA_FRAME['inchi_key'] == inchi_key]
-    if len(v) == 0:
+    compound = get_store().get('inchi_key', inchi_key)
+    if compound is None:
         return None
-    return v.iloc[0]
+    return pd.Series(compound, index=COLUMNS)
 
-def add_compounds(compounds, progress=None, save_every=100):
-    global DATA_FRAME
+def add_compounds(compounds, progress=None, save_every=100, export=True):
     """
-    Add compounds to the data frame
+    Add compounds to the store
     :param compounds: compounds to add
+    :param progress: progress bar function such as tqdm
+    :param save_every: number of compounds after which the new compounds are appended to the store file
+    :param export: write compounds.pkl for the notebooks when compounds were added, pass False when adding many
+                   batches and call export_pickle once at the end
     :return: None
     """
     if isinstance(compounds, dict):
@@ -117,10 +156,7 @@ def add_compounds(compounds, progress=None, save_every=100):
     if isinstance(compounds, pd.DataFrame):
         compounds = compounds.to_dict('records')
 
-    
-    existing_values = {c: DATA_FRAME[c].unique() for c in COLUMNS}
-    augmented_compounds = []
-
+    store = get_store()
     generator = enumerate(compounds)
     new = 0
     if progress is not None:
@@ -130,12 +166,7 @@ def add_compounds(compounds, progress=None, save_every=100):
         valid_keys = EXPECTED_KEYS.intersection(set(c.keys()))
 
         # Check if compound already exists
-        skip = False
-        for vk in valid_keys:
-            if c[vk] in existing_values[vk]:
-                skip = True
-                break
-        if skip:
+        if store.contains({k: c[k] for k in valid_keys}):
             continue
         new += 1
 
@@ -149,13 +180,22 @@ def add_compounds(compounds, progress=None, save_every=100):
                 c[mk] = result
                 break
 
-        c = {k: c.get(k) for k in EXPECTED_KEYS}
-        augmented_compounds.append(c)
+        store.add(c)
 
+        # Only the new compounds are appended to the store file
         if i % save_every == 0:
-            DATA_FRAME = pd.concat([DATA_FRAME, pd.DataFrame(augmented_compounds)], ignore_index=True)
-            DATA_FRAME.to_pickle(MAIN_DATA_SOURCE)
-            augmented_compounds = []
+            store.flush()
     print(f"Added {new} new compounds")
-    DATA_FRAME = pd.concat([DATA_FRAME, pd.DataFrame(augmented_compounds)], ignore_index=True)
-    DATA_FRAME.to_pickle(MAIN_DATA_SOURCE)
\ No newline at end of file
+    store.flush()
+    if export and (new > 0 or not os.path.exists(MAIN_DATA_SOURCE)):
+        export_pickle(MAIN_DATA_SOURCE)
+
+def export_pickle(path=MAIN_DATA_SOURCE):
+    """
+    Write all compounds of the store to a pickle, the notebooks and the pipeline read compounds.pkl
+    :param path: path of the pickle
+    :return: None
+    """
+    store = get_store()
+    store.flush()
+    store.to_frame().to_pickle(path)
@@ -0,0 +1,89 @@
+import os
+import sqlite3
+
+import pandas as pd
+
+
+class CompoundStore:
+    """
+    Compound table with hash indexes on every column and append-only persistence in SQLite
+    :param path: path to the SQLite file
+    :param columns: indexed columns
+    """
+    def __init__(self, path, columns=('smiles', 'inchi', 'inchi_key')):
+        self.path = path
+        self.columns = list(columns)
+        self.rows = []
+        self.indexes = {c: {} for c in self.columns}
+        self.pending = []
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            f'CREATE TABLE IF NOT EXISTS compounds (id INTEGER PRIMARY KEY, {", ".join(f"{c} TEXT" for c in self.columns)})')
+        self.connection.commit()
+
+        for row in self.connection.execute(f'SELECT {", ".join(self.columns)} FROM compounds ORDER BY id'):
+            self._index(dict(zip(self.columns, row)))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _index(self, compound):
+        position = len(self.rows)
+        self.rows.append(compound)
+        for c in self.columns:
+            value = compound.get(c)
+            # The first compound with a value keeps it, same as a lookup in the old data frame
+            if value is not None and value not in self.indexes[c]:
+                self.indexes[c][value] = position
+
+    def get(self, column, value):
+        """
+        Get compound by the value of one column
+        :param column: column name
+        :param value: value of the column
+        :return: compound dictionary or None
+        """
+        position = self.indexes[column].get(value)
+        if position is None:
+            return None
+        return self.rows[position]
+
+    def contains(self, compound):
+        """
+        Check if any of the known values of the compound is already stored
+        :param compound: compound dictionary
+        :return: bool
+        """
+        return any(compound.get(c) is not None and compound.get(c) in self.indexes[c] for c in self.columns)
+
+    def add(self, compound):
+        """
+        Add compound, it is visible immediately and written to disk on the next flush
+        :param compound: compound dictionary
+        :return: None
+        """
+        compound = {c: None if pd.isna(compound.get(c)) else compound.get(c) for c in self.columns}
+        self._index(compound)
+        self.pending.append(compound)
+
+    def flush(self):
+        """
+        Append the compounds added since the last flush to the SQLite file
+        :return: None
+        """
+        if len(self.pending) == 0:
+            return
+        self.connection.executemany(
+            f'INSERT INTO compounds ({", ".join(self.columns)}) VALUES ({", ".join("?" * len(self.columns))})',
+            [tuple(c[k] for k in self.columns) for c in self.pending])
+        self.connection.commit()
+        self.pending = []
+
+    def to_frame(self):
+        """
+        Get all compounds as a data frame
+        :return: data frame with one column per indexed column
+        """
+        return pd.DataFrame(self.rows, columns=self.columns)
@@ -1,67 +1,158 @@
 # This script converts a csv file to an arff file
 # arff is a file format used by Weka and some other machine learning software
+# The csv file is streamed in chunks of rows, so memory stays constant whatever the size of the file:
+#   pass 1 infers the type of every column (string, binary {0, 1}, integer or real) and the byte offset of every row
+#   pass 2 writes the header once and then the rows, optionally shuffled (rows are read back by their offsets)
+# Rows can be written as sparse arff, which only lists the non zero values (fingerprint bits are mostly 0)
 
 import argparse
+import io
 import os
 
-import arff
+import numpy as np
 import pandas as pd
 
-parser = argparse.ArgumentParser(description='Convert csv to arff')
-parser.add_argument('csv_file', type=str,
-                    help='Path to the csv file')
-parser.add_argument('arff_file', type=str,
-                    help='Path to the arff file')
-parser.add_argument('--relation', type=str, default=None,
-                    help='Relation name (if not specified, will be the arf file name)')
-parser.add_argument('--shuffle', action='store_true',
-                    help='Shuffle the rows')
-
-args = parser.parse_args()
-
-CSV_FILE = args.csv_file
-ARFF_FILE = args.arff_file
-RELATION = args.relation
-SHUFFLE = args.shuffle
-
-if not CSV_FILE.endswith('.csv'):
-    raise argparse.ArgumentError('CSV file must be a csv file')
-
-if not ARFF_FILE.endswith('.arff'):
-    raise argparse.ArgumentError('ARFF file must be a arff file')
-
-if RELATION is None:
-    RELATION = os.path.basename(ARFF_FILE).replace('.arff', '')
-
-df = pd.read_csv(CSV_FILE)
-
-if SHUFFLE:
-    df = df.sample(frac=1)
-
-metadata_columns = list(df.columns[df.dtypes == 'object'])
-sanitized_metadata_columns = {}
-for col in metadata_columns:
-    df[col] = df[col].astype(str)
-    df[col] = df[col].str.strip().str.replace(',', ';')
-    df[col] = df[col].str.strip()
-    sanitized_metadata_columns[col] = col.lower().replace(' ', '_')
-df = df.rename(columns=sanitized_metadata_columns)
-
-numeric_columns = list(df.columns[df.dtypes != 'object'])
-binary = set([0, 1])
-for col in numeric_columns:
-    vc = df[col].value_counts()
-    v = set(vc.keys())
-    if v.issubset(binary):
-        df[col] = df[col].astype(bool)
-
-arff.dump(ARFF_FILE, df.values, relation=RELATION, names=df.columns)
-
-with open(ARFF_FILE, 'r') as f:
-    data = f.read()
-    data = data.replace('{True, False}', '{0, 1}')
-    data = data.replace(',True', ',1')
-    data = data.replace(',False', ',0')
-
-with open(ARFF_FILE, 'w') as f:
-    f.write(data)
\ No newline at end of file
+STRING = 'string'
+BINARY = '{0, 1}'
+INTEGER = 'integer'
+REAL = 'real'
+
+# Read the rows of an open csv file as raw lines (bytes) in batches of chunk_size rows
+# With offsets given, the rows are read in that order by seeking to each offset
+# Values with line breaks inside quotes are not supported
+def _line_batches(f, chunk_size, offsets=None):
+    if offsets is None:
+        batch = []
+        for line in f:
+            batch.append(line)
+            if len(batch) == chunk_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        return
+
+    for start in range(0, len(offsets), chunk_size):
+        batch = []
+        for offset in offsets[start:start + chunk_size]:
+            f.seek(offset)
+            batch.append(f.readline())
+        yield batch
+
+def _parse(header, batch, string_columns=None):
+    dtype = None if string_columns is None else {c: str for c in string_columns}
+    return pd.read_csv(io.BytesIO(header + b''.join(batch)), dtype=dtype)
+
+# Pass 1: header line, arff type of every column and byte offset of every row
+def infer_types(csv_file, chunk_size=10000):
+    kinds, binary, integral = None, None, None
+    offsets = []
+    with open(csv_file, 'rb') as f:
+        header = f.readline()
+        position = len(header)
+        for batch in _line_batches(f, chunk_size):
+            for line in batch:
+                if line.strip():
+                    offsets.append(position)
+                position += len(line)
+
+            chunk = _parse(header, batch)
+            if kinds is None:
+                kinds = {c: set() for c in chunk.columns}
+                binary = {c: True for c in chunk.columns}
+                integral = {c: True for c in chunk.columns}
+            for column in chunk.columns:
+                values = chunk[column]
+                kinds[column].add(values.dtype.kind)
+                if values.dtype.kind in 'biuf':
+                    present = values.dropna()
+                    binary[column] = binary[column] and bool(present.isin([0, 1]).all())
+                    integral[column] = integral[column] and values.dtype.kind in 'biu'
+
+    types = {}
+    for column in kinds or {}:
+        if not kinds[column] <= set('biuf'):
+            types[column] = STRING
+        elif binary[column]:
+            types[column] = BINARY
+        elif integral[column]:
+            types[column] = INTEGER
+        else:
+            types[column] = REAL
+    return header, types, np.array(offsets, dtype=np.int64)
+
+# String representation of every value of a column, None for values left out of sparse rows
+def _format_column(values, arff_type, sparse):
+    if arff_type == STRING:
+        text = values.fillna('nan').astype(str).str.strip().str.replace(',', ';').str.strip()
+        return [repr(v) for v in text.tolist()]
+
+    missing = values.isna().to_numpy()
+    numbers = values.to_numpy(dtype=np.float64)
+    if arff_type == REAL:
+        formatted = [repr(v) for v in numbers.tolist()]
+    else:
+        formatted = [str(int(v)) if not m else '?' for v, m in zip(numbers.tolist(), missing)]
+    if sparse:
+        formatted = [None if (v == 0 and not m) else s for s, v, m in zip(formatted, numbers.tolist(), missing)]
+    return ['?' if m else s for s, m in zip(formatted, missing)]
+
+def _format_rows(chunk, types, sparse):
+    columns = [_format_column(chunk[c], types[c], sparse) for c in chunk.columns]
+    if not sparse:
+        return [','.join(row) for row in zip(*columns)]
+    return ['{' + ','.join(f'{i} {v}' for i, v in enumerate(row) if v is not None) + '}' for row in zip(*columns)]
+
+# Names of string columns are lower cased with spaces replaced by underscores
+def _attribute_name(column, arff_type):
+    return column.lower().replace(' ', '_') if arff_type == STRING else column
+
+def convert(csv_file, arff_file, relation=None, shuffle=False, sparse=False, chunk_size=10000, random_state=None):
+    if relation is None:
+        relation = os.path.basename(arff_file).replace('.arff', '')
+
+    header, types, offsets = infer_types(csv_file, chunk_size)
+    if shuffle:
+        offsets = np.random.default_rng(random_state).permutation(offsets)
+    string_columns = [c for c, t in types.items() if t == STRING]
+
+    with open(csv_file, 'rb') as f, open(arff_file, 'w') as out:
+        out.write(f'@relation {relation}\n')
+        for column, arff_type in types.items():
+            out.write(f'@attribute {_attribute_name(column, arff_type)} {arff_type}\n')
+        out.write('@data\n')
+
+        f.seek(len(header))
+        for batch in _line_batches(f, chunk_size, offsets if shuffle else None):
+            chunk = _parse(header, batch, string_columns)
+            for line in _format_rows(chunk, types, sparse):
+                out.write(line)
+                out.write('\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert csv to arff')
+    parser.add_argument('csv_file', type=str,
+                        help='Path to the csv file')
+    parser.add_argument('arff_file', type=str,
+                        help='Path to the arff file')
+    parser.add_argument('--relation', type=str, default=None,
+                        help='Relation name (if not specified, will be the arf file name)')
+    parser.add_argument('--shuffle', action='store_true',
+                        help='Shuffle the rows')
+    parser.add_argument('--random_state', type=int, default=None,
+                        help='Seed of the shuffle')
+    parser.add_argument('--sparse', action='store_true',
+                        help='Write sparse arff rows (only non zero values)')
+    parser.add_argument('--chunk_size', type=int, default=10000,
+                        help='Number of rows held in memory at once (default: 10000)')
+
+    args = parser.parse_args()
+
+    if not args.csv_file.endswith('.csv'):
+        parser.error('CSV file must be a csv file')
+
+    if not args.arff_file.endswith('.arff'):
+        parser.error('ARFF file must be a arff file')
+
+    convert(args.csv_file, args.arff_file, args.relation, args.shuffle, args.sparse, args.chunk_size, args.random_state)
@@ -0,0 +1,129 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+# Lookups made for every row, query type -> column used as input
+LOOKUPS = {
+    "inchi_key_to_inchi": "inchi_key",
+    "inchi_to_inchi_key": "inchi",
+    "inchi_to_smiles": "inchi",
+    "smiles_to_inchi": "smiles",
+}
+RESULT_COLUMNS = ["index", "inchi_key", "inchi", "smiles"] + list(LOOKUPS) + ["inchi_key_valid", "inchi_valid", "smiles_valid"]
+
+
+class RateLimiter:
+    """
+    Spaces out requests so that at most `rate` requests per second are started
+    :param rate: requests per second, None for no limit
+    """
+    def __init__(self, rate=None):
+        self.interval = 0 if rate is None else 1 / rate
+        self.next_start = 0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def compare(row, results):
+    """
+    Compare the looked up values with the values of the row, lookups that returned nothing are not counted as mismatches
+    :param row: row with inchi_key, inchi and smiles
+    :param results: dictionary of query type to result
+    :return: dictionary with the validity of inchi_key, inchi and smiles
+    """
+    inchi_key_valid = results["inchi_to_inchi_key"] is None or results["inchi_to_inchi_key"] == row["inchi_key"]
+    inchi_valid = all(results[q] is None or results[q] == row["inchi"] for q in ["inchi_key_to_inchi", "smiles_to_inchi"])
+    smiles_valid = results["inchi_to_smiles"] is None or results["inchi_to_smiles"] == row["smiles"]
+    return {"inchi_key_valid": inchi_key_valid, "inchi_valid": inchi_valid, "smiles_valid": smiles_valid}
+
+
+async def _lookup(query, url_format, value, semaphore, limiter):
+    async with semaphore:
+        await limiter.wait()
+        return await asyncio.to_thread(query, url_format, value)
+
+
+async def _validate_row(query, index, row, semaphore, limiter):
+    lookups = [_lookup(query, q, row[column], semaphore, limiter) for q, column in LOOKUPS.items()]
+    results = dict(zip(LOOKUPS, await asyncio.gather(*lookups)))
+    return {"index": index, "inchi_key": row["inchi_key"], "inchi": row["inchi"], "smiles": row["smiles"],
+            **results, **compare(row, results)}
+
+
+async def validate_async(query, data_frame, samples=None, concurrency=16, rate=None,
+                         checkpoint=None, log=False, progress=None, random_state=None):
+    """
+    Validate rows of the data frame against online lookups, many rows are validated concurrently
+    :param query: blocking function (query type, value) -> result or None, run on a thread per lookup
+                  a running thread can not be cancelled, so query has to bound its own time (request timeout and retries)
+    :param data_frame: data frame with inchi_key, inchi and smiles columns
+    :param samples: number of rows to validate (all rows if None)
+    :param concurrency: maximum number of lookups in flight
+    :param rate: maximum number of lookups started per second (no limit if None)
+    :param checkpoint: csv file to which every validated row is appended, rows already in it are skipped
+    :param log: print mismatches
+    :param progress: progress bar function such as tqdm
+    :param random_state: random state used to sample the rows
+    :return: data frame of the validated rows with at least one mismatch
+    """
+    done = pd.DataFrame(columns=RESULT_COLUMNS)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        done = pd.read_csv(checkpoint)
+    remaining = data_frame.drop(index=done["index"], errors="ignore")
+
+    if samples is None:
+        samples = len(data_frame)
+    samples = max(0, min(samples - len(done), len(remaining)))
+    rows = remaining.sample(samples, random_state=random_state)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate)
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+
+    tasks = [_validate_row(query, i, row, semaphore, limiter) for i, row in rows.iterrows()]
+    generator = asyncio.as_completed(tasks)
+    if progress is not None:
+        generator = progress(generator, total=len(tasks))
+
+    results = []
+    for task in generator:
+        result = await task
+        results.append(result)
+        if checkpoint is not None:
+            pd.DataFrame([result], columns=RESULT_COLUMNS).to_csv(checkpoint, mode="a", index=False,
+                                                                  header=not os.path.exists(checkpoint))
+        if log and not all([result["inchi_key_valid"], result["inchi_valid"], result["smiles_valid"]]):
+            print(f"Row {result['index']} is invalid")
+            if not result["inchi_key_valid"]:
+                print(f"  Expected inchi key: {result['inchi_key']}; got {result['inchi_to_inchi_key']}")
+            if not result["inchi_valid"]:
+                print(f"  Expected inchi: {result['inchi']}; got {result['inchi_key_to_inchi']} and {result['smiles_to_inchi']}")
+            if not result["smiles_valid"]:
+                print(f"  Expected smiles: {result['smiles']}; got {result['inchi_to_smiles']}")
+
+    validated = pd.DataFrame(done.to_dict("records") + results, columns=RESULT_COLUMNS)
+    valid = validated[["inchi_key_valid", "inchi_valid", "smiles_valid"]].astype(bool).all(axis=1)
+    return validated[~valid].reset_index(drop=True)
+
+
+def run(coroutine):
+    """
+    Run a coroutine to completion, also from inside a running event loop (e.g. jupyter)
+    :param coroutine: coroutine
+    :return: result of the coroutine
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
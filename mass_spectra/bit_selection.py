@@ -0,0 +1,125 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Selection of informative fingerprint bits
+# Bits are handled as packed columns (8 rows per byte, np.packbits along the rows), so a column of n compounds takes
+# n / 8 bytes: constant bits are found by counting set bits, duplicate bits by hashing the bytes of every column
+# The resulting selection is stored as json so new data (e.g. at inference time) is reduced to the exact same bits
+
+# Number of set bits of every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+# Pack a (n_rows, n_bits) 0/1 matrix along the rows, returns a C contiguous (n_bits, ceil(n_rows / 8)) array
+# Rows packed with np.packbits(axis=1) (as stored by mass_spectra.store) are given with packed=True and n_bits set
+# The matrix is processed in blocks of block_size rows so it never has to be unpacked as a whole
+def pack_columns(bits, packed=False, n_bits=None, block_size=8192):
+    if block_size % 8 != 0:
+        raise ValueError('block_size has to be a multiple of 8')
+    n_rows = bits.shape[0]
+    n_bits = bits.shape[1] if n_bits is None else n_bits
+    columns = np.empty(((n_rows + 7) // 8, n_bits), dtype=np.uint8)
+    for start in range(0, n_rows, block_size):
+        block = np.asarray(bits[start:start + block_size])
+        if packed:
+            block = np.unpackbits(block, axis=1, count=n_bits)
+        columns[start // 8:(start + len(block) + 7) // 8] = np.packbits(block.astype(bool), axis=0)
+    return np.ascontiguousarray(columns.T)
+
+def _correlated(columns, n_rows, threshold, block_size):
+    # Co-occurrence counts of all pairs of bits, accumulated over blocks of rows
+    counts = np.zeros((len(columns), len(columns)), dtype=np.float64)
+    for start in range(0, columns.shape[1], block_size // 8):
+        block = np.unpackbits(columns[:, start:start + block_size // 8], axis=1).astype(np.float32)
+        counts += block @ block.T
+    ones = np.diag(counts).copy()
+
+    # Pearson correlation of binary columns, bits are kept in order unless they correlate with an already kept bit
+    spread = np.sqrt(ones * (n_rows - ones))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = np.abs((n_rows * counts - np.outer(ones, ones)) / np.outer(spread, spread))
+    keep = np.ones(len(columns), dtype=bool)
+    for j in range(1, len(columns)):
+        keep[j] = not np.any(correlation[j, :j][keep[:j]] >= threshold)
+    return ~keep
+
+
+# Column names are stored with their JSON type (numpy scalars as the matching python type), so a selection made on
+# integer column names selects the same columns after loading
+def _json_name(name):
+    if isinstance(name, np.generic):
+        name = name.item()
+    if not isinstance(name, (str, int, float, bool)):
+        raise TypeError(f'Column name {name!r} of type {type(name).__name__} can not be stored')
+    return name
+
+
+class BitSelection:
+    # The columns of the input and the subset of them that is kept, in input order
+    def __init__(self, columns, selected):
+        self.columns = list(columns)
+        self.selected = list(selected)
+        positions = {c: i for i, c in enumerate(self.columns)}
+        self.indices = np.array([positions[c] for c in self.selected], dtype=np.int64)
+
+    @property
+    def mask(self):
+        mask = np.zeros(len(self.columns), dtype=bool)
+        mask[self.indices] = True
+        return mask
+
+    # Reduce a DataFrame (selected by column name) or a (n_rows, n_bits) matrix (selected by position)
+    def apply(self, bits):
+        if isinstance(bits, pd.DataFrame):
+            return bits[self.selected]
+        if bits.shape[1] != len(self.columns):
+            raise ValueError(f'Selection was made on {len(self.columns)} bits, got {bits.shape[1]}')
+        return bits[:, self.indices]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'columns': [_json_name(c) for c in self.columns], 'selected': [_json_name(c) for c in self.selected]}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            selection = json.load(f)
+        return cls(selection['columns'], selection['selected'])
+
+
+# Select the bits of a (n_rows, n_bits) 0/1 matrix or DataFrame
+# remove_constant drops bits with the same value in every row, remove_duplicates drops bits equal to an earlier bit
+# correlation_threshold additionally drops bits whose absolute correlation with an earlier kept bit is at least the threshold
+def select_bits(bits, columns=None, remove_constant=True, remove_duplicates=True, correlation_threshold=None,
+                packed=False, n_bits=None, block_size=8192):
+    if isinstance(bits, pd.DataFrame):
+        columns = bits.columns if columns is None else columns
+        bits = bits.to_numpy(dtype=np.uint8)
+    n_rows = bits.shape[0]
+    packed_columns = pack_columns(bits, packed=packed, n_bits=n_bits, block_size=block_size)
+    names = list(range(len(packed_columns))) if columns is None else list(columns)
+    if len(names) != len(packed_columns):
+        raise ValueError(f'Got {len(names)} column names for {len(packed_columns)} bits')
+
+    keep = np.ones(len(packed_columns), dtype=bool)
+    if remove_constant:
+        ones = POPCOUNT[packed_columns].sum(axis=1)
+        keep &= (ones > 0) & (ones < n_rows)
+
+    if remove_duplicates:
+        first = {}
+        for j in np.flatnonzero(keep):
+            key = packed_columns[j].tobytes()
+            if key in first:
+                keep[j] = False
+            else:
+                first[key] = j
+
+    if correlation_threshold is not None:
+        kept = np.flatnonzero(keep)
+        keep[kept[_correlated(packed_columns[kept], n_rows, correlation_threshold, block_size)]] = False
+
+    return BitSelection(names, [names[j] for j in np.flatnonzero(keep)])
@@ -1,16 +1,27 @@
-import pandas as pd
-from chembl_webresource_client.unichem import unichem_client as unichem
-from scyjava import config, jimport
-
-config.endpoints.append('org.openscience.cdk:cdk-bundle:2.8')
-InChIGeneratorFactory = jimport('org.openscience.cdk.inchi.InChIGeneratorFactory')
-InChIToStructure = jimport('org.openscience.cdk.inchi.InChIToStructure')
-DefaultChemObjectBuilder = jimport('org.openscience.cdk.DefaultChemObjectBuilder')
+CDK_ENDPOINT = 'org.openscience.cdk:cdk-bundle:2.8'
 
+# CDK classes are resolved on first use, importing the module does not start the JVM
+# pandas and the UniChem client are also only imported when compound_info is called
+_cdk_classes = None
+def _cdk():
+    global _cdk_classes
+    if _cdk_classes is None:
+        from scyjava import config, jimport
+        if CDK_ENDPOINT not in config.endpoints:
+            config.endpoints.append(CDK_ENDPOINT)
+        _cdk_classes = {
+            'InChIGeneratorFactory': jimport('org.openscience.cdk.inchi.InChIGeneratorFactory'),
+            'DefaultChemObjectBuilder': jimport('org.openscience.cdk.DefaultChemObjectBuilder'),
+        }
+    return _cdk_classes
 
 def compound_info(inchi):
-    factory = InChIGeneratorFactory()
-    intostruct = factory.getInChIToStructure(inchi, DefaultChemObjectBuilder.getInstance())
+    import pandas as pd
+    from chembl_webresource_client.unichem import unichem_client as unichem
+
+    cdk = _cdk()
+    factory = cdk['InChIGeneratorFactory']()
+    intostruct = factory.getInChIToStructure(inchi, cdk['DefaultChemObjectBuilder'].getInstance())
     atom_container = intostruct.getAtomContainer()
     # ger molecule name from inchi
     name = atom_container.getProperty('PUBCHEM_IUPAC_NAME')
\ No newline at end of file
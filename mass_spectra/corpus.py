@@ -0,0 +1,59 @@
+import os
+import random
+
+# Out-of-core word2vec corpus
+# Every document is stored as one line of space separated words in a token file, the corpus streams the lines from
+# disk on every pass, so training memory depends on the vocabulary size instead of the number of documents
+
+TOKEN_FILE_EXTENSION = "tokens"
+
+def token_path(token_folder, key):
+    return os.path.join(token_folder, f"{key}.{TOKEN_FILE_EXTENSION}")
+
+# Write the words of the documents to a token file, one document per line
+def save_tokens(path, documents):
+    # Write to a temporary file first so an interrupted run never leaves a truncated token file behind
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        for document in documents:
+            f.write(" ".join(document.words))
+            f.write("\n")
+    os.replace(tmp_path, path)
+
+
+class TokenCorpus:
+    # Restartable iterable over the documents (lists of words) of one or more token files
+    # With fraction < 1 every pass yields the same random subset of the documents
+    def __init__(self, paths, fraction=1.0, seed=0):
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.fraction = fraction
+        self.seed = seed
+        self._length = None
+
+    def __iter__(self):
+        rng = random.Random(self.seed)
+        for path in self.paths:
+            with open(path) as f:
+                for line in f:
+                    if self.fraction < 1 and rng.random() >= self.fraction:
+                        continue
+                    yield line.split()
+
+    def __len__(self):
+        if self._length is None:
+            self._length = sum(1 for _ in self)
+        return self._length
+
+
+class ConcatCorpus:
+    # Restartable concatenation of corpora (lists of documents or TokenCorpus)
+    def __init__(self, *corpora):
+        self.corpora = corpora
+
+    def __iter__(self):
+        for corpus in self.corpora:
+            yield from corpus
+
+    def __len__(self):
+        return sum(len(corpus) for corpus in self.corpora)
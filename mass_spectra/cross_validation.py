@@ -0,0 +1,141 @@
+import copy
+import mmap
+import multiprocessing
+import os
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.model_selection import KFold
+
+from mass_spectra.store import PackedBits
+
+# Cross validation over a pool of worker processes
+# Workers open X and y as memory maps instead of receiving copies, a fold only materialises its own train and test rows:
+# memory maps over a file (e.g. from store.load_dataset) are reopened from that file, in-memory arrays are written
+# once to a temporary .npy file. With workers=1 the folds run in this process on X and y directly
+# Every fold is saved as {"model", "train_index", "test_index"}, the rows themselves can be recovered with load_fold
+
+# Repeated shuffled k-fold splits as (name, train_index, test_index), names are "{repeat}_{fold}"
+def kfold_splits(n_rows, repeats=2, k=5, random_state=None):
+    for i in range(repeats):
+        kf = KFold(n_splits=k, shuffle=True, random_state=None if random_state is None else random_state + i)
+        for fold, (train_index, test_index) in enumerate(kf.split(np.arange(n_rows))):
+            yield f'{i}_{fold}', train_index, test_index
+
+# Splits that hide hidden_groups groups (e.g. InChI keys) at a time, so the test rows belong to groups never trained on
+# group_ids holds the integer group id (0..n_groups-1, e.g. inchi_key_id of the merged dataset) of every row and
+# group_order the order in which the ids are hidden (e.g. a permutation of all ids)
+# The last split also takes the remaining groups when fewer than hidden_groups would be left, names are "{start}_{end}"
+def group_splits(group_ids, group_order, hidden_groups):
+    group_ids = np.asarray(group_ids, dtype=np.int64)
+    group_order = np.asarray(group_order, dtype=np.int64)
+    n_groups = max(group_ids.max(initial=-1), group_order.max(initial=-1)) + 1
+    for end_i in range(hidden_groups, len(group_order), hidden_groups):
+        start_i = end_i - hidden_groups
+        if end_i + hidden_groups > len(group_order):
+            end_i = len(group_order)
+        hidden = np.zeros(n_groups, dtype=bool)
+        hidden[group_order[start_i:end_i]] = True
+        is_test = hidden[group_ids]
+        yield f'{start_i}_{end_i}', np.flatnonzero(~is_test), np.flatnonzero(is_test)
+
+# A memory map whose data starts at its offset in the file, views (e.g. X[10:]) keep the offset of the whole map
+def _is_file_map(array):
+    if not isinstance(array, np.memmap) or array._mmap is None or not (array.flags.c_contiguous or array.flags.f_contiguous):
+        return False
+    start = np.frombuffer(array._mmap, dtype=np.uint8).ctypes.data + array.offset % mmap.ALLOCATIONGRANULARITY
+    return array.ctypes.data == start
+
+# Picklable reference to X or y for the workers, opened again with _open
+def _share(array, folder, name):
+    if isinstance(array, PackedBits):
+        return ('packed', _share(array.packed, folder, name), array.n_bits)
+    if _is_file_map(array):
+        order = 'C' if array.flags.c_contiguous else 'F'
+        return ('memmap', array.filename, array.dtype.str, array.shape, array.offset, order)
+    path = os.path.join(folder, f'{name}.npy')
+    np.save(path, np.asarray(array))
+    return ('file', path)
+
+def _open(source):
+    kind = source[0]
+    if kind == 'array':
+        return source[1]
+    if kind == 'file':
+        return np.load(source[1], mmap_mode='r')
+    if kind == 'memmap':
+        _, filename, dtype, shape, offset, order = source
+        return np.memmap(filename, dtype=np.dtype(dtype), mode='r', offset=offset, shape=shape, order=order)
+    return PackedBits(_open(source[1]), source[2])
+
+def _fit_fold(model, x_source, y_source, train_index, test_index, model_training_data_path):
+    X = _open(x_source)
+    y = _open(y_source)
+
+    # train
+    model.fit(X[train_index], y[train_index])
+
+    # predict
+    X_test = X[test_index]
+    y_pred = model.predict(X_test)
+    y_prob = model.predict_proba(X_test)
+
+    # store the model and the rows it was trained and tested on
+    if model_training_data_path is not None:
+        with open(model_training_data_path, 'wb') as f:
+            pickle.dump({'model': model, 'train_index': train_index, 'test_index': test_index}, f)
+    return y_pred, y_prob
+
+# Fit a copy of the model on every split, splits are (name, train_index, test_index) with integer row indices
+# Folds are evaluated in the order of the splits with metrics.evaluate(y_true, y_prob, y_pred, model_training_data_path=...)
+# Models are saved to {output_folder}/{name}.pkl, returns the list of saved paths
+# With workers > 1 the model's own parallelism (e.g. n_jobs) should be lowered to avoid oversubscribing the CPUs
+# Workers are spawned (as the stages of mass_spectra.pipeline) instead of forked, forking a process that already runs
+# threads (BLAS, torch, tqdm) can deadlock; the model is pickled to the workers, so its class has to be importable
+def cross_validate(model, X, y, splits, metrics=None, output_folder=None, workers=1, progress=None):
+    splits = list(splits)
+    # DataFrames and lists are indexed by row position like arrays, memory maps and PackedBits are kept as they are
+    X, y = (a if isinstance(a, PackedBits) else np.asanyarray(a) for a in (X, y))
+    paths = [None if output_folder is None else os.path.join(output_folder, f'{name}.pkl') for name, _, _ in splits]
+    if output_folder is not None:
+        os.makedirs(output_folder, exist_ok=True)
+
+    with tempfile.TemporaryDirectory() as folder:
+        if workers > 1:
+            x_source, y_source = _share(X, folder, 'X'), _share(y, folder, 'y')
+        else:
+            x_source, y_source = ('array', X), ('array', y)
+
+        arguments = [(x_source, y_source, train_index, test_index, path) for (_, train_index, test_index), path in zip(splits, paths)]
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            results = executor.map(_fit_fold, [model] * len(arguments), *zip(*arguments))
+        else:
+            executor = None
+            results = (_fit_fold(copy.deepcopy(model), *a) for a in arguments)
+        if progress is not None:
+            results = progress(results, total=len(arguments), desc='Fold')
+
+        try:
+            for (_, _, test_index), path, (y_pred, y_prob) in zip(splits, paths, results):
+                if metrics is not None:
+                    metrics.evaluate(y[test_index], y_prob, y_pred, model_training_data_path=path)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    return paths
+
+# Load a fold saved by cross_validate together with its rows of X and y
+def load_fold(model_training_data_path, X, y):
+    with open(model_training_data_path, 'rb') as f:
+        fold = pickle.load(f)
+    train_index, test_index = fold['train_index'], fold['test_index']
+    return {
+        'model': fold['model'],
+        'X_train': X[train_index],
+        'y_train': y[train_index],
+        'X_test': X[test_index],
+        'y_test': y[test_index],
+    }
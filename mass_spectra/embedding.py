@@ -0,0 +1,56 @@
+import numpy as np
+from scipy import sparse
+
+# Batch version of spec2vec.calc_vector
+# Words of all documents are resolved to vocabulary indices once, the weighted word counts of a batch
+# of documents form a sparse (n_documents, n_words) matrix which is multiplied with the embedding matrix
+# Defaults are the same as the ones of calc_vector
+def embed_documents(model, documents, intensity_weighting_power=0, allowed_missing_percentage=10,
+                    batch_size=10000, out=None):
+    if not 0 <= allowed_missing_percentage <= 100.0:
+        raise ValueError("allowed_missing_percentage must be within [0,100]")
+
+    word_vectors = model.wv.vectors
+    key_to_index = model.wv.key_to_index
+    documents = documents if isinstance(documents, list) else list(documents)
+
+    if out is None:
+        out = np.empty((len(documents), word_vectors.shape[1]), dtype=np.float32)
+    if out.shape != (len(documents), word_vectors.shape[1]):
+        raise ValueError(f"Output array has shape {out.shape}, expected {(len(documents), word_vectors.shape[1])}")
+
+    for start in range(0, len(documents), batch_size):
+        batch = documents[start:start + batch_size]
+        out[start:start + len(batch)] = _embed_batch(word_vectors, key_to_index, batch,
+                                                     intensity_weighting_power, allowed_missing_percentage)
+    return out
+
+def _embed_batch(word_vectors, key_to_index, documents, intensity_weighting_power, allowed_missing_percentage):
+    lengths = np.array([len(d.words) for d in documents], dtype=np.int64)
+    indptr = np.zeros(len(documents) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(lengths)
+
+    # Vocabulary index of every word, -1 for words missing in the model
+    indices = np.fromiter((key_to_index.get(w, -1) for d in documents for w in d.words),
+                          dtype=np.int64, count=indptr[-1])
+    weights = np.fromiter((w for d in documents for w in d.weights), dtype=np.float64, count=indptr[-1])
+    if len(weights) > 0 and weights.max() > 1.0:
+        raise ValueError("Weights are not normalized to unity as expected.")
+    weights = np.power(weights, intensity_weighting_power)
+
+    # Weighted share of the document which is not covered by the model
+    missing = indices < 0
+    rows = np.repeat(np.arange(len(documents)), lengths)
+    total_weight = np.bincount(rows, weights=weights, minlength=len(documents))
+    missing_weight = np.bincount(rows, weights=weights * missing, minlength=len(documents))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        missing_percentage = 100 * missing_weight / total_weight
+
+    # calc_vector returns an empty vector for documents without known words or with too many missing words
+    all_missing = np.bincount(rows, weights=missing, minlength=len(documents)) == lengths
+    empty = all_missing | (missing_percentage > allowed_missing_percentage)
+    keep = ~missing & ~empty[rows]
+
+    counts = sparse.csr_matrix((weights[keep], (rows[keep], indices[keep])),
+                               shape=(len(documents), word_vectors.shape[0]))
+    return counts @ word_vectors
@@ -0,0 +1,171 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Lightweight instrumentation of the command line tools
+# Stage timers and counters are kept per process, worker processes collect their counters with collect() and return
+# them with their results so the main process can merge() them
+# The process totals are shared by all threads and guarded by a lock, the counter of a collect() block is only seen by
+# the thread (context) that opened it, so stages running on concurrent threads never count into each other
+# Every finished stage is logged as one JSON line on the "mass_spectra.metrics" logger, the totals (stages, counters
+# and peak memory) can be written to a metrics file at the end of a run
+
+logger = logging.getLogger("mass_spectra.metrics")
+
+_stages = {}
+_counters = Counter()
+_lock = threading.Lock()
+_collecting = ContextVar("collecting", default=None)
+
+# Peak resident set size of the process so far in MB (of its finished child processes with children=True)
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS, psutil is used where resource is not available (Windows)
+def peak_memory_mb(children=False):
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+        return usage / (1 << 20) if sys.platform == "darwin" else usage / (1 << 10)
+    except (ImportError, AttributeError, ValueError):
+        pass
+    if children:
+        return None
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, "peak_wset", memory.rss) / (1 << 20)
+
+def log_event(event, **fields):
+    logger.info(json.dumps({"event": event, **fields}, default=str))
+
+# Time the block as the stage name, a stage run several times accumulates its seconds and calls
+@contextmanager
+def stage(name, **fields):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            totals = _stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            totals["seconds"] += seconds
+            totals["calls"] += 1
+        log_event("stage", stage=name, seconds=round(seconds, 6), peak_memory_mb=peak_memory_mb(), **fields)
+
+def count(name, n=1):
+    collecting = _collecting.get()
+    if collecting is not None:
+        collecting[name] += n
+        return
+    with _lock:
+        _counters[name] += n
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+# Add counters (and stage totals of snapshot()) of a worker process to the process totals
+def merge(counts, stages=None):
+    with _lock:
+        _counters.update(counts)
+        for name, totals in (stages or {}).items():
+            merged = _stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            merged["seconds"] += totals["seconds"]
+            merged["calls"] += totals["calls"]
+
+# Count into a fresh counter inside the block, the yielded dict holds the counts of the block afterwards
+# The counts are not added to the process counters, they are meant to be returned from a worker and merged by the caller
+@contextmanager
+def collect():
+    collecting = Counter()
+    token = _collecting.set(collecting)
+    collected = {}
+    try:
+        yield collected
+    finally:
+        _collecting.reset(token)
+        collected.update(collecting)
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+def _stage_totals():
+    with _lock:
+        return {name: dict(totals) for name, totals in _stages.items()}
+
+# Counters and stage totals of the process, for a worker process that runs a whole stage on its own
+def snapshot():
+    return {"counts": counters(), "stages": _stage_totals()}
+
+def summary():
+    return {
+        "stages": _stage_totals(),
+        "counters": counters(),
+        "peak_memory_mb": peak_memory_mb(),
+        "peak_memory_children_mb": peak_memory_mb(children=True),
+    }
+
+def write_metrics(path, **fields):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({**fields, **summary()}, f, indent=2)
+
+# Profile the block with cProfile if path is given, the stats are saved to path (readable with pstats or snakeviz)
+# and the functions with the highest cumulative time are logged
+@contextmanager
+def profile(path=None, top=20):
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top)
+        logger.info(stream.getvalue())
+
+def configure_logging(level=logging.INFO):
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+# Arguments shared by the command line tools
+def add_arguments(parser):
+    parser.add_argument('--metrics_file', type=str, default=None,
+                        help='Path to a JSON file the stage timings, counters and peak memory are written to')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='Profile the run with cProfile and save the stats to this file')
+
+# Instrument a whole command line run: structured stage logs, optional profiling and the metrics file at the end
+@contextmanager
+def run(tool, metrics_file=None, profile_file=None):
+    configure_logging()
+    start = time.perf_counter()
+    status = "failed"
+    try:
+        with profile(profile_file):
+            yield
+        status = "finished"
+    finally:
+        seconds = time.perf_counter() - start
+        log_event("run", tool=tool, status=status, seconds=round(seconds, 6), **summary())
+        if metrics_file is not None:
+            write_metrics(metrics_file, tool=tool, status=status, seconds=seconds)
@@ -0,0 +1,82 @@
+import numpy as np
+
+# Scale rows to unit length, rows of zeros (empty embeddings) stay zero
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+# Indices and scores of the k largest values in every row, sorted from the best match down
+def top_k(scores, k):
+    k = min(k, scores.shape[1])
+    indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, indices, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+class CosineIndex:
+    # Top-k cosine similarity search over a fixed set of reference vectors
+    # With n_lists=None the search is exact, queries are compared to all references in blocks of block_size
+    # With n_lists set the references are clustered (spherical k-means) and every query is only compared to
+    # the references of its n_probe closest clusters (inverted file index), so the search cost grows sub-linearly
+    def __init__(self, n_lists=None, n_probe=8, block_size=1024, iterations=10, random_state=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.block_size = block_size
+        self.iterations = iterations
+        self.random_state = random_state
+
+    def fit(self, vectors):
+        self.vectors = normalize(vectors)
+        if self.n_lists is not None:
+            self._fit_lists()
+        return self
+
+    def _assign(self, vectors):
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), self.block_size):
+            assignment[start:start + self.block_size] = np.argmax(vectors[start:start + self.block_size] @ self.centroids.T, axis=1)
+        return assignment
+
+    def _fit_lists(self):
+        rng = np.random.default_rng(self.random_state)
+        n_lists = min(self.n_lists, len(self.vectors))
+        self.centroids = self.vectors[rng.choice(len(self.vectors), n_lists, replace=False)]
+        for _ in range(self.iterations):
+            assignment = self._assign(self.vectors)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignment, self.vectors)
+            # Clusters which lost all members are restarted from a random reference
+            empty = np.bincount(assignment, minlength=n_lists) == 0
+            sums[empty] = self.vectors[rng.choice(len(self.vectors), empty.sum())]
+            self.centroids = normalize(sums)
+
+        assignment = self._assign(self.vectors)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(n_lists)]
+
+    # Returns (scores, indices) of shape (n_queries, k), missing neighbours have index -1 and score -inf
+    def search(self, queries, k):
+        queries = normalize(queries)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+
+        for start in range(0, len(queries), self.block_size):
+            block = queries[start:start + self.block_size]
+            if self.n_lists is None:
+                block_scores, block_indices = top_k(block @ self.vectors.T, k)
+                scores[start:start + len(block), :block_scores.shape[1]] = block_scores
+                indices[start:start + len(block), :block_indices.shape[1]] = block_indices
+                continue
+
+            probes = top_k(block @ self.centroids.T, self.n_probe)[1]
+            for i, (query, probe) in enumerate(zip(block, probes)):
+                candidates = np.concatenate([self.lists[p] for p in probe])
+                if len(candidates) == 0:
+                    continue
+                candidate_scores, candidate_indices = top_k((self.vectors[candidates] @ query)[np.newaxis], k)
+                scores[start + i, :candidate_scores.shape[1]] = candidate_scores[0]
+                indices[start + i, :candidate_indices.shape[1]] = candidates[candidate_indices[0]]
+        return scores, indices
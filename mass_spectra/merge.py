@@ -0,0 +1,83 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from mass_spectra.store import load, save_dataset, unpack_bits
+
+# Merge of the embedding and fingerprint stores into the X/y training data
+# InChI keys are mapped to integer ids once, every embedding row then finds its fingerprint row through an id -> row
+# lookup array (a hash join), so no string indexes are joined and only the matched rows of X and y are materialised
+# Rows follow the fingerprint order and, within an InChI key, the embedding order (the order of the former pandas join)
+
+DESCRIPTIVE_COLUMNS = ['inchi_key', 'inchi', 'smiles']
+
+# Integer ids of the InChI keys of every array, ids are shared between the arrays and missing keys get -1
+# Returns the unique keys (id -> key) and one id array per input array
+def inchikey_ids(*key_arrays):
+    lengths = [len(keys) for keys in key_arrays]
+    ids, keys = pd.factorize(np.concatenate([np.asarray(keys, dtype=object) for keys in key_arrays]))
+    return np.asarray(keys, dtype=object), np.split(ids, np.cumsum(lengths)[:-1])
+
+# Row pairs (embedding_rows, fingerprint_rows) of the embeddings and fingerprints with the same id
+# Every embedding row is matched to the first fingerprint row of its id, unmatched rows are left out
+def join_rows(embedding_ids, fingerprint_ids, n_ids):
+    fingerprint_row = np.full(n_ids + 1, -1, dtype=np.int64) # last entry for the missing id -1
+    rows = np.arange(len(fingerprint_ids))[::-1]
+    fingerprint_row[fingerprint_ids[::-1]] = rows # reversed, so the first row of an id is written last
+    fingerprint_row[-1] = -1
+
+    matched = fingerprint_row[embedding_ids]
+    embedding_rows = np.flatnonzero(matched >= 0)
+    fingerprint_rows = matched[embedding_rows]
+    order = np.lexsort((embedding_rows, fingerprint_rows))
+    return embedding_rows[order], fingerprint_rows[order]
+
+# Merge the stores written by save_embeddings and save_fingerprints
+# Returns X (float32 embeddings), y (0/1 fingerprint bits), the index with the descriptive columns and the InChI key id
+# (group) of every row, and the column names of X and y
+def merge(embedding_path, fingerprint_path):
+    embeddings, embedding_index, embedding_header = load(embedding_path)
+    packed, fingerprint_index, fingerprint_header = load(fingerprint_path, packed=True)
+
+    keys, (embedding_ids, fingerprint_ids) = inchikey_ids(embedding_index['inchi_key'], fingerprint_index['inchi_key'])
+    embedding_rows, fingerprint_rows = join_rows(embedding_ids, fingerprint_ids, len(keys))
+
+    X = np.asarray(embeddings[embedding_rows], dtype=np.float32)
+    y = unpack_bits(np.asarray(packed[fingerprint_rows]), len(fingerprint_header['columns']))
+
+    # Ids of the merged rows are renumbered to 0..n_inchi_keys-1 in order of appearance
+    inchi_key_ids, _ = pd.factorize(embedding_ids[embedding_rows])
+    index = fingerprint_index.iloc[fingerprint_rows][DESCRIPTIVE_COLUMNS].reset_index(drop=True)
+    index['inchi_key_id'] = inchi_key_ids
+
+    x_columns = [f'embedding_{c}' for c in embedding_header['columns']]
+    y_columns = [f'fingerprint_{c}' for c in fingerprint_header['columns']]
+    return X, y, index, x_columns, y_columns
+
+# Merge the stores and save the result with save_dataset as {folder}/X, {folder}/y
+def merge_to_dataset(embedding_path, fingerprint_path, folder):
+    X, y, index, x_columns, y_columns = merge(embedding_path, fingerprint_path)
+    save_dataset(folder, X, y, index, x_columns, y_columns)
+    return X, y, index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge embeddings and fingerprints into X/y training data')
+    parser.add_argument('embedding_path', type=str,
+                        help='Path to the embedding store (written by save_embeddings)')
+    parser.add_argument('fingerprint_path', type=str,
+                        help='Path to the fingerprint store (written by save_fingerprints)')
+    parser.add_argument('output_folder', type=str,
+                        help='Folder the merged dataset is written to')
+
+    args = parser.parse_args()
+
+    # Stores are given by their path with or without the .npy extension (to_spec2vec writes to a .npy path)
+    for path in (args.embedding_path, args.fingerprint_path):
+        if not os.path.isfile(path if path.endswith('.npy') else f'{path}.npy'):
+            parser.error(f'Store {path} does not exist')
+
+    X, y, index = merge_to_dataset(args.embedding_path, args.fingerprint_path, args.output_folder)
+    print(f'Merged {len(index)} rows of {index["inchi_key_id"].nunique()} InChI keys, X {X.shape}, y {y.shape}')
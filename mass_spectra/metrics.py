@@ -0,0 +1,249 @@
+import numpy as np
+import pandas as pd
+from scipy.special import xlogy
+from scipy.stats import rankdata
+
+from mass_spectra.bit_selection import POPCOUNT, pack_columns
+
+# Multi-label metrics of fingerprint predictions
+# The confusion counts (TP/FP/FN/TN per label and per sample) are computed once on packed bits with a popcount table,
+# every thresholded metric is derived from them; results follow the semantics of scikit-learn 1.3
+# (including zero_division) so they can replace the sklearn metric functions one to one
+
+AVERAGES = ["micro", "macro", "weighted", "samples"]
+Y_PRED_SCORES = ["accuracy_score", "log_loss", "hamming_loss"]
+Y_PRED_SCORES_WITH_AVERAGING = ["f1_score", "precision_score", "recall_score", "jaccard_score"]
+Y_PROB_SCORES = ["roc_auc_score", "label_ranking_loss", "coverage_error"]
+METRIC_NAMES = Y_PRED_SCORES + [f"{m}__{a}" for m in Y_PRED_SCORES_WITH_AVERAGING for a in AVERAGES] + Y_PROB_SCORES
+
+# Multi-output sklearn estimators return one (n_samples, 2) array per target, convert to (n_samples, n_targets)
+def probability_matrix(probabilities):
+    if isinstance(probabilities, list):
+        return np.column_stack([p[:, -1] for p in probabilities])
+    return np.asarray(probabilities)
+
+
+class ConfusionCounts:
+    # True positives, predicted positives and true positives of a 0/1 (n_samples, n_labels) prediction,
+    # summed per label (columns) and per sample (rows)
+    def __init__(self, y_true, y_pred):
+        y_true = np.asarray(y_true)
+        y_pred = np.asarray(y_pred)
+        if y_true.shape != y_pred.shape:
+            raise ValueError(f"y_true and y_pred have different shapes {y_true.shape} and {y_pred.shape}")
+        self.n_samples, self.n_labels = y_true.shape
+
+        true_columns, pred_columns = pack_columns(y_true), pack_columns(y_pred)
+        self.tp = POPCOUNT[true_columns & pred_columns].sum(axis=1)
+        self.pred_sum = POPCOUNT[pred_columns].sum(axis=1)
+        self.true_sum = POPCOUNT[true_columns].sum(axis=1)
+
+        true_rows, pred_rows = np.packbits(y_true.astype(bool), axis=1), np.packbits(y_pred.astype(bool), axis=1)
+        self.sample_tp = POPCOUNT[true_rows & pred_rows].sum(axis=1)
+        self.sample_pred_sum = POPCOUNT[pred_rows].sum(axis=1)
+        self.sample_true_sum = POPCOUNT[true_rows].sum(axis=1)
+        self.sample_errors = POPCOUNT[true_rows ^ pred_rows].sum(axis=1)
+
+    @property
+    def fp(self):
+        return self.pred_sum - self.tp
+
+    @property
+    def fn(self):
+        return self.true_sum - self.tp
+
+    @property
+    def tn(self):
+        return self.n_samples - self.tp - self.fp - self.fn
+
+    # (tp, pred_sum, true_sum) arrays the given average is computed from
+    def sums(self, average):
+        if average == "micro":
+            return np.array([self.tp.sum()]), np.array([self.pred_sum.sum()]), np.array([self.true_sum.sum()])
+        if average == "samples":
+            return self.sample_tp, self.sample_pred_sum, self.sample_true_sum
+        return self.tp, self.pred_sum, self.true_sum
+
+
+def _divide(numerator, denominator, zero_division):
+    denominator = np.asarray(denominator, dtype=np.float64).copy()
+    mask = denominator == 0
+    denominator[mask] = 1
+    result = numerator / denominator
+    result[mask] = zero_division
+    return result
+
+# Weighted average ignoring NaNs, unweighted if all weights are zero
+def _nanaverage(values, weights=None):
+    mask = np.isnan(values)
+    if len(values) == 0 or mask.all():
+        return np.nan
+    if weights is None:
+        return np.nanmean(values)
+    values, weights = values[~mask], np.asarray(weights)[~mask]
+    if weights.sum() == 0:
+        return np.average(values)
+    return np.average(values, weights=weights)
+
+# Precision, recall and F-beta score averaged with "micro", "macro", "weighted" or "samples" (None for per label scores)
+def precision_recall_fscore(counts, average="macro", zero_division=0, beta=1.0):
+    tp, pred_sum, true_sum = counts.sums(average)
+    precision = _divide(tp, pred_sum, zero_division)
+    recall = _divide(tp, true_sum, zero_division)
+
+    # F-score is zero_division if its denominator is 0 or if both precision and recall are ill-defined
+    beta2 = beta ** 2
+    denominator = beta2 * precision + recall
+    mask = np.isclose(denominator, 0) | np.isclose(pred_sum + true_sum, 0)
+    denominator[mask] = 1
+    f_score = (1 + beta2) * precision * recall / denominator
+    f_score[mask] = zero_division
+
+    if average is None:
+        return precision, recall, f_score
+    weights = true_sum if average == "weighted" else None
+    return _nanaverage(precision, weights), _nanaverage(recall, weights), _nanaverage(f_score, weights)
+
+def precision_score(counts, average="macro", zero_division=0):
+    return precision_recall_fscore(counts, average, zero_division)[0]
+
+def recall_score(counts, average="macro", zero_division=0):
+    return precision_recall_fscore(counts, average, zero_division)[1]
+
+def f1_score(counts, average="macro", zero_division=0):
+    return precision_recall_fscore(counts, average, zero_division)[2]
+
+def jaccard_score(counts, average="macro", zero_division=0):
+    tp, pred_sum, true_sum = counts.sums(average)
+    jaccard = _divide(tp, pred_sum + true_sum - tp, zero_division)
+    if average is None:
+        return jaccard
+    weights = true_sum if average == "weighted" and np.any(true_sum) else None
+    return np.average(jaccard, weights=weights)
+
+# Subset accuracy, a sample is only correct if all of its labels are
+def accuracy_score(counts):
+    return np.mean(counts.sample_errors == 0)
+
+def hamming_loss(counts):
+    return counts.sample_errors.sum() / (counts.n_samples * counts.n_labels)
+
+# Cross entropy of the rows of y_prob normalised to sum to one, as sklearn computes log_loss for multi-label targets
+def log_loss(y_true, y_prob):
+    y_prob = np.asarray(y_prob)
+    if y_prob.dtype not in (np.float64, np.float32, np.float16):
+        y_prob = y_prob.astype(np.float64)
+    eps = np.finfo(y_prob.dtype).eps
+    y_prob = np.clip(y_prob, eps, 1 - eps)
+    y_prob = y_prob / y_prob.sum(axis=1)[:, np.newaxis]
+    return np.mean(-xlogy(np.asarray(y_true), y_prob).sum(axis=1))
+
+# Macro averaged ROC AUC, NaN if any label has only one class in y_true (sklearn raises in that case)
+def roc_auc_score(y_true, y_prob):
+    y_true = np.asarray(y_true).astype(bool)
+    positives = y_true.sum(axis=0)
+    negatives = len(y_true) - positives
+    if np.any(positives == 0) or np.any(negatives == 0):
+        return np.nan
+    # Mann-Whitney U statistic with tied scores sharing their average rank
+    ranks = rankdata(np.asarray(y_prob), axis=0)
+    u = np.where(y_true, ranks, 0).sum(axis=0) - positives * (positives + 1) / 2
+    return np.mean(u / (positives * negatives))
+
+# Average fraction of (true, false) label pairs per sample where the false label scores at least as high as the true one
+def label_ranking_loss(y_true, y_prob, block_size=4096):
+    y_true = np.asarray(y_true).astype(bool)
+    y_prob = np.asarray(y_prob)
+    n_samples, n_labels = y_true.shape
+    loss = np.zeros(n_samples)
+    for start in range(0, n_samples, block_size):
+        true, prob = y_true[start:start + block_size], y_prob[start:start + block_size]
+        # Sort by score with true labels in front of false labels of the same score,
+        # every false label is then wrongly ordered with all true labels in front of it
+        order = np.lexsort((~true, prob), axis=1)
+        sorted_true = np.take_along_axis(true, order, axis=1)
+        loss[start:start + block_size] = (np.cumsum(sorted_true, axis=1) * ~sorted_true).sum(axis=1)
+
+    positives = y_true.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        loss /= (n_labels - positives) * positives
+    loss[(positives == 0) | (positives == n_labels)] = 0.0
+    return np.mean(loss)
+
+# Average number of top scored labels needed to cover all true labels of a sample
+def coverage_error(y_true, y_prob):
+    y_prob = np.asarray(y_prob)
+    lowest_true = np.where(np.asarray(y_true).astype(bool), y_prob, np.inf).min(axis=1)
+    coverage = (y_prob >= lowest_true[:, np.newaxis]).sum(axis=1)
+    coverage[np.isinf(lowest_true)] = 0
+    return np.mean(coverage)
+
+# All metrics of METRIC_NAMES as a dictionary
+# zero_division is used for f1/precision/recall, jaccard_zero_division for jaccard (same defaults as s3_train),
+# zero_division=np.nan leaves labels (or samples) without predicted or true positives out of the averages
+# errors="nan" sets only the metric that raised a ValueError to NaN (with a warning) instead of raising
+def multilabel_scores(y_true, y_prob, y_pred, zero_division=0, jaccard_zero_division=0, errors="raise"):
+    def compute(function, *args):
+        try:
+            return function(*args)
+        except ValueError as e:
+            if errors != "nan":
+                raise
+            print("Warning: ", e)
+            return None
+
+    y_true = np.asarray(y_true)
+    y_prob = probability_matrix(y_prob)
+    counts = compute(ConfusionCounts, y_true, y_pred)
+
+    # Metrics of the confusion counts are NaN if the counts could not be computed (the warning is printed once)
+    def from_counts(function, *args):
+        return None if counts is None else compute(function, counts, *args)
+
+    scores = {
+        "accuracy_score": from_counts(accuracy_score),
+        "log_loss": compute(log_loss, y_true, y_pred),
+        "hamming_loss": from_counts(hamming_loss),
+    }
+    for average in AVERAGES:
+        scores[f"f1_score__{average}"] = from_counts(f1_score, average, zero_division)
+        scores[f"precision_score__{average}"] = from_counts(precision_score, average, zero_division)
+        scores[f"recall_score__{average}"] = from_counts(recall_score, average, zero_division)
+        scores[f"jaccard_score__{average}"] = from_counts(jaccard_score, average, jaccard_zero_division)
+    scores["roc_auc_score"] = compute(roc_auc_score, y_true, y_prob)
+    scores["label_ranking_loss"] = compute(label_ranking_loss, y_true, y_prob)
+    scores["coverage_error"] = compute(coverage_error, y_true, y_prob)
+    return {name: np.nan if scores[name] is None else float(scores[name]) for name in METRIC_NAMES}
+
+class Metrics:
+    # Collects the scores of every fold, results are kept in a list and turned into a DataFrame when accessed
+    def __init__(self, repeats=2, folds=5, zero_division=0, jaccard_zero_division=0):
+        self.repeats = repeats
+        self.folds = folds
+        self.zero_division = zero_division
+        self.jaccard_zero_division = jaccard_zero_division
+        self.metric_names = METRIC_NAMES
+        self.i = 0
+        self.entries = []
+
+    def evaluate(self, y_true, y_prob, y_pred, model_training_data_path=None):
+        entry = {
+            'repeat': self.i // self.folds,
+            'fold': self.i % self.folds,
+            'model_training_data_path': model_training_data_path
+        }
+        # A metric that cannot be computed is NaN, the other metrics of the fold are kept
+        entry.update(multilabel_scores(y_true, y_prob, y_pred, self.zero_division, self.jaccard_zero_division, errors="nan"))
+        self.entries.append(entry)
+        self.i += 1
+
+    @property
+    def results(self):
+        return pd.DataFrame(self.entries, columns=['repeat', 'fold', 'model_training_data_path'] + self.metric_names)
+
+    def store(self, filename):
+        self.results.to_csv(filename, index=False)
+
+    def current(self, metric_name):
+        return self.entries[-1][metric_name]
+
@@ -0,0 +1,390 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from mass_spectra import instrumentation
+from mass_spectra.merge import DESCRIPTIVE_COLUMNS, merge_to_dataset
+from mass_spectra.preprocessing_cache import file_digest
+
+# Command line version of the pipeline notebooks (s0_embed, s3_train, s4_evaluate) as a DAG of stages
+# Every stage declares the files it reads and writes, a stage runs after the stages writing its inputs
+# The digests of the inputs and the parameters of every completed stage are kept in {output_folder}/pipeline_state.json,
+# a stage is skipped while they are unchanged and its outputs exist, so an interrupted run resumes where it stopped
+# Independent stages (e.g. fingerprint and preprocess/train_word2vec) run at the same time, every stage runs in its own
+# spawned process, so no stage forks a process hosting the JVM of another stage, and the CPUs (--workers) are split
+# between the --jobs stages running at once
+#
+# Files in the output folder:
+#   preprocessed.npz              - preprocessed spectra (preprocess)
+#   spec2vec.model                - word2vec model (train_word2vec, skipped when --model_file is given)
+#   fingerprint, spec2vec         - fingerprint and embedding stores (fingerprint, embed)
+#   fingerprint_selection.json    - bits kept by the bit selection (fingerprint)
+#   merged/                       - X/y training data (merge)
+#   model/{model}/                - fold models, metrics.csv and unseen_inchi_keys_metrics.csv (cv_train)
+#   model/{model}/evaluation.csv  - summary of the metrics (evaluate)
+
+STATE_FILE = 'pipeline_state.json'
+STAGES = ['fingerprint', 'preprocess', 'train_word2vec', 'embed', 'merge', 'cv_train', 'evaluate']
+MODELS = ['one_vs_rest_random_forest', 'multilabel_random_forest', 'multilabel_catboost']
+
+# function(**arguments) is run in a spawned process, so both have to be picklable (module level functions)
+class Stage:
+    def __init__(self, name, function, arguments, inputs, outputs, params=None):
+        self.name = name
+        self.function = function
+        self.arguments = arguments
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+
+def store_files(path):
+    return [f'{path}.npy', f'{path}.json', f'{path}.index.csv']
+
+# Digest of a file or of all files in a folder
+# Digests are remembered by size and modification time, so unchanged files are not hashed again
+def path_digest(path, known=None):
+    known = {} if known is None else known
+    if os.path.isdir(path):
+        digest = hashlib.sha256()
+        for root, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode('utf-8'))
+                digest.update(path_digest(file_path, known).encode('utf-8'))
+        return digest.hexdigest()
+
+    stat = os.stat(path)
+    signature = [stat.st_size, stat.st_mtime_ns]
+    cached = known.get(path)
+    if cached is None or cached['signature'] != signature:
+        known[path] = {'signature': signature, 'digest': file_digest(path)}
+    return known[path]['digest']
+
+class State:
+    def __init__(self, path):
+        self.path = path
+        self.data = {'stages': {}, 'files': {}}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    def signature(self, stage):
+        inputs = {path: path_digest(path, self.data['files']) for path in stage.inputs}
+        params = json.dumps(stage.params, sort_keys=True, default=str)
+        return {'inputs': inputs, 'params': hashlib.sha256(params.encode('utf-8')).hexdigest()}
+
+    def is_complete(self, stage, signature):
+        completed = self.data['stages'].get(stage.name)
+        return (completed is not None and completed['signature'] == signature
+                and all(os.path.exists(path) for path in stage.outputs))
+
+    # Written to a temporary file first, an interruption never leaves a broken state file behind
+    def complete(self, stage, signature):
+        self.data['stages'][stage.name] = {
+            'signature': signature,
+            'outputs': stage.outputs,
+            'completed': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(f'{self.path}.tmp', self.path)
+
+# Stages writing the inputs of every stage
+def dependencies(stages):
+    producers = {path: stage.name for stage in stages for path in stage.outputs}
+    return {stage.name: {producers[path] for path in stage.inputs if path in producers} for stage in stages}
+
+# Run the stages in dependency order with at most jobs stages at once
+# Stages not in selected (None for all) only have to be complete, forced stages run even if their inputs are unchanged
+def run_stages(stages, state, selected=None, force=(), jobs=2):
+    requires = dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    context = multiprocessing.get_context('spawn')
+    done, running = set(), {} # running: name -> (future, executor, signature)
+
+    def finish(name):
+        future, executor, signature = running.pop(name)
+        try:
+            result = future.result()
+        finally:
+            executor.shutdown()
+        instrumentation.merge(result['counts'], result['stages'])
+        state.complete(by_name[name], signature)
+        done.add(name)
+
+    try:
+        while len(done) < len(stages):
+            skipped = False
+            for name, stage in by_name.items():
+                if len(running) >= jobs:
+                    break
+                if name in done or name in running or not requires[name] <= done:
+                    continue
+                signature = state.signature(stage)
+                if name not in force and state.is_complete(stage, signature):
+                    print(f'Skipping {name}, inputs are unchanged')
+                    done.add(name)
+                    skipped = True
+                    continue
+                if selected is not None and name not in selected:
+                    raise RuntimeError(f'Stage {name} is not selected but its outputs are missing or out of date')
+                print(f'Running {name}')
+                # One process per stage, the executor is shut down when the stage is finished
+                executor = ProcessPoolExecutor(max_workers=1, mp_context=context)
+                running[name] = (executor.submit(run_stage, name, stage.function, stage.arguments), executor, signature)
+
+            if not running:
+                if skipped:
+                    continue
+                raise RuntimeError(f'Stages {sorted(set(by_name) - done)} wait for each other')
+
+            # Block until a stage finishes, a failed stage stops the run, completed stages are kept in the state
+            finished, _ = wait([future for future, _, _ in running.values()], return_when=FIRST_COMPLETED)
+            for name in [name for name, (future, _, _) in running.items() if future in finished]:
+                finish(name)
+    finally:
+        # Stages still running when another one failed are waited for, so their results are kept
+        for name in list(running):
+            try:
+                finish(name)
+            except Exception as e:
+                print(f'Stage {name} failed: {e}')
+
+# Runs in the spawned process of the stage, the counters and stage times of the process are the ones of the stage
+def run_stage(name, function, arguments):
+    instrumentation.configure_logging()
+    with instrumentation.stage(name):
+        function(**arguments)
+    return instrumentation.snapshot()
+
+# Metadata of the compounds with sanitised column names and values (s0_embed)
+def load_metadata(metadata_file):
+    metadata_df = pd.read_pickle(metadata_file).dropna(axis=0, how='any')
+    metadata_df = metadata_df.rename(columns={c: c.lower().strip().replace(' ', '_') for c in metadata_df.columns})
+    string_columns = metadata_df.columns[metadata_df.dtypes == 'object']
+    metadata_df[string_columns] = metadata_df[string_columns].apply(lambda c: c.map(lambda x: x.strip() if isinstance(x, str) else x))
+    return metadata_df.rename(columns={'inchikey': 'inchi_key'})
+
+def fingerprint(metadata_file, output_folder, fingerprints, remove_constant_bits, remove_duplicate_bits,
+                correlation_threshold, workers):
+    from mass_spectra.bit_selection import select_bits
+    from mass_spectra.store import save_fingerprints
+    from mass_spectra.to_fingerprint import generate_fingerprint
+
+    metadata_df = load_metadata(metadata_file)
+    source = metadata_df['inchi'].fillna(metadata_df['inchi_key'])
+    generated = generate_fingerprint(fingerprints, source, workers=workers)
+
+    # combine all generated fingerprints with prefixed column names
+    merged = None
+    for fp, fp_df in generated.items():
+        tmp = fp_df.set_index('inchi')
+        tmp.columns = [f'{fp.lower().replace("fingerprinter", "")}_{c}' for c in tmp.columns]
+        merged = tmp if merged is None else merged.join(tmp, how='inner')
+
+    bit_selection = select_bits(merged.dropna().astype('uint8'), remove_constant=remove_constant_bits,
+                                remove_duplicates=remove_duplicate_bits, correlation_threshold=correlation_threshold)
+    bit_selection.save(os.path.join(output_folder, 'fingerprint_selection.json'))
+    merged = bit_selection.apply(merged)
+
+    fingerprints_df = metadata_df[DESCRIPTIVE_COLUMNS].set_index('inchi').join(merged, how='inner').reset_index()
+    bit_columns = [c for c in fingerprints_df.columns if c not in DESCRIPTIVE_COLUMNS]
+    fingerprints_df = fingerprints_df[DESCRIPTIVE_COLUMNS + bit_columns].dropna(axis=0, how='any')
+    save_fingerprints(os.path.join(output_folder, 'fingerprint'), fingerprints_df[bit_columns].to_numpy(dtype='uint8'),
+                      fingerprints_df[DESCRIPTIVE_COLUMNS], bit_columns)
+
+def preprocess(spectra_file, preprocessed_file, workers):
+    from mass_spectra.preprocessing_cache import save_spectra
+    from mass_spectra.train_spec2vec import load_from_mgf, preprocess_spectra
+
+    save_spectra(preprocessed_file, list(preprocess_spectra(load_from_mgf(spectra_file), False, workers=workers)))
+
+def load_documents(preprocessed_file):
+    from spec2vec import SpectrumDocument
+
+    from mass_spectra.preprocessing_cache import load_spectra
+    from mass_spectra.train_spec2vec import N_DECIMALS
+
+    return [SpectrumDocument(s, n_decimals=N_DECIMALS) for s in load_spectra(preprocessed_file)]
+
+def train_word2vec(preprocessed_file, model_file, epochs, workers):
+    from spec2vec.model_building import train_new_word2vec_model
+
+    model = train_new_word2vec_model(load_documents(preprocessed_file), iterations=epochs, workers=workers, progress_logger=True)
+    model.save(model_file)
+
+def embed(metadata_file, preprocessed_file, model_file, output_folder):
+    import gensim
+
+    from mass_spectra.embedding import embed_documents
+    from mass_spectra.store import save_embeddings
+
+    documents = load_documents(preprocessed_file)
+    model = gensim.models.Word2Vec.load(model_file)
+    embedding_df = pd.DataFrame(embed_documents(model, documents), columns=[str(i) for i in range(model.wv.vector_size)])
+    embedding_df.index = pd.Index([s.metadata.get('inchikey') for s in documents], name='inchi_key')
+
+    descriptive_data = load_metadata(metadata_file)[DESCRIPTIVE_COLUMNS].set_index('inchi_key')
+    embedding_df = descriptive_data.join(embedding_df, how='inner').reset_index()
+    columns = [c for c in embedding_df.columns if c not in DESCRIPTIVE_COLUMNS]
+    save_embeddings(os.path.join(output_folder, 'spec2vec'), embedding_df[columns].to_numpy(),
+                    embedding_df[DESCRIPTIVE_COLUMNS], columns)
+
+# Models trained by cv_train (the options of s3_train)
+def create_model(name, random_state):
+    if name == 'one_vs_rest_random_forest':
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.multiclass import OneVsRestClassifier
+        return OneVsRestClassifier(RandomForestClassifier(n_estimators=100, random_state=random_state), n_jobs=-1)
+
+    from wrappers.multilabel import MultiLabel
+    if name == 'multilabel_random_forest':
+        return MultiLabel('random_forest', n_estimators=100, thread_count=-1, random_state=random_state)
+    if name == 'multilabel_catboost':
+        return MultiLabel('catboost', iterations=500, learning_rate=0.1, thread_count=-1, early_stopping_rounds=50, random_state=random_state)
+    raise ValueError(f'Unknown model {name}, options are: {MODELS}')
+
+def cv_train(merged_folder, model_folder, model_name, repeats, k, hidden_inchi_keys, random_state, workers):
+    from mass_spectra.cross_validation import cross_validate, group_splits, kfold_splits
+    from mass_spectra.metrics import Metrics
+    from mass_spectra.store import load_dataset
+
+    X, y, merged_df = load_dataset(merged_folder)
+    model = create_model(model_name, random_state)
+
+    metrics = Metrics(repeats, k)
+    cross_validate(model, X, y, kfold_splits(len(X), repeats, k, random_state), metrics,
+                   output_folder=os.path.join(model_folder, 'models'), workers=workers)
+    metrics.store(os.path.join(model_folder, 'metrics.csv'))
+
+    # Every split hides hidden_inchi_keys InChI keys, so the model is tested on compounds it has not seen
+    all_inchi_key_ids = list(range(merged_df['inchi_key_id'].max() + 1))
+    random.Random(random_state).shuffle(all_inchi_key_ids)
+    splits = list(group_splits(merged_df['inchi_key_id'], all_inchi_key_ids, hidden_inchi_keys))
+    metrics = Metrics(1, max(len(splits), 1))
+    cross_validate(model, X, y, splits, metrics,
+                   output_folder=os.path.join(model_folder, 'unseen_inchi_keys_models'), workers=workers)
+    metrics.store(os.path.join(model_folder, 'unseen_inchi_keys_metrics.csv'))
+
+def evaluate(model_folder):
+    summaries = {name: pd.read_csv(os.path.join(model_folder, f'{name}.csv')).drop(columns=['repeat', 'fold', 'model_training_data_path']).describe()
+                 for name in ('metrics', 'unseen_inchi_keys_metrics')}
+    pd.concat(summaries, names=['split', 'statistic']).to_csv(os.path.join(model_folder, 'evaluation.csv'))
+
+def preprocessing_settings():
+    from mass_spectra.train_spec2vec import preprocessing_settings
+    return preprocessing_settings()
+
+# Stages of a run, the model is trained by train_word2vec unless --model_file is given
+def build_stages(args):
+    out = args.output_folder
+    preprocessed_file = os.path.join(out, 'preprocessed.npz')
+    model_file = args.model_file or os.path.join(out, 'spec2vec.model')
+    merged_folder = os.path.join(out, 'merged')
+    model_folder = os.path.join(out, 'model', args.model)
+    fingerprint_store = os.path.join(out, 'fingerprint')
+    embedding_store = os.path.join(out, 'spec2vec')
+
+    # The CPUs are split between the stages that can run at the same time
+    workers = max(1, args.workers // args.jobs)
+    stages = [
+        Stage('fingerprint', fingerprint,
+              {'metadata_file': args.metadata, 'output_folder': out, 'fingerprints': args.fingerprints,
+               'remove_constant_bits': not args.keep_constant_bits, 'remove_duplicate_bits': not args.keep_duplicate_bits,
+               'correlation_threshold': args.correlation_threshold, 'workers': workers},
+              [args.metadata], store_files(fingerprint_store) + [os.path.join(out, 'fingerprint_selection.json')],
+              {'fingerprints': args.fingerprints, 'keep_constant_bits': args.keep_constant_bits,
+               'keep_duplicate_bits': args.keep_duplicate_bits, 'correlation_threshold': args.correlation_threshold}),
+        Stage('preprocess', preprocess, {'spectra_file': args.spectra, 'preprocessed_file': preprocessed_file, 'workers': workers},
+              [args.spectra], [preprocessed_file], {'settings': preprocessing_settings()}),
+        Stage('embed', embed,
+              {'metadata_file': args.metadata, 'preprocessed_file': preprocessed_file, 'model_file': model_file, 'output_folder': out},
+              [args.metadata, preprocessed_file, model_file], store_files(embedding_store)),
+        Stage('merge', merge_to_dataset,
+              {'embedding_path': embedding_store, 'fingerprint_path': fingerprint_store, 'folder': merged_folder},
+              store_files(fingerprint_store) + store_files(embedding_store), [merged_folder]),
+        Stage('cv_train', cv_train,
+              {'merged_folder': merged_folder, 'model_folder': model_folder, 'model_name': args.model, 'repeats': args.repeats,
+               'k': args.k, 'hidden_inchi_keys': args.hidden_inchi_keys, 'random_state': args.random_state,
+               'workers': args.cv_workers},
+              [merged_folder], [os.path.join(model_folder, 'metrics.csv'), os.path.join(model_folder, 'unseen_inchi_keys_metrics.csv')],
+              {'model': args.model, 'repeats': args.repeats, 'k': args.k, 'hidden_inchi_keys': args.hidden_inchi_keys,
+               'random_state': args.random_state}),
+        Stage('evaluate', evaluate, {'model_folder': model_folder},
+              [os.path.join(model_folder, 'metrics.csv'), os.path.join(model_folder, 'unseen_inchi_keys_metrics.csv')],
+              [os.path.join(model_folder, 'evaluation.csv')]),
+    ]
+    if args.model_file is None:
+        stages.insert(2, Stage('train_word2vec', train_word2vec,
+                               {'preprocessed_file': preprocessed_file, 'model_file': model_file, 'epochs': args.epochs, 'workers': workers},
+                               [preprocessed_file], [model_file], {'epochs': args.epochs}))
+    return stages
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the pipeline from spectra and compound metadata to evaluated models')
+
+    parser.add_argument('metadata', type=str,
+                        help='Path to the compound metadata (.pkl)')
+    parser.add_argument('spectra', type=str,
+                        help='Path to the spectra (.mgf)')
+    parser.add_argument('output_folder', type=str,
+                        help='Folder all stages write to, also holds the pipeline state')
+    parser.add_argument('--model_file', type=str, default=None,
+                        help='Use this spec2vec model instead of training a new one')
+    parser.add_argument('--fingerprints', type=str, nargs='+',
+                        default=['EStateFingerprinter', 'MACCSFingerprinter', 'PubchemFingerprinter', 'SubstructureFingerprinter'],
+                        help='Fingerprints to generate')
+    parser.add_argument('--keep_constant_bits', action='store_true',
+                        help='Keep fingerprint bits with the same value for every compound')
+    parser.add_argument('--keep_duplicate_bits', action='store_true',
+                        help='Keep fingerprint bits equal to an earlier bit')
+    parser.add_argument('--correlation_threshold', type=float, default=None,
+                        help='Also remove bits with at least this absolute correlation to a kept bit')
+    parser.add_argument('--epochs', type=int, default=25,
+                        help='Number of word2vec epochs (default: 25)')
+    parser.add_argument('--model', type=str, default='one_vs_rest_random_forest', choices=MODELS,
+                        help='Model trained in cross validation (default: one_vs_rest_random_forest)')
+    parser.add_argument('--repeats', type=int, default=2,
+                        help='Number of repeats of the k-fold cross validation (default: 2)')
+    parser.add_argument('--k', type=int, default=5,
+                        help='Number of folds (default: 5)')
+    parser.add_argument('--hidden_inchi_keys', type=int, default=10,
+                        help='Number of InChI keys hidden in every split of the unseen InChI keys validation (default: 10)')
+    parser.add_argument('--random_state', type=int, default=27082023,
+                        help='Seed of the splits and models')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='Number of CPUs for preprocessing, word2vec training and fingerprints (each fingerprint worker '
+                             'starts its own JVM), split between the stages run at the same time (default: number of CPUs)')
+    parser.add_argument('--cv_workers', type=int, default=1,
+                        help='Number of folds trained in parallel (default: 1)')
+    parser.add_argument('--jobs', type=int, default=2,
+                        help='Number of independent stages run at the same time, each in its own process (default: 2)')
+    parser.add_argument('--stages', type=str, nargs='+', default=None, choices=STAGES,
+                        help='Only run these stages, the stages they depend on must be complete')
+    parser.add_argument('--force', type=str, nargs='+', default=[], choices=STAGES,
+                        help='Run these stages even if their inputs are unchanged')
+    instrumentation.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    if not args.metadata.endswith('.pkl'):
+        parser.error('Metadata must be a pkl file')
+    if not args.spectra.endswith('.mgf'):
+        parser.error('Spectra must be a mgf file')
+    if args.jobs < 1:
+        parser.error('Jobs must be at least 1')
+    if args.model_file is not None and not os.path.isfile(args.model_file):
+        parser.error(f'Model file {args.model_file} does not exist')
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    with instrumentation.run('pipeline', args.metrics_file, args.profile):
+        run_stages(build_stages(args), State(os.path.join(args.output_folder, STATE_FILE)),
+                   selected=args.stages, force=set(args.force), jobs=args.jobs)
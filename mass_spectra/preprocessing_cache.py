@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Bump when the on-disk layout of the cache files changes
+CACHE_FORMAT_VERSION = 1
+
+# Hash the content of a file in blocks so large MGF files are never fully loaded
+def file_digest(file_path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Cache key of a file is the hash of its content combined with the preprocessing settings
+# Pass digest when the file_digest of the file is already known, so the file is not read again
+def cache_key(file_path, settings, digest=None):
+    key = {
+        "file": file_digest(file_path) if digest is None else digest,
+        "settings": settings,
+        "format": CACHE_FORMAT_VERSION,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+def cache_path(cache_folder, key):
+    return os.path.join(cache_folder, f"{key}.npz")
+
+# Convert numpy scalars in the metadata to plain python values
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+# Concatenate the fragments of all spectra into one column, offsets mark where each spectrum starts
+def _pack_fragments(fragments):
+    lengths = [0 if f is None else len(f.mz) for f in fragments]
+    offsets = np.zeros(len(fragments) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    mz = np.concatenate([f.mz for f in fragments if f is not None] or [np.empty(0)])
+    intensities = np.concatenate([f.intensities for f in fragments if f is not None] or [np.empty(0)])
+    return mz.astype(np.float64), intensities.astype(np.float64), offsets
+
+# Store preprocessed spectra as flat peak/loss columns plus a JSON encoded metadata blob
+def save_spectra(path, spectra):
+    peaks_mz, peaks_intensities, peaks_offsets = _pack_fragments([s.peaks for s in spectra])
+    losses_mz, losses_intensities, losses_offsets = _pack_fragments([s.losses for s in spectra])
+    has_losses = np.array([s.losses is not None for s in spectra], dtype=bool)
+    metadata = json.dumps([s.metadata for s in spectra], default=_json_default).encode("utf-8")
+
+    # Write to a temporary file first so an interrupted run never leaves a broken cache entry behind
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f,
+                 peaks_mz=peaks_mz, peaks_intensities=peaks_intensities, peaks_offsets=peaks_offsets,
+                 losses_mz=losses_mz, losses_intensities=losses_intensities, losses_offsets=losses_offsets,
+                 has_losses=has_losses, metadata=np.frombuffer(metadata, dtype=np.uint8))
+    os.replace(tmp_path, path)
+
+# Load spectra stored with save_spectra
+def load_spectra(path):
+    from matchms import Fragments, Spectrum
+
+    with np.load(path, allow_pickle=False) as data:
+        peaks_mz, peaks_intensities, peaks_offsets = data["peaks_mz"], data["peaks_intensities"], data["peaks_offsets"]
+        losses_mz, losses_intensities, losses_offsets = data["losses_mz"], data["losses_intensities"], data["losses_offsets"]
+        has_losses = data["has_losses"]
+        metadata = json.loads(data["metadata"].tobytes().decode("utf-8"))
+
+    spectra = []
+    for i, m in enumerate(metadata):
+        start, end = peaks_offsets[i], peaks_offsets[i + 1]
+        s = Spectrum(mz=peaks_mz[start:end], intensities=peaks_intensities[start:end],
+                     metadata=m, metadata_harmonization=False)
+        if has_losses[i]:
+            start, end = losses_offsets[i], losses_offsets[i + 1]
+            s.losses = Fragments(mz=losses_mz[start:end], intensities=losses_intensities[start:end])
+        spectra.append(s)
+    return spectra
+
+# Return the cached spectra for the file, or compute them with compute() and store them in the cache
+# key is the cache_key of the file, computed from file_path and settings when not given
+def load_or_compute(file_path, cache_folder, settings, compute, key=None):
+    path = cache_path(cache_folder, cache_key(file_path, settings) if key is None else key)
+    if os.path.isfile(path):
+        print(f"Using cached preprocessing of {os.path.basename(file_path)}")
+        return load_spectra(path)
+
+    spectra = compute()
+    save_spectra(path, spectra)
+    return spectra
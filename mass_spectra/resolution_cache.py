@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared on-disk cache for identifier resolution (InChI key -> InChI, InChI -> SMILES, ...)
+# Successful lookups and known misses are both stored, misses expire after NEGATIVE_TTL seconds so they are retried eventually
+# The MASS_SPECTRA_RESOLUTION_CACHE environment variable (read when a cache is opened) moves the cache file
+CACHE_FILE = './source/compounds/resolution_cache.sqlite'
+POSITIVE_TTL = None # successful lookups never expire
+NEGATIVE_TTL = 7 * 24 * 60 * 60
+
+# Returned by the cache for keys it knows nothing about (None is a cached miss)
+NOT_CACHED = object()
+
+class ResolutionCache:
+    def __init__(self, path=None, ttl=POSITIVE_TTL, negative_ttl=NEGATIVE_TTL):
+        if path is None:
+            path = os.environ.get('MASS_SPECTRA_RESOLUTION_CACHE', CACHE_FILE)
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS resolutions (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                created REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )''')
+        self._connection.commit()
+
+    def _expired(self, value, created, now):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        return ttl is not None and now - created > ttl
+
+    def get(self, namespace, key):
+        return self.get_many(namespace, [key]).get(key, NOT_CACHED)
+
+    # Returns {key: value} for all cached keys, value is None for cached misses
+    def get_many(self, namespace, keys):
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        found = {}
+        with self._lock:
+            # sqlite limits the number of query parameters, so keys are queried in batches
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._connection.execute(
+                    f'SELECT key, value, created FROM resolutions WHERE namespace = ? AND key IN ({",".join("?" * len(batch))})',
+                    [namespace, *batch]).fetchall()
+                for key, value, created in rows:
+                    if not self._expired(value, created, now):
+                        found[key] = value
+        return found
+
+    def set(self, namespace, key, value):
+        self.set_many(namespace, {key: value})
+
+    # Store {key: value}, a value of None marks a known miss
+    def set_many(self, namespace, values):
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO resolutions (namespace, key, value, created) VALUES (?, ?, ?, ?)',
+                [(namespace, key, value, now) for key, value in values.items()])
+            self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+# HTTP session with a connection pool and exponential backoff for rate limits and unavailable servers
+def create_session(retries=5, backoff_factor=0.5, pool_size=16):
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(429, 502, 503, 504),
+                  allowed_methods=frozenset(['GET']), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+_default_cache = None
+_default_session = None
+
+# Cache and session shared by all resolvers of the process
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResolutionCache()
+    return _default_cache
+
+def default_session():
+    global _default_session
+    if _default_session is None:
+        _default_session = create_session()
+    return _default_session
+
+class Resolver:
+    # namespace: name under which the results are cached
+    # url_format: url with a {key} placeholder for the (url quoted) key
+    # parse: function converting a successful response to a value, None if the response contains no value
+    # miss_statuses: status codes meaning the key can not be resolved, these are cached as misses
+    # Other failures (timeouts, exhausted retries) are not cached and resolve to None
+    def __init__(self, namespace, url_format, parse, cache=None, session=None, timeout=30, workers=8, miss_statuses=(400, 404)):
+        self.namespace = namespace
+        self.url_format = url_format
+        self.parse = parse
+        self.cache = cache if cache is not None else default_cache()
+        self.session = session if session is not None else default_session()
+        self.timeout = timeout
+        self.workers = workers
+        self.miss_statuses = miss_statuses
+
+    def _fetch(self, key):
+        url = self.url_format.format(key=quote(str(key), safe=''))
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            print(f'Warning: request to {url} failed: {e}')
+            return NOT_CACHED
+        if response.status_code in self.miss_statuses:
+            return None
+        if response.status_code != 200:
+            print(f'Warning: request to {url} returned status {response.status_code}')
+            return NOT_CACHED
+        return self.parse(response)
+
+    def resolve(self, key):
+        return self.resolve_many([key])[key]
+
+    # Resolve a batch of keys, only keys missing from the cache are requested (concurrently, over the pooled session)
+    def resolve_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        resolved = self.cache.get_many(self.namespace, keys)
+        missing = [k for k in keys if k not in resolved]
+
+        if len(missing) > 0:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(missing))) as executor:
+                fetched = dict(zip(missing, executor.map(self._fetch, missing)))
+            fetched = {k: v for k, v in fetched.items() if v is not NOT_CACHED}
+            self.cache.set_many(self.namespace, fetched)
+            resolved.update(fetched)
+        return {k: resolved.get(k) for k in keys}
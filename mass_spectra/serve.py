@@ -0,0 +1,243 @@
+import argparse
+import io
+import json
+import pickle
+import queue
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+import numpy as np
+
+from mass_spectra.embedding import embed_documents
+from mass_spectra.metrics import probability_matrix
+from mass_spectra.train_spec2vec import convert_to_document, load_from_mgf, metadata_processing, peak_processing
+
+# Long running fingerprint prediction service
+# The trained model and the spec2vec model are loaded once, spectra are then predicted in micro-batches:
+# preprocessing -> spec2vec embedding -> predict_proba -> fingerprint bits
+# Requests are parsed and preprocessed on their own handler thread, the documents of concurrent requests are then
+# grouped by a collector thread into batches of up to batch_size spectra, a batch is started at the latest max_wait
+# seconds after its first request arrived
+
+
+# Load a model pickled by s3_train (a fold file with "model", "X_train", ... keys) or a plain pickled model
+def load_model(model_file):
+    with open(model_file, "rb") as f:
+        model = pickle.load(f)
+    if isinstance(model, dict):
+        model = model["model"]
+    return model
+
+
+class FingerprintPredictor:
+    def __init__(self, model_file, spec2vec_model_file, columns=None, batch_size=256, max_wait=0.01, threshold=0.5,
+                 intensity_weighting_power=0, allowed_missing_percentage=10):
+        import gensim
+
+        self.model = load_model(model_file)
+        self.spec2vec_model = gensim.models.Word2Vec.load(spec2vec_model_file)
+        self.columns = columns
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.threshold = threshold
+        # Embedding settings have to match the ones used to embed the training data (calc_vector defaults)
+        self.intensity_weighting_power = intensity_weighting_power
+        self.allowed_missing_percentage = allowed_missing_percentage
+        self.requests = queue.Queue()
+        self.collector = None
+        self.collector_lock = threading.Lock()
+
+    # Returns the spectra of an mgf file (path or file object) and the time spent loading them
+    def load_mgf(self, source):
+        start = perf_counter()
+        spectra = list(load_from_mgf(source))
+        return spectra, {"loading": perf_counter() - start}
+
+    # Returns the documents of the spectra accepted by preprocessing and their positions in spectra
+    def preprocess(self, spectra):
+        start = perf_counter()
+        documents, positions = [], []
+        for i, s in enumerate(spectra):
+            s = peak_processing(metadata_processing(s))
+            if s is None or len(s.intensities) == 0:
+                continue
+            documents.append(convert_to_document(s))
+            positions.append(i)
+        return documents, positions, {"preprocessing": perf_counter() - start}
+
+    # Returns the probability matrix of the documents, the model is called with at most batch_size documents at once
+    def predict_documents(self, documents):
+        latency = {}
+
+        start = perf_counter()
+        embeddings = embed_documents(self.spec2vec_model, documents, self.intensity_weighting_power, self.allowed_missing_percentage)
+        latency["embedding"] = perf_counter() - start
+
+        start = perf_counter()
+        probabilities = [probability_matrix(self.model.predict_proba(embeddings[b:b + self.batch_size]))
+                         for b in range(0, len(embeddings), self.batch_size)]
+        probabilities = np.vstack(probabilities) if len(probabilities) > 0 else np.empty((0, 0))
+        latency["prediction"] = perf_counter() - start
+        return probabilities, latency
+
+    # One result per input spectrum, spectra rejected by preprocessing get a result with "error" set
+    def format_results(self, n_spectra, documents, positions, probabilities):
+        results = [{"index": i, "error": "spectrum rejected by preprocessing"} for i in range(n_spectra)]
+        for position, document, p in zip(positions, documents, probabilities):
+            bits = np.flatnonzero(p > self.threshold)
+            results[position] = {
+                "index": position,
+                "title": document.metadata.get("title"),
+                "inchikey": document.metadata.get("inchikey"),
+                "bits": [self.columns[b] for b in bits] if self.columns is not None else bits.tolist(),
+            }
+        return results
+
+    # Predict the documents in a batch shared with concurrent requests
+    # Returns a future of (probabilities, latency), latency includes the time spent waiting for the batch ("queue")
+    def submit(self, documents):
+        future = Future()
+        if len(documents) == 0:
+            future.set_result(self.predict_documents(documents))
+            return future
+        with self.collector_lock:
+            if self.collector is None:
+                self.collector = threading.Thread(target=self._collect, name="fingerprint-batches", daemon=True)
+                self.collector.start()
+        self.requests.put((documents, future, perf_counter()))
+        return future
+
+    def _collect(self):
+        while True:
+            pending = [self.requests.get()]
+            size = len(pending[0][0])
+            deadline = perf_counter() + self.max_wait
+            while size < self.batch_size:
+                try:
+                    request = self.requests.get(timeout=max(deadline - perf_counter(), 0))
+                except queue.Empty:
+                    break
+                pending.append(request)
+                size += len(request[0])
+            self._predict_batch(pending)
+
+    def _predict_batch(self, pending):
+        start = perf_counter()
+        documents = [d for request_documents, _, _ in pending for d in request_documents]
+        try:
+            probabilities, latency = self.predict_documents(documents)
+        except Exception as e:
+            for _, future, _ in pending:
+                future.set_exception(e)
+            return
+        offset = 0
+        for request_documents, future, queued in pending:
+            future.set_result((probabilities[offset:offset + len(request_documents)], {"queue": start - queued, **latency}))
+            offset += len(request_documents)
+
+    # Returns one result per input spectrum and the time spent in every stage (seconds)
+    # batched=True shares the model call with concurrent requests
+    def predict_spectra(self, spectra, batched=False):
+        documents, positions, latency = self.preprocess(spectra)
+        if batched:
+            probabilities, prediction_latency = self.submit(documents).result()
+        else:
+            probabilities, prediction_latency = self.predict_documents(documents)
+        return self.format_results(len(spectra), documents, positions, probabilities), {**latency, **prediction_latency}
+
+    def predict_mgf(self, source, batched=False):
+        spectra, latency = self.load_mgf(source)
+        results, prediction_latency = self.predict_spectra(spectra, batched=batched)
+        return results, {**latency, **prediction_latency}
+
+
+def create_server(predictor, host="127.0.0.1", port=8080):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok"})
+            else:
+                self._send(404, {"error": "not found"})
+
+        # POST /predict with the content of an MGF file as body
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send(404, {"error": "not found"})
+                return
+            # Invalid requests (body, mgf or spectra) are answered with 400, failures of the models with 500
+            try:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                spectra, latency = predictor.load_mgf(io.StringIO(body))
+                documents, positions, preprocessing_latency = predictor.preprocess(spectra)
+            except Exception as e:
+                self._send(400, {"error": str(e)})
+                return
+            try:
+                probabilities, prediction_latency = predictor.submit(documents).result()
+            except Exception as e:
+                self._send(500, {"error": str(e)})
+                return
+            results = predictor.format_results(len(spectra), documents, positions, probabilities)
+            self._send(200, {"predictions": results, "latency": {**latency, **preprocessing_latency, **prediction_latency}})
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Predict fingerprints of spectra with a trained model')
+
+    parser.add_argument('model_file', type=str,
+                        help='Path to the pickled model (or a fold file from s3_train)')
+    parser.add_argument('spec2vec_model_file', type=str,
+                        help='Path to the spec2vec model used to embed the training data')
+    parser.add_argument('--columns', type=str, default=None,
+                        help='Path to the fingerprint store (e.g. merged/y) with the names of the predicted bits')
+    parser.add_argument('--input', type=str, default=None,
+                        help='Predict this mgf file and exit instead of starting the server')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Where to write the predictions of --input (default: stdout)')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Host to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='Port to listen on (default: 8080)')
+    parser.add_argument('--batch_size', type=int, default=256,
+                        help='Number of spectra passed to the model at once (default: 256)')
+    parser.add_argument('--max_wait', type=float, default=0.01,
+                        help='Seconds a request waits for other requests to fill its batch (default: 0.01)')
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help='Probability above which a bit is set (default: 0.5)')
+
+    args = parser.parse_args()
+
+    columns = None
+    if args.columns is not None:
+        from mass_spectra.store import load
+        columns = load(args.columns, packed=True)[2]['columns']
+
+    start = perf_counter()
+    predictor = FingerprintPredictor(args.model_file, args.spec2vec_model_file, columns=columns,
+                                     batch_size=args.batch_size, max_wait=args.max_wait, threshold=args.threshold)
+    print(f"Models loaded in {perf_counter() - start:.2f}s")
+
+    if args.input is not None:
+        results, latency = predictor.predict_mgf(args.input)
+        output = json.dumps({"predictions": results, "latency": latency}, indent=2)
+        if args.output is None:
+            print(output)
+        else:
+            with open(args.output, "w") as f:
+                f.write(output)
+    else:
+        server = create_server(predictor, args.host, args.port)
+        print(f"Serving on http://{args.host}:{server.server_port} (POST /predict with an mgf body)")
+        server.serve_forever()
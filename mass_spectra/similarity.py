@@ -0,0 +1,142 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+from spec2vec import SpectrumDocument
+
+from mass_spectra import knn_index
+from mass_spectra.embedding import embed_documents
+from mass_spectra.knn_index import normalize
+
+# Blocked all-vs-all spec2vec cosine similarity
+# Queries are split into blocks of query_block_size rows which are scored on worker processes against tiles of
+# reference_block_size references, so memory stays bounded by the tile size instead of n_queries x n_references
+# Only the top_k matches per query and/or the matches with score >= threshold are kept in a sparse matrix,
+# the full matrix can additionally be spilled to a memory mapped .npy file with dense_file
+
+
+class SimilarityScores:
+    # Similarity scores of queries (rows) against references (columns)
+    # matrix is a scipy sparse matrix, or a memory mapped dense matrix if the scores were spilled to disk
+    def __init__(self, references, queries, matrix, reference_embeddings, query_embeddings):
+        self.references = references
+        self.queries = queries
+        self.matrix = matrix
+        self.reference_embeddings = reference_embeddings
+        self.query_embeddings = query_embeddings
+        self._query_positions = {id(q): i for i, q in enumerate(queries)}
+
+    def _query_index(self, query):
+        if isinstance(query, (int, np.integer)):
+            return int(query)
+        if id(query) not in self._query_positions:
+            raise ValueError('Query is not one of the scored queries')
+        return self._query_positions[id(query)]
+
+    # List of (reference, score) for the stored matches of the query (a query object or its position)
+    def scores_by_query(self, query, sort=False):
+        row = self._query_index(query)
+        if sparse.issparse(self.matrix):
+            row_matrix = self.matrix.getrow(row)
+            columns, scores = row_matrix.indices, row_matrix.data
+        else:
+            columns = np.arange(self.matrix.shape[1])
+            scores = np.asarray(self.matrix[row])
+        if sort:
+            order = np.argsort(-scores, kind='stable')
+            columns, scores = columns[order], scores[order]
+        return [(self.references[c], float(s)) for c, s in zip(columns, scores)]
+
+    # Exact dense scores of a rectangular part of the matrix, computed from the stored embeddings
+    def submatrix(self, query_slice, reference_slice=None):
+        reference_slice = query_slice if reference_slice is None else reference_slice
+        return self.query_embeddings[query_slice] @ self.reference_embeddings[reference_slice].T
+
+
+def _score_block(query_file, reference_file, start, end, k, threshold, reference_block_size, dense_file):
+    queries = np.asarray(np.load(query_file, mmap_mode='r')[start:end])
+    references = np.load(reference_file, mmap_mode='r')
+    dense = np.load(dense_file, mmap_mode='r+') if dense_file is not None else None
+
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    best_indices = np.empty((len(queries), 0), dtype=np.int64)
+    rows, columns, values = [], [], []
+    for reference_start in range(0, len(references), reference_block_size):
+        tile = queries @ np.asarray(references[reference_start:reference_start + reference_block_size]).T
+        if dense is not None:
+            dense[start:end, reference_start:reference_start + tile.shape[1]] = tile
+        if k is not None:
+            merged_indices = np.hstack([best_indices, np.broadcast_to(np.arange(reference_start, reference_start + tile.shape[1]), tile.shape)])
+            best_scores, positions = knn_index.top_k(np.hstack([best_scores, tile]), k)
+            best_indices = np.take_along_axis(merged_indices, positions, axis=1)
+        elif threshold is not None:
+            r, c = np.nonzero(tile >= threshold)
+            rows.append(r + start)
+            columns.append(c + reference_start)
+            values.append(tile[r, c])
+
+    if dense is not None:
+        dense.flush()
+    if k is not None:
+        keep = best_scores >= threshold if threshold is not None else np.ones(best_scores.shape, dtype=bool)
+        r, c = np.nonzero(keep)
+        return r + start, best_indices[r, c], best_scores[r, c]
+    if threshold is not None:
+        return np.concatenate(rows), np.concatenate(columns), np.concatenate(values)
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+
+def _to_documents(spectra, n_decimals):
+    return [s if isinstance(s, SpectrumDocument) else SpectrumDocument(s, n_decimals=n_decimals) for s in spectra]
+
+
+def calculate_scores_blocked(references, queries=None, model=None, intensity_weighting_power=0.5,
+                             allowed_missing_percentage=5.0, top_k=None, threshold=None, dense_file=None,
+                             query_block_size=1024, reference_block_size=8192, workers=1, n_decimals=2):
+    # references/queries: spectra or SpectrumDocuments, queries default to the references (all-vs-all)
+    # model: spec2vec Word2Vec model
+    if top_k is None and threshold is None and dense_file is None:
+        raise ValueError('Set top_k, threshold or dense_file, otherwise the full score matrix would have to be kept in memory')
+    queries = references if queries is None else queries
+
+    reference_embeddings = normalize(embed_documents(model, _to_documents(references, n_decimals),
+                                                     intensity_weighting_power, allowed_missing_percentage))
+    query_embeddings = reference_embeddings if queries is references else normalize(
+        embed_documents(model, _to_documents(queries, n_decimals), intensity_weighting_power, allowed_missing_percentage))
+
+    if dense_file is not None:
+        os.makedirs(os.path.dirname(dense_file) or '.', exist_ok=True)
+        dense = np.lib.format.open_memmap(dense_file, mode='w+', dtype=np.float32, shape=(len(queries), len(references)))
+        del dense
+
+    # Nothing to score, blocks and the top_k selection need at least one query and one reference
+    if len(queries) == 0 or len(references) == 0:
+        if top_k is None and threshold is None:
+            matrix = np.load(dense_file, mmap_mode='r')
+        else:
+            matrix = sparse.csr_matrix((len(queries), len(references)), dtype=np.float32)
+        return SimilarityScores(references, queries, matrix, reference_embeddings, query_embeddings)
+
+    with tempfile.TemporaryDirectory() as folder:
+        # Workers read the embeddings from memory mapped files instead of receiving copies
+        query_file = os.path.join(folder, 'queries.npy')
+        reference_file = os.path.join(folder, 'references.npy')
+        np.save(query_file, query_embeddings)
+        np.save(reference_file, reference_embeddings)
+
+        blocks = [(start, min(start + query_block_size, len(queries))) for start in range(0, len(queries), query_block_size)]
+        arguments = [(query_file, reference_file, start, end, top_k, threshold, reference_block_size, dense_file) for start, end in blocks]
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_score_block, *zip(*arguments)))
+        else:
+            results = [_score_block(*a) for a in arguments]
+
+    if top_k is None and threshold is None:
+        matrix = np.load(dense_file, mmap_mode='r')
+    else:
+        rows, columns, values = (np.concatenate(r) for r in zip(*results))
+        matrix = sparse.csr_matrix((values, (rows, columns)), shape=(len(queries), len(references)))
+    return SimilarityScores(references, queries, matrix, reference_embeddings, query_embeddings)
@@ -1,44 +1,92 @@
+import numpy as np
 from gensim.models import Word2Vec
-from matchms import Spectrum, calculate_scores
-from spec2vec import Spec2Vec
+from scipy import sparse
+from spec2vec import Spec2Vec, SpectrumDocument
+
+from mass_spectra.embedding import embed_documents
+from mass_spectra.knn_index import CosineIndex, normalize
 
 
 class SimilarityVoting:
-    def __init__(self, spec2vec_model_file, intensity_weighting_power=0.5, allowed_missing_percentage=5.0):
+    # Predicts targets of unknown spectra from the similarities to the known spectra
+    # vote='sum' (default) returns the similarity weighted sum of the targets, with k=None over all known spectra,
+    # which are the scores of the original all-vs-all implementation (similarities.dot(y))
+    # vote='mean' returns the weighted mean of the targets with only positive similarities voting, a probability in [0, 1]
+    # k limits the vote to the k most similar known spectra, n_lists enables the approximate (inverted file) index
+    # with n_probe clusters searched per query
+    VOTES = ('sum', 'mean')
+
+    def __init__(self, spec2vec_model_file, intensity_weighting_power=0.5, allowed_missing_percentage=5.0,
+                 k=None, vote='sum', n_lists=None, n_probe=8):
+        if vote not in self.VOTES:
+            raise ValueError(f'Unknown vote {vote}. Options are: {self.VOTES}')
+        self.spec2vec_model_file = spec2vec_model_file
         model = Word2Vec.load(spec2vec_model_file)
         self.spec2vec = Spec2Vec(model=model, intensity_weighting_power=intensity_weighting_power,
                                  allowed_missing_percentage=allowed_missing_percentage)
+        self.k = k
+        self.vote = vote
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+
+    # Spectra and SpectrumDocuments are embedded with the spec2vec model, a 2D float array is used as embeddings directly
+    def _embed(self, X):
+        if isinstance(X, np.ndarray) and X.ndim == 2 and X.dtype.kind == 'f':
+            return X
+        documents = [s if isinstance(s, SpectrumDocument) else SpectrumDocument(s, n_decimals=self.spec2vec.n_decimals) for s in X]
+        return embed_documents(self.spec2vec.model, documents, self.spec2vec.intensity_weighting_power,
+                               self.spec2vec.allowed_missing_percentage)
 
     def fit(self, X, y):
-        self.X = [Spectrum(s) for s in X] # List of known spectra
-        self.y = y # Matrix of shape (n_known_spectra, n_targets)
+        # Embeddings of the known spectra are computed and normalised once
+        self.index = CosineIndex(n_lists=self.n_lists, n_probe=self.n_probe).fit(self._embed(X))
+        self.y = np.asarray(y, dtype=np.float32) # Matrix of shape (n_known_spectra, n_targets)
+        return self
+
+    def _vote(self, weights):
+        if self.vote == 'sum':
+            return np.asarray(weights @ self.y)
+        weights = weights.maximum(0) if sparse.issparse(weights) else np.maximum(weights, 0)
+        votes = np.asarray(weights @ self.y)
+        total = np.asarray(weights.sum(axis=1)).reshape(-1, 1)
+        return np.clip(np.divide(votes, total, out=np.zeros_like(votes), where=total > 0), 0, 1)
 
     def predict_proba(self, X):
-        X = [Spectrum(s) for s in X] # List of unknown spectra
+        queries = self._embed(X)
+        if self.k is None:
+            # Similarities to all known spectra, computed for blocks of unknown spectra to bound the memory
+            queries = normalize(queries)
+            blocks = [self._vote(queries[start:start + self.index.block_size] @ self.index.vectors.T)
+                      for start in range(0, len(queries), self.index.block_size)]
+            return np.concatenate(blocks) if blocks else np.zeros((0, self.y.shape[1]), dtype=np.float32)
 
-        # Matrix with known spectra as columns and unknown spectra as rows, shape (n_unknown_spectra, n_known_spectra)
-        similarities = calculate_scores(X, self.X, self.spec2vec, is_symmetric=False)
+        # k nearest known spectra of every unknown spectrum as a sparse weight matrix, missing neighbours get weight 0
+        scores, indices = self.index.search(queries, self.k)
+        rows = np.repeat(np.arange(len(indices)), indices.shape[1])
+        weights = sparse.csr_matrix((np.where(indices >= 0, scores, 0).ravel(), (rows, np.maximum(indices, 0).ravel())),
+                                    shape=(len(indices), len(self.y)))
 
         # Matrix with shape (n_unknown_spectra, n_targets)
-        y = similarities.dot(self.y)
+        return self._vote(weights)
 
-        # Return probabilities
-        return y
-    
     def predict(self, X):
         # Calculate probabilities, matrix with shape (n_unknown_spectra, n_targets)
         y = self.predict_proba(X)
 
         # Return binary predictions
         return (y > 0.5).astype(int)
-    
+
     def get_metadata_routing(self):
         return {"input": "spectrum", "output": "spectrum"}
-    
+
     def get_params(self, deep=True):
-        return {"spec2vec_model_file": self.spec2vec.model, "intensity_weighting_power": self.spec2vec.intensity_weighting_power, "allowed_missing_percentage": self.spec2vec.allowed_missing_percentage}
+        return {"spec2vec_model_file": self.spec2vec_model_file, "intensity_weighting_power": self.spec2vec.intensity_weighting_power,
+                "allowed_missing_percentage": self.spec2vec.allowed_missing_percentage, "k": self.k, "vote": self.vote, "n_lists": self.n_lists, "n_probe": self.n_probe}
 
     def set_params(self, **parameters):
         for parameter, value in parameters.items():
-            setattr(self.spec2vec, parameter, value)
-        return self
\ No newline at end of file
+            if parameter in ("k", "vote", "n_lists", "n_probe"):
+                setattr(self, parameter, value)
+            else:
+                setattr(self.spec2vec, parameter, value)
+        return self
@@ -0,0 +1,135 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Binary storage for embeddings and fingerprints
+# A matrix stored at `path` consists of three files:
+#   {path}.npy       - float32 embedding matrix or fingerprint bits packed 8 per byte (rows are spectra/compounds)
+#   {path}.json      - header with the kind of matrix and the column names
+#   {path}.index.csv - descriptive columns (inchi_key, inchi, smiles, ...) with one row per matrix row
+# The .npy files are opened as memory maps, so loading is instant and only touched pages are read
+
+EMBEDDING = 'embedding'
+FINGERPRINT = 'fingerprint'
+
+def _strip_extension(path):
+    for extension in ('.npy', '.json', '.index.csv'):
+        if path.endswith(extension):
+            return path[:-len(extension)]
+    return path
+
+def _write(path, matrix, kind, columns, index):
+    path = _strip_extension(path)
+    if index is not None and len(index) != matrix.shape[0]:
+        raise ValueError(f'Index has {len(index)} rows, matrix has {matrix.shape[0]}')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    out = np.lib.format.open_memmap(f'{path}.npy', mode='w+', dtype=matrix.dtype, shape=matrix.shape)
+    out[:] = matrix
+    out.flush()
+    del out
+
+    with open(f'{path}.json', 'w') as f:
+        json.dump({'kind': kind, 'shape': [matrix.shape[0], len(columns)], 'columns': [str(c) for c in columns]}, f)
+    if index is None:
+        index = pd.DataFrame(index=range(matrix.shape[0]))
+    pd.DataFrame(index).reset_index(drop=True).to_csv(f'{path}.index.csv', index=False)
+
+# Store a float32 embedding matrix of shape (n_rows, n_dimensions)
+def save_embeddings(path, embeddings, index=None, columns=None):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if columns is None:
+        columns = range(embeddings.shape[1])
+    _write(path, embeddings, EMBEDDING, list(columns), index)
+
+# Store a 0/1 fingerprint matrix of shape (n_rows, n_bits), bits are packed 8 per byte
+# Any other value (NaN, 2, -1, ...) raises a ValueError instead of being stored as a set bit
+def save_fingerprints(path, bits, index=None, columns=None):
+    bits = np.asarray(bits)
+    if bits.ndim != 2:
+        raise ValueError(f'Fingerprints must be a 2D matrix, got shape {bits.shape}')
+    if columns is None:
+        columns = [f'bit_{i}' for i in range(bits.shape[1])]
+    if len(columns) != bits.shape[1]:
+        raise ValueError(f'Got {len(columns)} column names for {bits.shape[1]} bits')
+    if bits.dtype != bool:
+        invalid = ~np.isin(bits, (0, 1))
+        if invalid.any():
+            row, column = np.argwhere(invalid)[0]
+            raise ValueError(f'Fingerprints must only contain 0 and 1, found {bits[row, column]!r} in row {row} '
+                             f'column {columns[column]} ({invalid.sum()} invalid values)')
+    _write(path, np.packbits(bits.astype(bool), axis=1), FINGERPRINT, list(columns), index)
+
+# Unpack fingerprint bits stored with save_fingerprints to a uint8 matrix of shape (n_rows, n_bits)
+def unpack_bits(packed, n_bits):
+    return np.unpackbits(packed, axis=1, count=n_bits)
+
+# Packed fingerprint bits which are unpacked on indexing
+# bits[rows] (an int, slice, index array or boolean mask, optionally followed by a column index) only unpacks the
+# selected rows, np.asarray(bits) unpacks all of them, so a memory mapped store is never fully held in memory
+class PackedBits:
+    def __init__(self, packed, n_bits):
+        self.packed = packed
+        self.n_bits = n_bits
+
+    @property
+    def shape(self):
+        return (self.packed.shape[0], self.n_bits)
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def dtype(self):
+        return np.dtype(np.uint8)
+
+    def __len__(self):
+        return self.packed.shape[0]
+
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        if isinstance(rows, (int, np.integer)):
+            return unpack_bits(np.asarray(self.packed[[rows]]), self.n_bits)[0, columns]
+        return unpack_bits(np.asarray(self.packed[rows]), self.n_bits)[:, columns]
+
+    def __array__(self, dtype=None, copy=None):
+        bits = unpack_bits(np.asarray(self.packed), self.n_bits)
+        return bits if dtype is None else bits.astype(dtype)
+
+# Load a stored matrix, returns (matrix, index, header)
+# Embeddings are returned as a read only memory map, fingerprints are unpacked unless packed=True
+def load(path, mmap=True, packed=False):
+    path = _strip_extension(path)
+    with open(f'{path}.json') as f:
+        header = json.load(f)
+    matrix = np.load(f'{path}.npy', mmap_mode='r' if mmap else None)
+    if header['kind'] == FINGERPRINT and not packed:
+        matrix = unpack_bits(matrix, len(header['columns']))
+    try:
+        index = pd.read_csv(f'{path}.index.csv')
+    except pd.errors.EmptyDataError:
+        # Stored without descriptive columns
+        index = pd.DataFrame(index=range(matrix.shape[0]))
+    return matrix, index, header
+
+# Load a stored matrix as a DataFrame with the descriptive columns in front (same layout as the old csv files)
+def load_frame(path):
+    matrix, index, header = load(path, mmap=False)
+    frame = pd.DataFrame(matrix, columns=header['columns'])
+    return pd.concat([index, frame], axis=1)
+
+# Merged training data is stored in a folder with X (embeddings), y (fingerprint bits) and a shared index
+def save_dataset(folder, X, y, index, x_columns=None, y_columns=None):
+    save_embeddings(os.path.join(folder, 'X'), X, index, x_columns)
+    save_fingerprints(os.path.join(folder, 'y'), y, index, y_columns)
+
+# Load merged training data, returns (X, y, index)
+# X is a read only memory map over the stored embeddings, y the fingerprint bits as PackedBits over the packed
+# store, so only the rows that are indexed (e.g. the rows of a fold) are unpacked
+def load_dataset(folder, mmap=True):
+    X, index, _ = load(os.path.join(folder, 'X'), mmap=mmap)
+    packed, _, header = load(os.path.join(folder, 'y'), mmap=mmap, packed=True)
+    return X, PackedBits(packed, len(header['columns'])), index
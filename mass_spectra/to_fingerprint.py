@@ -1,26 +1,73 @@
 import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from time import sleep
 
+import numpy as np
 import pandas as pd
-from chembl_webresource_client.unichem import unichem_client as unichem
-from scyjava import config, jimport
 
-config.endpoints.append('org.openscience.cdk:cdk-bundle:2.8')
-InChIGeneratorFactory = jimport('org.openscience.cdk.inchi.InChIGeneratorFactory')
-InChIToStructure = jimport('org.openscience.cdk.inchi.InChIToStructure')
-DefaultChemObjectBuilder = jimport('org.openscience.cdk.DefaultChemObjectBuilder')
+from mass_spectra import instrumentation
+from mass_spectra.merge import DESCRIPTIVE_COLUMNS
+from mass_spectra.resolution_cache import Resolver
+from mass_spectra.store import save_fingerprints
+
+CDK_ENDPOINT = 'org.openscience.cdk:cdk-bundle:2.8'
+
+# CDK classes are resolved on first use, the JVM is started by the first call and not when the module is imported
+# so --help, argument validation and pool workers without molecules to convert never pay for it
+_cdk_classes = None
+def _cdk():
+    global _cdk_classes
+    if _cdk_classes is None:
+        from scyjava import config, jimport
+        if CDK_ENDPOINT not in config.endpoints:
+            config.endpoints.append(CDK_ENDPOINT)
+        InChIGeneratorFactory = jimport('org.openscience.cdk.inchi.InChIGeneratorFactory')
+        SmilesGenerator = jimport('org.openscience.cdk.smiles.SmilesGenerator')
+        SmiFlavor = jimport('org.openscience.cdk.smiles.SmiFlavor')
+        _cdk_classes = {
+            'jimport': jimport,
+            'DefaultChemObjectBuilder': jimport('org.openscience.cdk.DefaultChemObjectBuilder'),
+            'InchiGenerator': InChIGeneratorFactory.getInstance(),
+            'SmilesGenerator': SmilesGenerator(SmiFlavor.Absolute),
+        }
+    return _cdk_classes
 
-InchiGenerator = InChIGeneratorFactory.getInstance()
 def inchi_to_atom_container(inchi):
-    builderInstance = DefaultChemObjectBuilder.getInstance()
-    intostruct = InchiGenerator.getInChIToStructure(inchi, builderInstance)
+    cdk = _cdk()
+    builderInstance = cdk['DefaultChemObjectBuilder'].getInstance()
+    intostruct = cdk['InchiGenerator'].getInChIToStructure(inchi, builderInstance)
     return intostruct.getAtomContainer()
 
-def inchikey_to_inchi(inchikey):
-    ret = unichem.inchiFromKey(inchikey)
-    if len(ret) == 0:
+# UniChem lookups go through the shared resolution cache
+# The UNICHEM_HOST environment variable (read on every lookup) points them to another server, such as a local stub
+UNICHEM_HOST = 'https://www.ebi.ac.uk/unichem/rest'
+
+def unichem_host():
+    return os.environ.get('UNICHEM_HOST', UNICHEM_HOST)
+
+def _parse_unichem_inchi(response):
+    ret = response.json()
+    if not isinstance(ret, list) or len(ret) == 0:
         return None
-    return ret[0]['standardinchi']
+    return ret[0].get('standardinchi')
+
+# One resolver per host, created on first use
+_unichem_resolvers = {}
+def unichem_resolver(host=None):
+    host = unichem_host() if host is None else host
+    if host not in _unichem_resolvers:
+        _unichem_resolvers[host] = Resolver('unichem_inchikey_to_inchi', f'{host}/inchi/{{key}}', _parse_unichem_inchi)
+    return _unichem_resolvers[host]
+
+def inchikey_to_inchi(inchikey):
+    return unichem_resolver().resolve(inchikey)
+
+# Resolve many InChI keys at once, returns {inchikey: inchi or None}
+def inchikeys_to_inchi(inchikeys):
+    return unichem_resolver().resolve_many(inchikeys)
 
 AVAILABLE_FINGERPRINTS = [
     'AtomPairs2DFingerprinter',
@@ -33,55 +80,178 @@ AVAILABLE_FINGERPRINTS = [
     'SubstructureFingerprinter'
 ]
 
-FINGERPRINT_ARGS = {
-    'PubchemFingerprinter': [DefaultChemObjectBuilder.getInstance()]
-}
+# Fingerprinters constructed with the chem object builder
+BUILDER_FINGERPRINTS = {'PubchemFingerprinter'}
 
 CONVERSION_RETRY_COUNT = 3
 CONVERSION_RETRY_DELAY = 1
 
-def generate_fingerprint(fingerprint_array, inchi_array):
+# Parse InChI (or InChI key) to an atom container, returns None if the molecule can not be converted
+def to_atom_container(inchi, inchi_idx=None):
+    atom_container = None
+    for i in range(CONVERSION_RETRY_COUNT):
+        try:
+            atom_container = inchi_to_atom_container(f'{inchi}')
+            if atom_container.getAtomCount() == 0:
+                instrumentation.count('unichem_fallbacks')
+                converted = inchikey_to_inchi(inchi)
+                if converted is None:
+                    # Unknown to UniChem (possibly a cached miss), retrying can not change the result
+                    print(f'Could not resolve InChI key {inchi}')
+                    return None
+                print(f'Converted InChI key {inchi} to {converted}')
+                atom_container = inchi_to_atom_container(converted)
+        except Exception as e:
+            print(f'Error Number {i} at idx {inchi_idx} converting InChI key {inchi}: {e}')
+            instrumentation.count('conversion_retries')
+            sleep(CONVERSION_RETRY_DELAY)
+            continue
+        break
+
+    if atom_container is None or atom_container.getAtomCount() == 0:
+        return None
+    return atom_container
+
+# Descriptive columns (DESCRIPTIVE_COLUMNS) of an input, the input is taken as InChI or InChI key until the
+# converted molecule is described
+def input_descriptors(inchi):
+    inchi = f'{inchi}'
+    if inchi.startswith('InChI='):
+        return {'inchi_key': None, 'inchi': inchi, 'smiles': None}
+    return {'inchi_key': inchi, 'inchi': None, 'smiles': None}
+
+# Standard InChI, InChI key and SMILES of a converted molecule generated by CDK, values CDK can not generate are kept
+def describe_molecule(atom_container, descriptors):
+    cdk = _cdk()
+    descriptors = dict(descriptors)
+    try:
+        generator = cdk['InchiGenerator'].getInChIGenerator(atom_container)
+        if generator.getInchi() is not None:
+            descriptors['inchi'] = str(generator.getInchi())
+            descriptors['inchi_key'] = str(generator.getInchiKey())
+    except Exception as e:
+        print(f'Could not generate InChI of {descriptors}: {e}')
+    try:
+        descriptors['smiles'] = str(cdk['SmilesGenerator'].create(atom_container))
+    except Exception as e:
+        print(f'Could not generate SMILES of {descriptors}: {e}')
+    return descriptors
+
+def create_fingerprinter(fp):
+    if fp not in AVAILABLE_FINGERPRINTS:
+        raise ValueError(f'Fingerprint type {fp} not available. Options are: {AVAILABLE_FINGERPRINTS}')
+    cdk = _cdk()
+    fingerprinter = cdk['jimport'](f'org.openscience.cdk.fingerprint.{fp}')
+    if fp in BUILDER_FINGERPRINTS:
+        return fingerprinter(cdk['DefaultChemObjectBuilder'].getInstance())
+    return fingerprinter()
+
+# Compute all requested fingerprints with every molecule parsed only once
+# Returns packed bit matrices {fingerprint: uint8 array of shape (n_inchi, ceil(size / 8))}, the fingerprint
+# sizes {fingerprint: size}, a boolean mask of the molecules that were converted and the descriptive columns
+# of every input (a list of dicts), converted molecules are only described by CDK with describe=True
+def compute_fingerprints(fingerprint_array, inchi_array, describe=False):
+    fingerprinters = {fp: create_fingerprinter(fp) for fp in fingerprint_array}
+    sizes = {fp: fingerprinter.getSize() for fp, fingerprinter in fingerprinters.items()}
+
+    inchi_array = list(inchi_array)
+    packed = {fp: np.zeros((len(inchi_array), (size + 7) // 8), dtype=np.uint8) for fp, size in sizes.items()}
+    converted = np.zeros(len(inchi_array), dtype=bool)
+    descriptors = [input_descriptors(inchi) for inchi in inchi_array]
+
+    print(f'Converting {len(inchi_array)} InChI keys to {", ".join(f"{sizes[fp]} bit {fp}" for fp in sizes)} fingerprint')
+    for inchi_idx, inchi in enumerate(inchi_array):
+        atom_container = to_atom_container(inchi, inchi_idx)
+        if atom_container is None:
+            print(f'Cound not convert InChI key {inchi}...skipping')
+            instrumentation.count('conversion_failures')
+            continue
+        converted[inchi_idx] = True
+        if describe:
+            descriptors[inchi_idx] = describe_molecule(atom_container, descriptors[inchi_idx])
+        instrumentation.count('converted')
+
+        for fp, fingerprinter in fingerprinters.items():
+            # Only the indices of the set bits cross the Java boundary, as one int array
+            set_bits = np.asarray(fingerprinter.getBitFingerprint(atom_container).getSetbits(), dtype=np.int64)
+            row = np.zeros(sizes[fp], dtype=bool)
+            row[set_bits[set_bits < sizes[fp]]] = True
+            packed[fp][inchi_idx] = np.packbits(row)
+    return packed, sizes, converted, descriptors
+
+# Build one DataFrame per fingerprint with the inchi column followed by bit columns, indexed by the position in inchi_array
+def fingerprints_to_frames(packed, sizes, converted, inchi_array):
+    inchi_array = list(inchi_array)
+    rows = np.flatnonzero(converted)
     fingerprints = {}
+    for fp, size in sizes.items():
+        bits = np.unpackbits(packed[fp][rows], axis=1, count=size)
+        fp_df = pd.DataFrame(bits, index=rows, columns=[f'bit_{i}' for i in range(size)])
+        fp_df.insert(0, 'inchi', [inchi_array[i] for i in rows])
+        fingerprints[fp] = fp_df
+    return fingerprints
+
+# Number of shards per worker, smaller shards balance the load when some molecules need UniChem lookups
+SHARDS_PER_WORKER = 4
+
+# compute_fingerprints in a worker process, the instrumentation counters of the shard are returned with its results
+def _compute_fingerprints_shard(fingerprint_array, inchi_array, describe=False):
+    with instrumentation.collect() as counts:
+        results = compute_fingerprints(fingerprint_array, inchi_array, describe)
+    return results, counts
+
+# Shard inchi_array over a pool of worker processes, each worker starts its own JVM once on its first shard
+# Results are merged in the original order, so the output is the same as compute_fingerprints
+def compute_fingerprints_parallel(fingerprint_array, inchi_array, workers, describe=False):
     for fp in fingerprint_array:
-        print(f'Generating {fp} fingerprint')
         if fp not in AVAILABLE_FINGERPRINTS:
             raise ValueError(f'Fingerprint type {fp} not available. Options are: {AVAILABLE_FINGERPRINTS}')
 
-        fingerprinter = jimport(f'org.openscience.cdk.fingerprint.{fp}')
-        fingerprinter = fingerprinter(*FINGERPRINT_ARGS.get(fp, {}))
-
-        fingerprints[f'{fp}'] = pd.DataFrame(columns=['inchi'] + [f'bit_{i}' for i in range(fingerprinter.getSize())])
-        print(f'Converting {len(inchi_array)} InChI keys to {fingerprinter.getSize()} bit {fp} fingerprint')
-        for inchi_idx, inchi in enumerate(inchi_array):
-            for i in range(CONVERSION_RETRY_COUNT):
-                try:
-                    atom_container = inchi_to_atom_container(f'{inchi}')
-                    if atom_container.getAtomCount() == 0:
-                        converted = inchikey_to_inchi(inchi)
-                        print(f'Converted InChI key {inchi} to {converted}')
-                        atom_container = inchi_to_atom_container(converted)
-                except Exception as e:
-                    print(f'Error Number {i} at idx {inchi_idx} converting InChI key {inchi}: {e}')
-                    sleep(CONVERSION_RETRY_DELAY)
-                    continue
-                break
+    inchi_array = list(inchi_array)
+    n_shards = min(len(inchi_array), workers * SHARDS_PER_WORKER)
+    bounds = np.linspace(0, len(inchi_array), n_shards + 1).astype(int)
+    shards = [inchi_array[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
 
-            if atom_container.getAtomCount() == 0:
-                print(f'Cound not convert InChI key {inchi}...skipping')
-                continue
-            fingerprint = fingerprinter.getBitFingerprint(atom_container).asBitSet()
-            fingerprint = java_bitset_to_python_array(fingerprint)
-            fingerprint = fingerprint[:fingerprinter.getSize()]
+    # A running JVM does not survive fork, so workers are always spawned
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        results = []
+        for result, counts in executor.map(_compute_fingerprints_shard, repeat(fingerprint_array), shards, repeat(describe)):
+            results.append(result)
+            instrumentation.merge(counts)
 
-            fingerprints[f'{fp}'].loc[inchi_idx] = [inchi] + fingerprint     
+    sizes = results[0][1]
+    packed = {fp: np.concatenate([r[0][fp] for r in results]) for fp in sizes}
+    converted = np.concatenate([r[2] for r in results])
+    descriptors = [d for r in results for d in r[3]]
+    return packed, sizes, converted, descriptors
+
+# Returns one DataFrame per fingerprint (see fingerprints_to_frames)
+# With return_index=True also the descriptive columns of every input, indexed like the DataFrames
+# (the InChI, InChI key and SMILES of the molecules are only generated then)
+def generate_fingerprint(fingerprint_array, inchi_array, workers=1, return_index=False):
+    print(f'Generating {", ".join(fingerprint_array)} fingerprint')
+    inchi_array = list(inchi_array)
+    if workers > 1 and len(inchi_array) > 1:
+        packed, sizes, converted, descriptors = compute_fingerprints_parallel(fingerprint_array, inchi_array, workers,
+                                                                              describe=return_index)
+    else:
+        packed, sizes, converted, descriptors = compute_fingerprints(fingerprint_array, inchi_array, describe=return_index)
+    fingerprints = fingerprints_to_frames(packed, sizes, converted, inchi_array)
+    if return_index:
+        return fingerprints, pd.DataFrame(descriptors, columns=DESCRIPTIVE_COLUMNS)
     return fingerprints
 
-def java_bitset_to_python_array(bitSet):
-        bits = [0] * bitSet.size()
-        for i in bitSet.stream().toArray():
-            bits[i] = 1
-        return bits
-    
+# Write every generated fingerprint to the binary store as {folder}/{fingerprint name}
+# index holds the descriptive columns of every input (from generate_fingerprint with return_index=True), so the
+# stores have the same index as the ones written by s0_embed and can be merged with the embeddings
+def save_fingerprint_store(fingerprints, index, folder):
+    for fp, fp_df in fingerprints.items():
+        bit_columns = [c for c in fp_df.columns if c != 'inchi']
+        bits = fp_df[bit_columns].to_numpy(dtype='uint8')
+        save_fingerprints(os.path.join(folder, fp), bits, index.loc[fp_df.index, DESCRIPTIVE_COLUMNS], bit_columns)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Optional app description')
 
@@ -93,6 +263,11 @@ if __name__ == '__main__':
                         help='Accept array of InChI keys separated by commas')
     parser.add_argument('--fingerprint_array', action='store_true',
                         help='Accept array of fingerprint types separated by commas')
+    parser.add_argument('--output_folder', type=str, default=None,
+                        help='Folder to write the fingerprints to as a binary fingerprint store')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes, each with its own JVM (default: 1)')
+    instrumentation.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -106,7 +281,16 @@ if __name__ == '__main__':
     else:
         fingerprint_array = [args.Fingerprint]
 
-    try:
-        fingerprints = generate_fingerprint(fingerprint_array, inchi_array)
-    except ValueError as e:
-        parser.error(e)
\ No newline at end of file
+    with instrumentation.run('to_fingerprint', args.metrics_file, args.profile):
+        try:
+            # The descriptive columns are only needed for the store
+            with instrumentation.stage('fingerprint', inchis=len(inchi_array), workers=args.workers):
+                fingerprints = generate_fingerprint(fingerprint_array, inchi_array, workers=args.workers,
+                                                    return_index=args.output_folder is not None)
+        except ValueError as e:
+            parser.error(e)
+
+        if args.output_folder is not None:
+            fingerprints, index = fingerprints
+            with instrumentation.stage('save'):
+                save_fingerprint_store(fingerprints, index, args.output_folder)
\ No newline at end of file
@@ -1,45 +1,68 @@
 import argparse
 
-import gensim
-import pandas as pd
-from spec2vec import Spec2Vec, calc_vector
+from mass_spectra import instrumentation
 
-from mass_spectra.train_spec2vec import preprocess_file
+# Embed the spectra of an mgf file with a spec2vec model and write the embeddings as csv or as a binary embedding store
+# gensim, pandas and the preprocessing are imported here, so the module and --help load without them
+def embed_file(data_file, model_file, output_file, cache_folder=None):
+    import gensim
+    import pandas as pd
 
-parser = argparse.ArgumentParser(description='Embed spectra using spec2vec model')
+    from mass_spectra.embedding import embed_documents
+    from mass_spectra.merge import DESCRIPTIVE_COLUMNS
+    from mass_spectra.store import save_embeddings
+    from mass_spectra.train_spec2vec import preprocess_file
 
-parser.add_argument('data_file', type=str,
-                    help='Path to the data file')
-parser.add_argument('model_file', type=str,
-                    help='Path to the model file')
-parser.add_argument('output_file', type=str,
-                    help='Path to the output file')
+    with instrumentation.stage('preprocess'):
+        tms_spectra_documents = preprocess_file(data_file, cache_folder=cache_folder)
 
-args = parser.parse_args()
+    with instrumentation.stage('load_model'):
+        tms_model = gensim.models.Word2Vec.load(model_file)
 
-DATA_FILE = args.data_file
-MODEL_FILE = args.model_file
-OUTPUT_FILE = args.output_file
+    with instrumentation.stage('embed', documents=len(tms_spectra_documents)):
+        tms_embedding = embed_documents(tms_model, tms_spectra_documents)
 
-if not DATA_FILE.endswith('.mgf'):
-    raise argparse.ArgumentError('Data file must be a mgf file')
+    with instrumentation.stage('write'):
+        if output_file.endswith('.npy'):
+            # Same descriptive columns as the fingerprint stores, so the embeddings can be merged with them
+            metadata_keys = {'inchi_key': 'inchikey', 'inchi': 'inchi', 'smiles': 'smiles'}
+            tms_index = pd.DataFrame({column: [s.metadata.get(metadata_keys[column]) for s in tms_spectra_documents]
+                                      for column in DESCRIPTIVE_COLUMNS})
+            tms_index['title'] = [s.metadata.get('title') for s in tms_spectra_documents]
+            save_embeddings(output_file, tms_embedding, tms_index)
+        else:
+            tms_index = pd.DataFrame({
+                'title': [s.metadata.get('title') for s in tms_spectra_documents],
+                'inchikey': [s.metadata.get('inchikey') for s in tms_spectra_documents],
+            })
+            tms_embedding_df = pd.DataFrame(tms_embedding, columns=list(range(tms_embedding.shape[1])))
+            tms_embedding_df = pd.concat([tms_index, tms_embedding_df], axis=1)
+            tms_embedding_df.to_csv(output_file, index=False)
 
-if not OUTPUT_FILE.endswith('.csv'):
-    raise argparse.ArgumentError('Output file must be a csv file')
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Embed spectra using spec2vec model')
 
-tms_spectra_documents = preprocess_file(DATA_FILE)
+    parser.add_argument('data_file', type=str,
+                        help='Path to the data file')
+    parser.add_argument('model_file', type=str,
+                        help='Path to the model file')
+    parser.add_argument('output_file', type=str,
+                        help='Path to the output file (.csv, or .npy to write a binary embedding store)')
+    parser.add_argument('--cache_folder', type=str, default=None,
+                        help='Folder with cached preprocessed spectra, the data file is only preprocessed when it is not cached yet')
+    instrumentation.add_arguments(parser)
 
-tms_model = gensim.models.Word2Vec.load(MODEL_FILE)
-tms_model = Spec2Vec(tms_model)
+    args = parser.parse_args(argv)
 
-tms_embedding = []
-for spectra in tms_spectra_documents:
-    title = spectra.metadata.get('title')
-    inchikey = spectra.metadata.get('inchikey')
-    embedding = calc_vector(tms_model.model, spectra)
-    tms_embedding.append((title, inchikey, *embedding))
+    if not args.data_file.endswith('.mgf'):
+        parser.error('Data file must be a mgf file')
 
-tms_columns = ['title', 'inchikey'] + [i for i in range(0, len(tms_embedding[0])-2)]
-tms_embedding_df = pd.DataFrame(tms_embedding, columns=tms_columns)
+    if not args.output_file.endswith('.csv') and not args.output_file.endswith('.npy'):
+        parser.error('Output file must be a csv or npy file')
 
-tms_embedding_df.to_csv(OUTPUT_FILE, index=False)
\ No newline at end of file
+    with instrumentation.run('to_spec2vec', args.metrics_file, args.profile):
+        embed_file(args.data_file, args.model_file, args.output_file, args.cache_folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,75 @@
 import argparse
+import json
 import logging
 import multiprocessing
 import os
-import pickle
+import random
 import re
+from collections import deque
+from itertools import islice
 
-import matchms.filtering as ms_filters
-from matchms.exporting import save_as_mgf
-from matchms.importing import load_from_mgf
-from matchms.logging_functions import (set_matchms_logger_level,
-                                       set_rdkit_logger_level)
-from spec2vec import SpectrumDocument
-from spec2vec.model_building import train_new_word2vec_model
+from mass_spectra import corpus, instrumentation, preprocessing_cache
 
-# Set logging level to "ERROR" to avoid distracting output during training
-set_rdkit_logger_level("rdApp.error")
-set_matchms_logger_level("ERROR") # set logging level to "ERROR" to avoid too many messages
+# matchms, spec2vec and gensim are imported on first use, so --help and modules only needing the constants start fast
+_ms_filters = None
+def _filters():
+    global _ms_filters
+    if _ms_filters is None:
+        import matchms.filtering as ms_filters
+        from matchms.logging_functions import (set_matchms_logger_level,
+                                               set_rdkit_logger_level)
+
+        # Set logging level to "ERROR" to avoid distracting output during training
+        set_rdkit_logger_level("rdApp.error")
+        set_matchms_logger_level("ERROR") # set logging level to "ERROR" to avoid too many messages
+        _ms_filters = ms_filters
+    return _ms_filters
+
+# matchms.importing.load_from_mgf with the matchms log levels set
+def load_from_mgf(file_path):
+    _filters()
+    import matchms.importing
+    return matchms.importing.load_from_mgf(file_path)
+
+# Preprocessing parameters, any change invalidates the preprocessing cache
+MZ_FROM = 0
+MZ_TO = 1000
+N_REQUIRED_PEAKS = 10
+INTENSITY_FROM = 0.001
+LOSS_MZ_FROM = 5.0
+LOSS_MZ_TO = 200.0
+N_DECIMALS = 2
+
+def preprocessing_settings():
+    import matchms
+    return {
+        "mz_from": MZ_FROM,
+        "mz_to": MZ_TO,
+        "n_required_peaks": N_REQUIRED_PEAKS,
+        "intensity_from": INTENSITY_FROM,
+        "loss_mz_from": LOSS_MZ_FROM,
+        "loss_mz_to": LOSS_MZ_TO,
+        "n_decimals": N_DECIMALS,
+        "matchms": matchms.__version__,
+    }
+
+# List all files that end with ".mgf" in the given directory
+def find_mgf_files(directory, file_name_ending="", file_extension="mgf"):
+    return [os.path.join(directory, filename) for filename in sorted(os.listdir(directory))
+            if filename.endswith(f"{file_name_ending}.{file_extension}")]
 
 # Load all spectra from the any file that ends with ".mgf" in the given directory
 def load_from_mgf_files(directory, file_name_ending="", file_extension="mgf"):
-    for filename in os.listdir(directory):
-        if filename.endswith(f"{file_name_ending}.{file_extension}"):
-            print(f"Loading {filename}")
-            yield from load_from_mgf(os.path.join(directory, filename))
+    for file_path in find_mgf_files(directory, file_name_ending, file_extension):
+        print(f"Loading {os.path.basename(file_path)}")
+        yield from load_from_mgf(file_path)
 
 # Regex to extract information from title
 inchi_name = re.compile("InChiKey:\s*([A-Z\-]+).*Name: (.*)")
 
 # Preprocess the metadata
 def metadata_processing(s):
+    ms_filters = _filters()
     if s.metadata.get("title") and not s.metadata.get("inchikey"):
         matched = inchi_name.findall(s.metadata.get("title"))
         if len(matched) > 0:
@@ -48,19 +89,22 @@ def metadata_processing(s):
 
 # Preprocess the peaks
 def peak_processing(s):
+    ms_filters = _filters()
     s = ms_filters.add_parent_mass(s)
     s = ms_filters.normalize_intensities(s)
-    s = ms_filters.select_by_mz(s, mz_from=0, mz_to=1000)
-    s = ms_filters.require_minimum_number_of_peaks(s, n_required=10)
-    s = ms_filters.reduce_to_number_of_peaks(s, n_required=10)
+    s = ms_filters.select_by_mz(s, mz_from=MZ_FROM, mz_to=MZ_TO)
+    filtered = ms_filters.require_minimum_number_of_peaks(s, n_required=N_REQUIRED_PEAKS)
+    if s is not None and filtered is None:
+        instrumentation.count("spectra_dropped_min_peaks")
+    s = ms_filters.reduce_to_number_of_peaks(filtered, n_required=N_REQUIRED_PEAKS)
 
     if s is None:
         return None
-    s_remove_low_peaks = ms_filters.select_by_relative_intensity(s, intensity_from=0.001)
-    if len(s_remove_low_peaks.peaks) >= 10:
+    s_remove_low_peaks = ms_filters.select_by_relative_intensity(s, intensity_from=INTENSITY_FROM)
+    if len(s_remove_low_peaks.peaks) >= N_REQUIRED_PEAKS:
         s = s_remove_low_peaks
 
-    s = ms_filters.add_losses(s, loss_mz_from=5.0, loss_mz_to=200.0)
+    s = ms_filters.add_losses(s, loss_mz_from=LOSS_MZ_FROM, loss_mz_to=LOSS_MZ_TO)
     return s
 
 # Preprocessing pipeline
@@ -72,13 +116,132 @@ def preprocess(s, convert_to_document=True):
     return convert_to_document(s)
 
 # Preprocess pipeline for the file
-def preprocess_file(file_path, convert_to_document=True):
-    spectrums = load_from_mgf(file_path)
-    return [preprocess(s, convert_to_document) for s in spectrums]
+# If cache_folder is given the preprocessed spectra are stored there and reused while the file and settings are unchanged
+# key is the preprocessing_cache.cache_key of the file, pass it when already computed so the file is hashed only once
+def preprocess_file(file_path, convert_to_document=True, workers=None, chunk_size=1000, cache_folder=None, key=None):
+    if cache_folder is None:
+        spectrums = load_from_mgf(file_path)
+        return list(preprocess_spectra(spectrums, convert_to_document, workers=workers, chunk_size=chunk_size))
+
+    spectrums = preprocessing_cache.load_or_compute(
+        file_path, cache_folder, preprocessing_settings(),
+        lambda: list(preprocess_spectra(load_from_mgf(file_path), False, workers=workers, chunk_size=chunk_size)), key=key)
+    if not convert_to_document:
+        return spectrums
+    from spec2vec import SpectrumDocument
+    return [SpectrumDocument(s, n_decimals=N_DECIMALS) for s in spectrums]
+
+# Write the words of the preprocessed documents of the file to a token file in token_folder, existing token files are reused
+# Returns the path of the token file
+def tokenize_file(file_path, token_folder, workers=None, chunk_size=1000, cache_folder=None, key=None):
+    if key is None:
+        key = preprocessing_cache.cache_key(file_path, preprocessing_settings())
+    path = corpus.token_path(token_folder, key)
+    if os.path.exists(path):
+        print(f"Using token file of {os.path.basename(file_path)}")
+    else:
+        corpus.save_tokens(path, preprocess_file(file_path, workers=workers, chunk_size=chunk_size, cache_folder=cache_folder, key=key))
+    return path
 
 # Convert the spectra to SpectrumDocuments
 def convert_to_document(s):
-    return SpectrumDocument(s, n_decimals=2)
+    from spec2vec import SpectrumDocument
+    return SpectrumDocument(s, n_decimals=N_DECIMALS)
+
+# Preprocess a chunk of spectra, runs inside the worker processes
+# Returns the processed spectra and the instrumentation counters of the chunk, which the caller merges
+def _preprocess_chunk(chunk, to_document):
+    processed = []
+    with instrumentation.collect() as counts:
+        for s in chunk:
+            s = metadata_processing(s)
+            s = peak_processing(s)
+            # Spectra rejected by the peak filters can not be converted to documents
+            if s is None or len(s.intensities) == 0:
+                instrumentation.count("spectra_dropped")
+                continue
+            processed.append(convert_to_document(s) if to_document else s)
+        instrumentation.count("spectra_processed", len(processed))
+    return processed, counts
+
+def _merge_chunk(result):
+    processed, counts = result
+    instrumentation.merge(counts)
+    return processed
+
+# Split any iterable of spectra into lists of chunk_size spectra
+def _chunks(spectrums, chunk_size):
+    spectrums = iter(spectrums)
+    while True:
+        chunk = list(islice(spectrums, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+# Preprocess a stream of spectra on a pool of worker processes
+# Chunks are read lazily and at most 2 * workers chunks are in flight at any time, so memory stays bounded
+# Spectra (or SpectrumDocuments) are yielded in input order, spectra rejected by the filters are dropped
+def preprocess_spectra(spectrums, convert_to_document=True, workers=None, chunk_size=1000):
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    chunks = _chunks(spectrums, chunk_size)
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield from _merge_chunk(_preprocess_chunk(chunk, convert_to_document))
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_preprocess_chunk, (chunk, convert_to_document)))
+            if len(pending) >= 2 * workers:
+                yield from _merge_chunk(pending.popleft().get())
+        while pending:
+            yield from _merge_chunk(pending.popleft().get())
+
+# The manifest next to a model lists the cache keys of the files it was trained on
+def manifest_path(model_file):
+    return f"{model_file}.manifest.json"
+
+def load_manifest(model_file):
+    path = manifest_path(model_file)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)["files"]
+
+def save_manifest(model_file, files):
+    with open(manifest_path(model_file), "w") as f:
+        json.dump({"files": files}, f, indent=2, sort_keys=True)
+
+# Epochs after which the model is saved, the last epoch is always included
+def checkpoint_iterations(epochs, checkpoint_every=None):
+    if checkpoint_every is None:
+        return [epochs]
+    return list(range(checkpoint_every, epochs, checkpoint_every)) + [epochs]
+
+# Continue training a loaded word2vec model on new documents
+# The vocabulary is extended with the words of the new documents, replay documents (a sample of the documents the model
+# was already trained on) are mixed in so the vectors of the old words do not drift away from the new ones
+# documents and replay_documents can be lists or restartable iterables such as corpus.TokenCorpus
+def continue_word2vec_training(model, documents, replay_documents=(), epochs=10, workers=None,
+                               filename=None, checkpoint_every=None, progress_logger=True):
+    from spec2vec.utils import ModelSaver, TrainingProgressLogger
+
+    model.build_vocab(documents, update=True)
+    training_corpus = corpus.ConcatCorpus(documents, replay_documents)
+    if workers is not None:
+        model.workers = workers
+
+    callbacks = []
+    if progress_logger:
+        callbacks.append(TrainingProgressLogger(epochs))
+    if filename:
+        callbacks.append(ModelSaver(epochs, checkpoint_iterations(epochs, checkpoint_every), filename))
+
+    model.train(training_corpus, total_examples=len(training_corpus), epochs=epochs, compute_loss=True, callbacks=callbacks)
+    return model
 
 if __name__ == "__main__":
     # Parse arguments
@@ -93,15 +256,35 @@ if __name__ == "__main__":
     parser.add_argument('--file_name_ending', type=str, default="TBDMS_RAW",
                         help='File name ending to filter files by')
     parser.add_argument('--preprocessed_dataset_folder', type=str, default="preprocessed",
-                        help='Path to the preprocessed dataset folder')
+                        help='Path to the folder where preprocessed spectra are cached')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='Preprocess all files again without reading or writing the cache')
+    # Kept so existing scripts keep working, the per file cache replaced the preprocessed.mgf export and documents.pickle
     parser.add_argument('--use_preprocessed_dataset', action='store_true',
-                        help='Use the preprocessed dataset if it exists')
+                        help='Deprecated, has no effect: preprocessed files are always reused from the cache (see --no_cache)')
     parser.add_argument('--use_documents_pickle', action='store_true',
-                        help='Use the documents pickle file if it exists')
+                        help='Deprecated, has no effect: documents.pickle is no longer written or read')
     parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
-                        help='Number of workers to use for training (default: number of CPUs)')
+                        help='Number of workers to use for preprocessing and training (default: number of CPUs)')
+    parser.add_argument('--chunk_size', type=int, default=1000,
+                        help='Number of spectra sent to a preprocessing worker at once (default: 1000)')
+    parser.add_argument('--resume_from', type=str, default=None,
+                        help='Path to a trained model, training continues on the files it was not trained on yet')
+    parser.add_argument('--replay_fraction', type=float, default=0.1,
+                        help='Fraction of the already trained documents mixed into the new ones with --resume_from (default: 0.1)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream the documents from token files in the preprocessed dataset folder instead of keeping them in memory')
+    parser.add_argument('--checkpoint_every', type=int, default=None,
+                        help='Save the model every N epochs (default: only at the end)')
+    instrumentation.add_arguments(parser)
 
     args = parser.parse_args()
+    if args.use_preprocessed_dataset or args.use_documents_pickle:
+        print("--use_preprocessed_dataset and --use_documents_pickle are deprecated and ignored, "
+              f"preprocessed spectra are cached per file in {args.preprocessed_dataset_folder}")
+
+    import gensim
+    from spec2vec.model_building import train_new_word2vec_model
 
     # Assign arguments to variables
     DATASET_FOLDER = args.dataset_folder
@@ -109,48 +292,75 @@ if __name__ == "__main__":
     EPOCHS = args.epochs
     FILE_NAME_ENDING = args.file_name_ending
     PREPROCESSED_DATASET_FOLDER = args.preprocessed_dataset_folder
-    USE_PREPROCESSED_DATASET = args.use_preprocessed_dataset
-    USE_DOCUMENTS_PICKLE = args.use_documents_pickle
+    CACHE_FOLDER = None if args.no_cache else PREPROCESSED_DATASET_FOLDER
     WORKERS = args.workers
+    CHUNK_SIZE = args.chunk_size
+    RESUME_FROM = args.resume_from
+    REPLAY_FRACTION = args.replay_fraction
+    CHECKPOINT_EVERY = args.checkpoint_every
+    STREAM = args.stream
 
-    # Create the preprocessed dataset folder if it doesn't exist
-    os.makedirs(PREPROCESSED_DATASET_FOLDER, exist_ok=True)
-
-    # Load the spectra from the dataset folder and preprocess them
-    data_already_preprocessed = USE_PREPROCESSED_DATASET and os.path.isdir(PREPROCESSED_DATASET_FOLDER) and len(os.listdir(PREPROCESSED_DATASET_FOLDER)) > 0
-    if not data_already_preprocessed:
-        spectrums = load_from_mgf_files(DATASET_FOLDER, file_name_ending=FILE_NAME_ENDING)
-        print("Using data from dataset")
-
-        spectrums = [metadata_processing(s) for s in spectrums]
-        spectrums = [peak_processing(s) for s in spectrums]
-    elif not USE_DOCUMENTS_PICKLE:
-        spectrums = load_from_mgf_files(PREPROCESSED_DATASET_FOLDER, file_name_ending=FILE_NAME_ENDING)
-        print("Using data from preprocessed dataset")
-        
-    if data_already_preprocessed and USE_DOCUMENTS_PICKLE:
-        with open(os.path.join(PREPROCESSED_DATASET_FOLDER, "documents.pickle"), "rb") as f:
-            documents = pickle.load(f)
-        print("Using stored documents")
-    else:
-        documents = [convert_to_document(s) for s in spectrums if len(s.intensities) > 0]
-        print("Using newly created documents")
+    # A folder (existing, or given with a trailing separator) gets the model saved as spec2vec.model inside it
+    if os.path.isdir(MODEL_SAVE_FILE) or MODEL_SAVE_FILE.endswith(os.sep):
+        MODEL_SAVE_FILE = os.path.join(MODEL_SAVE_FILE, "spec2vec.model")
+    os.makedirs(os.path.dirname(MODEL_SAVE_FILE) or ".", exist_ok=True)
 
-    # Train the model 
-    print(f"Training model with {EPOCHS} epochs on {len(documents)} documents")
-    model = train_new_word2vec_model(documents, iterations=EPOCHS, workers=WORKERS, progress_logger=True)
+    with instrumentation.run("train_spec2vec", args.metrics_file, args.profile):
+        # Files the resumed model was already trained on, identified by the hash of their content and preprocessing
+        trained_files = load_manifest(RESUME_FROM) if RESUME_FROM is not None else {}
 
-    # Save the model
-    os.makedirs(os.path.dirname(MODEL_SAVE_FILE), exist_ok=True)
-    if not os.path.isfile(MODEL_SAVE_FILE):
-        MODEL_SAVE_FILE = os.path.join(MODEL_SAVE_FILE, "spec2vec.model")
-    model.save(MODEL_SAVE_FILE)
-    print("Model saved to", MODEL_SAVE_FILE)
+        # Load the spectra from the dataset folder and preprocess them
+        # Every file is cached on its own, so only new or changed files are preprocessed again
+        # With --stream only the words of the documents are kept, in one token file per input file
+        # key is the cache key computed below, so every file is hashed only once per run
+        def load_documents(file_path, key):
+            with instrumentation.stage("preprocess", file=os.path.basename(file_path)):
+                if STREAM:
+                    return [tokenize_file(file_path, PREPROCESSED_DATASET_FOLDER, workers=WORKERS, chunk_size=CHUNK_SIZE, cache_folder=CACHE_FOLDER, key=key)]
+                return preprocess_file(file_path, workers=WORKERS, chunk_size=CHUNK_SIZE, cache_folder=CACHE_FOLDER, key=key)
+
+        documents = []
+        replay_documents = []
+        files = {}
+        settings = preprocessing_settings()
+        for file_path in find_mgf_files(DATASET_FOLDER, file_name_ending=FILE_NAME_ENDING):
+            key = preprocessing_cache.cache_key(file_path, settings)
+            files[key] = os.path.basename(file_path)
+            if key in trained_files:
+                if REPLAY_FRACTION <= 0:
+                    continue
+                print(f"Loading {os.path.basename(file_path)} (replay)")
+                replay_documents.extend(load_documents(file_path, key))
+                continue
+            print(f"Loading {os.path.basename(file_path)}")
+            documents.extend(load_documents(file_path, key))
+
+        if STREAM:
+            documents = corpus.TokenCorpus(documents)
+            replay_documents = corpus.TokenCorpus(replay_documents, fraction=REPLAY_FRACTION)
+        else:
+            replay_documents = random.Random(0).sample(replay_documents, int(len(replay_documents) * REPLAY_FRACTION))
 
-    # Save the spectra as MGF files
-    if not data_already_preprocessed:
-        save_as_mgf(spectrums, os.path.join(PREPROCESSED_DATASET_FOLDER, "preprocessed.mgf"))
+        # Train the model, intermediate models are saved as {model}_iter_{epoch}.model
+        iterations = checkpoint_iterations(EPOCHS, CHECKPOINT_EVERY)
+        instrumentation.count("documents", len(documents))
+        with instrumentation.stage("train", epochs=EPOCHS, documents=len(documents)):
+            if RESUME_FROM is None:
+                print(f"Training model with {EPOCHS} epochs on {len(documents)} documents")
+                model = train_new_word2vec_model(documents, iterations=iterations, filename=MODEL_SAVE_FILE,
+                                                 workers=WORKERS, progress_logger=True)
+            else:
+                model = gensim.models.Word2Vec.load(RESUME_FROM)
+                if len(documents) == 0:
+                    print(f"No new files to train {RESUME_FROM} on")
+                else:
+                    print(f"Continuing training of {RESUME_FROM} with {EPOCHS} epochs on {len(documents)} new and {len(replay_documents)} replayed documents")
+                    model = continue_word2vec_training(model, documents, replay_documents, epochs=EPOCHS, workers=WORKERS,
+                                                       filename=MODEL_SAVE_FILE, checkpoint_every=CHECKPOINT_EVERY)
+                files = {**trained_files, **files}
 
-    # Save documents with pickle
-    with open(os.path.join(PREPROCESSED_DATASET_FOLDER, "documents.pickle"), "wb") as f:
-        pickle.dump(documents, f)
\ No newline at end of file
+        # Save the model and the files it was trained on
+        with instrumentation.stage("save"):
+            model.save(MODEL_SAVE_FILE)
+            save_manifest(MODEL_SAVE_FILE, files)
+        print("Model saved to", MODEL_SAVE_FILE)
@@ -0,0 +1,56 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import pytest
+from spec2vec import SpectrumDocument
+
+from benchmarks import synthetic
+
+# Synthetic spectra and a small word2vec model trained on them, shared by the tests
+@pytest.fixture(scope="session")
+def documents():
+    spectra, _ = synthetic.generate_spectra(60, random_state=0)
+    return [SpectrumDocument(s, n_decimals=2) for s in spectra]
+
+@pytest.fixture(scope="session")
+def spec2vec_model_file(documents, tmp_path_factory):
+    from spec2vec.model_building import train_new_word2vec_model
+    model_file = str(tmp_path_factory.mktemp("spec2vec") / "spec2vec.model")
+    train_new_word2vec_model(documents, iterations=[2], filename=model_file, progress_logger=False,
+                             vector_size=16, workers=1, seed=0)
+    return model_file
+
+# Local HTTP server standing in for the UniChem and ChemSpider APIs
+# Tests set server.respond to a function of the unquoted request path returning (status, body), server.requests
+# lists the paths of all requests received
+@pytest.fixture
+def stub_server():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = unquote(self.path)
+            with server.lock:
+                server.requests.append(path)
+            status, body = server.respond(path)
+            try:
+                self.send_response(status)
+                self.send_header("Content-Type", "text/plain")
+                self.end_headers()
+                self.wfile.write(body.encode("utf-8"))
+            except OSError:
+                pass # the client gave up waiting
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.respond = lambda path: (404, "")
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
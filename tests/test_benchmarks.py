@@ -0,0 +1,94 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from benchmarks import run, synthetic
+from mass_spectra.train_spec2vec import load_from_mgf, metadata_processing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_synthetic_data_is_reproducible(tmp_path):
+    path, compounds = synthetic.write_mgf(str(tmp_path), 25, random_state=3)
+    np.testing.assert_array_equal(compounds, np.arange(25) % len(synthetic.KNOWN_COMPOUNDS))
+    spectra = list(load_from_mgf(path))
+    expected, _ = synthetic.generate_spectra(25, random_state=3)
+    assert len(spectra) == 25
+    for s, e in zip(spectra, expected):
+        np.testing.assert_allclose(s.peaks.mz, e.peaks.mz)
+
+    # Written again without appending to the existing file
+    synthetic.write_mgf(str(tmp_path), 25, random_state=3)
+    assert len(list(load_from_mgf(path))) == 25
+
+# Titles are parsed into the InChI keys of the known compounds, as the NIST titles
+def test_synthetic_titles_carry_the_inchikey():
+    spectra, compounds = synthetic.generate_spectra(len(synthetic.KNOWN_COMPOUNDS))
+    for s, c in zip(spectra, compounds):
+        assert metadata_processing(s).get("inchikey") == synthetic.KNOWN_COMPOUNDS[c][1]
+
+def test_generated_fingerprints_follow_compounds():
+    bits = synthetic.generate_fingerprints([0, 1, 0], n_bits=20)
+    assert bits.shape == (3, 20) and set(np.unique(bits)) <= {0, 1}
+    np.testing.assert_array_equal(bits[0], bits[2])
+    assert synthetic.generate_inchis(12)[11] == synthetic.KNOWN_COMPOUNDS[1][0]
+
+def test_benchmark_records_and_skips_stages():
+    benchmark = run.Benchmark(stages=["load_mgf", "metadata_processing", "peak_processing", "word2vec"])
+    assert benchmark.run("load_mgf", 10, lambda: [1, 2]) == [1, 2]
+    assert benchmark.run("embed", 10, lambda: 1) is None
+
+    def missing():
+        import a_module_that_is_not_installed
+    benchmark.run("metadata_processing", 10, missing)
+    benchmark.run("peak_processing", 10, lambda: 1)
+
+    result = benchmark.results["load_mgf"]
+    assert result["items"] == 10 and result["seconds"] >= 0
+    assert set(result) == {"seconds", "items", "items_per_second", "peak_rss_mb", "peak_rss_children_mb"}
+    assert benchmark.results["embed"] == {"skipped": "not selected"}
+    assert benchmark.results["metadata_processing"] == {"skipped": "missing dependency: a_module_that_is_not_installed"}
+    assert benchmark.results["peak_processing"] == {"skipped": "requires metadata_processing"}
+
+# The fitted exponent of the power law is the slope in log-log space
+def test_scaling_exponent():
+    results = {str(n): {"embed": {"seconds": 1e-6 * n ** 2}, "fingerprint": {"skipped": "missing dependency: scyjava"}}
+               for n in (100, 1000, 10000)}
+    curves = run.scaling(results)
+    assert list(curves) == ["embed"]
+    assert curves["embed"]["sizes"] == [100, 1000, 10000]
+    assert curves["embed"]["exponent"] == pytest.approx(2)
+    assert run.scaling({"100": {"embed": {"seconds": 1.0}}})["embed"]["exponent"] is None
+
+def test_history_is_appended(tmp_path):
+    path = str(tmp_path / "history" / "history.json")
+    assert run.load_history(path) == []
+    run.save_history(path, [{"commit": "a"}])
+    run.save_history(path, run.load_history(path) + [{"commit": "b"}])
+    assert [e["commit"] for e in run.load_history(path)] == ["a", "b"]
+    assert os.listdir(tmp_path / "history") == ["history.json"]
+
+# Small end to end run of the command line tool, stages with missing dependencies (scyjava) are recorded as skipped
+def test_cli_appends_results(tmp_path):
+    history = str(tmp_path / "history.json")
+    args = [sys.executable, "-m", "benchmarks.run", "--sizes", "30", "60", "--epochs", "1", "--vector_size", "8",
+            "--workers", "1", "--history", history]
+    run.save_history(history, [{"commit": "earlier"}])
+    result = subprocess.run(args, cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    with open(history) as f:
+        entries = json.load(f)
+    assert len(entries) == 2 and entries[0] == {"commit": "earlier"}
+    entry = entries[-1]
+    assert entry["settings"]["sizes"] == [30, 60]
+    assert set(entry["results"]) == {"30", "60"}
+    assert set(entry["results"]["30"]) == set(run.STAGES)
+    for stage in ("load_mgf", "word2vec", "embed", "model_predict"):
+        assert entry["results"]["60"][stage]["items"] > 0
+        assert entry["scaling"][stage]["sizes"] == [30, 60]
+    assert entry["results"]["60"]["load_mgf"]["items"] == 60
+    assert "seconds" in entry["results"]["60"]["fingerprint"] or "scyjava" in entry["results"]["60"]["fingerprint"]["skipped"]
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from mass_spectra.bit_selection import BitSelection, pack_columns, select_bits
+
+# 13 rows, so the packed columns end in a partially filled byte
+BITS = np.array([
+    # constant 0, constant 1, a, copy of a, b, not b, c, c with one row flipped
+    [0, 1, 1, 1, 0, 1, 0, 0],
+    [0, 1, 0, 0, 1, 0, 1, 1],
+    [0, 1, 1, 1, 1, 0, 0, 0],
+    [0, 1, 0, 0, 0, 1, 1, 1],
+    [0, 1, 1, 1, 0, 1, 1, 1],
+    [0, 1, 0, 0, 1, 0, 0, 0],
+    [0, 1, 1, 1, 1, 0, 1, 1],
+    [0, 1, 1, 1, 0, 1, 0, 0],
+    [0, 1, 0, 0, 0, 1, 1, 1],
+    [0, 1, 0, 0, 1, 0, 0, 1],
+    [0, 1, 1, 1, 1, 0, 1, 1],
+    [0, 1, 0, 0, 0, 1, 0, 0],
+    [0, 1, 1, 1, 1, 0, 1, 1],
+], dtype=np.uint8)
+
+def test_pack_columns_matches_packbits():
+    expected = np.packbits(BITS, axis=0).T
+    np.testing.assert_array_equal(pack_columns(BITS, block_size=8), expected)
+    np.testing.assert_array_equal(pack_columns(np.packbits(BITS, axis=1), packed=True, n_bits=8, block_size=8), expected)
+    with pytest.raises(ValueError):
+        pack_columns(BITS, block_size=12)
+
+def test_removes_constant_and_duplicate_bits():
+    assert select_bits(BITS).selected == [2, 4, 5, 6, 7]
+    assert select_bits(BITS, remove_constant=False).selected == [0, 1, 2, 4, 5, 6, 7]
+    assert select_bits(BITS, remove_duplicates=False).selected == [2, 3, 4, 5, 6, 7]
+    assert select_bits(BITS, remove_constant=False, remove_duplicates=False).selected == list(range(8))
+
+def test_removes_bits_correlated_with_an_earlier_kept_bit():
+    correlation = np.abs(np.corrcoef(BITS[:, [6, 7]].T)[0, 1])
+    assert select_bits(BITS, correlation_threshold=1.0).selected == [2, 4, 6, 7]
+    assert select_bits(BITS, correlation_threshold=correlation - 1e-6).selected == [2, 4, 6]
+    assert select_bits(BITS, correlation_threshold=correlation + 1e-6).selected == [2, 4, 6, 7]
+
+@pytest.mark.parametrize("block_size", [8, 8192])
+def test_packed_input_gives_the_same_selection(block_size):
+    packed = np.packbits(BITS, axis=1)
+    for options in ({}, {"correlation_threshold": 0.9}):
+        assert (select_bits(packed, packed=True, n_bits=8, block_size=block_size, **options).selected
+                == select_bits(BITS, block_size=block_size, **options).selected)
+
+def test_data_frame_columns_are_kept():
+    frame = pd.DataFrame(BITS, columns=[f"fp_{i}" for i in range(8)])
+    selection = select_bits(frame)
+    assert selection.selected == ["fp_2", "fp_4", "fp_5", "fp_6", "fp_7"]
+    assert list(selection.apply(frame).columns) == selection.selected
+    np.testing.assert_array_equal(selection.apply(BITS), BITS[:, [2, 4, 5, 6, 7]])
+    np.testing.assert_array_equal(selection.mask, [False, False, True, False, True, True, True, True])
+    with pytest.raises(ValueError):
+        selection.apply(BITS[:, :7])
+    with pytest.raises(ValueError):
+        select_bits(BITS, columns=["a", "b"])
+
+@pytest.mark.parametrize("columns", [list(range(100, 108)), [f"fp_{i}" for i in range(8)], [1, "b", 3, "d", 5, "f", 7, "h"]])
+def test_save_load_round_trip(tmp_path, columns):
+    frame = pd.DataFrame(BITS, columns=columns)
+    selection = select_bits(frame)
+    path = str(tmp_path / "selection" / "fingerprint_selection.json")
+    selection.save(path)
+    loaded = BitSelection.load(path)
+    assert loaded.columns == list(columns) and loaded.selected == selection.selected
+    pd.testing.assert_frame_equal(loaded.apply(frame), selection.apply(frame))
+    np.testing.assert_array_equal(loaded.apply(BITS), selection.apply(BITS))
+
+def test_unstorable_column_names(tmp_path):
+    with pytest.raises(TypeError):
+        BitSelection([("a", 1)], [("a", 1)]).save(str(tmp_path / "selection.json"))
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from helper import compound_querier
+from helper.compound_store import CompoundStore
+
+METHANE = {"smiles": "C", "inchi": "InChI=1S/CH4/h1H4", "inchi_key": "VNWKTOKETHGBQD-UHFFFAOYSA-N"}
+ETHANE = {"smiles": "CC", "inchi": "InChI=1S/C2H6/c1-2/h1-2H3", "inchi_key": "OTMSDBZUPAUEDD-UHFFFAOYSA-N"}
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "compounds" / "compounds.sqlite")
+
+def test_lookup_by_every_column(store_path):
+    store = CompoundStore(store_path)
+    store.add(METHANE)
+    store.add(ETHANE)
+    for column in ("smiles", "inchi", "inchi_key"):
+        assert store.get(column, METHANE[column]) == METHANE
+        assert store.get(column, ETHANE[column]) == ETHANE
+        assert store.get(column, "unknown") is None
+    assert len(store) == 2
+
+def test_contains_matches_any_known_value(store_path):
+    store = CompoundStore(store_path)
+    store.add(METHANE)
+    assert store.contains({"inchi_key": METHANE["inchi_key"]})
+    assert store.contains({"smiles": "unknown", "inchi": METHANE["inchi"]})
+    assert not store.contains({"smiles": ETHANE["smiles"], "inchi_key": None})
+    assert not store.contains({})
+
+def test_missing_values_are_stored_as_none(store_path):
+    store = CompoundStore(store_path)
+    store.add({"smiles": "C", "inchi": np.nan})
+    assert store.get("smiles", "C") == {"smiles": "C", "inchi": None, "inchi_key": None}
+    assert store.indexes["inchi"] == {} and store.indexes["inchi_key"] == {}
+
+# The first compound with a value keeps it, as a lookup in the old data frame returned the first matching row
+def test_duplicates_resolve_to_the_first_compound(store_path):
+    store = CompoundStore(store_path)
+    store.add(METHANE)
+    store.add({**ETHANE, "smiles": METHANE["smiles"]})
+    assert store.get("smiles", "C") == METHANE
+    assert store.get("inchi_key", ETHANE["inchi_key"])["smiles"] == "C"
+    assert len(store) == 2
+
+def test_only_flushed_compounds_are_reloaded(store_path):
+    store = CompoundStore(store_path)
+    store.add(METHANE)
+    store.flush()
+    store.add(ETHANE)
+    assert CompoundStore(store_path).to_frame().to_dict("records") == [METHANE]
+
+    store.flush()
+    store.flush()
+    reloaded = CompoundStore(store_path)
+    assert reloaded.to_frame().to_dict("records") == [METHANE, ETHANE]
+    assert reloaded.get("inchi", ETHANE["inchi"]) == ETHANE
+
+def test_to_frame_has_the_store_columns(store_path):
+    frame = CompoundStore(store_path, columns=["inchi_key", "smiles"]).to_frame()
+    assert list(frame.columns) == ["inchi_key", "smiles"] and len(frame) == 0
+
+@pytest.fixture
+def querier(tmp_path, monkeypatch):
+    monkeypatch.setattr(compound_querier, "STORE_SOURCE", str(tmp_path / "compounds.sqlite"))
+    monkeypatch.setattr(compound_querier, "MAIN_DATA_SOURCE", str(tmp_path / "compounds.pkl"))
+    monkeypatch.setattr(compound_querier, "_store", None)
+    return compound_querier
+
+# Missing columns are queried from the columns the compound was given with (no InChI key to SMILES lookup exists)
+def test_add_compounds_exports_the_pickle(querier, monkeypatch):
+    monkeypatch.setattr(querier, "query", lambda url_format, value: {"inchi_key_to_smiles": None,
+                                                                    "inchi_key_to_inchi": ETHANE["inchi"]}[url_format])
+    querier.add_compounds(pd.DataFrame([METHANE]))
+    querier.add_compounds([METHANE, {"inchi_key": ETHANE["inchi_key"]}])
+    ethane = {**ETHANE, "smiles": None}
+    assert pd.read_pickle(querier.MAIN_DATA_SOURCE).to_dict("records") == [METHANE, ethane]
+    assert querier.get_compound(ETHANE["inchi_key"]).to_dict() == ethane
+    assert querier.get_compound("unknown") is None
+
+def test_add_compounds_without_export(querier):
+    querier.add_compounds(METHANE, export=False)
+    assert not querier.os.path.exists(querier.MAIN_DATA_SOURCE)
+    querier.export_pickle(querier.MAIN_DATA_SOURCE)
+    assert pd.read_pickle(querier.MAIN_DATA_SOURCE).to_dict("records") == [METHANE]
+
+# Compounds of a compounds.pkl written by earlier versions are imported into a new store
+def test_store_imports_the_legacy_pickle(querier):
+    pd.DataFrame([METHANE, ETHANE]).to_pickle(querier.MAIN_DATA_SOURCE)
+    assert len(querier.get_store()) == 2
+    assert querier.STORE.get("smiles", "CC") == ETHANE
+    assert CompoundStore(querier.STORE_SOURCE).to_frame().to_dict("records") == [METHANE, ETHANE]
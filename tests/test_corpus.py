@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+from spec2vec.model_building import train_new_word2vec_model
+
+from benchmarks import synthetic
+from mass_spectra import corpus
+from mass_spectra.train_spec2vec import tokenize_file
+
+def test_token_file_round_trip(documents, tmp_path):
+    path = corpus.token_path(str(tmp_path / "tokens"), "key")
+    corpus.save_tokens(path, documents)
+    tokens = corpus.TokenCorpus(path)
+    assert list(tokens) == [d.words for d in documents]
+    # every pass reads the file again
+    assert list(tokens) == list(tokens)
+    assert len(tokens) == len(documents)
+    assert not os.path.exists(f"{path}.tmp")
+
+def test_fraction_yields_the_same_subset_on_every_pass(documents, tmp_path):
+    path = corpus.token_path(str(tmp_path), "key")
+    corpus.save_tokens(path, documents)
+    tokens = corpus.TokenCorpus(path, fraction=0.5, seed=1)
+    first = list(tokens)
+    assert first == list(tokens)
+    assert 0 < len(first) < len(documents) and len(tokens) == len(first)
+    assert all(words in [d.words for d in documents] for words in first)
+
+def test_concat_corpus(documents, tmp_path):
+    paths = [corpus.token_path(str(tmp_path), key) for key in ("a", "b")]
+    corpus.save_tokens(paths[0], documents[:10])
+    corpus.save_tokens(paths[1], documents[10:25])
+    concat = corpus.ConcatCorpus(corpus.TokenCorpus(paths), [d.words for d in documents[25:30]])
+    assert len(concat) == 30
+    assert list(concat) == [d.words for d in documents[:30]]
+
+# A model trained on the streamed token files is the same as one trained on the documents in memory
+def test_streamed_training_matches_in_memory_training(documents, tmp_path):
+    path = corpus.token_path(str(tmp_path), "key")
+    corpus.save_tokens(path, documents)
+    options = dict(iterations=[2], progress_logger=False, vector_size=16, workers=1, seed=0)
+    streamed = train_new_word2vec_model(corpus.TokenCorpus(path), **options)
+    in_memory = train_new_word2vec_model(documents, **options)
+    assert streamed.wv.index_to_key == in_memory.wv.index_to_key
+    np.testing.assert_allclose(streamed.wv.vectors, in_memory.wv.vectors, rtol=1e-5)
+
+def test_tokenize_file_reuses_existing_token_files(tmp_path, capsys):
+    mgf, _ = synthetic.write_mgf(str(tmp_path), 30)
+    path = tokenize_file(mgf, str(tmp_path / "tokens"), workers=1)
+    assert len(corpus.TokenCorpus(path)) > 0
+    modified = os.path.getmtime(path)
+    assert tokenize_file(mgf, str(tmp_path / "tokens"), workers=1) == path
+    assert os.path.getmtime(path) == modified
+    assert "Using token file" in capsys.readouterr().out
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from sklearn.tree import DecisionTreeClassifier
+
+from mass_spectra import cross_validation
+from mass_spectra.cross_validation import cross_validate, group_splits, kfold_splits, load_fold
+from mass_spectra.store import PackedBits, load_dataset, save_dataset
+
+# Collects the arguments of Metrics.evaluate
+class Recorder:
+    def __init__(self):
+        self.folds = []
+
+    def evaluate(self, y_true, y_prob, y_pred, model_training_data_path=None):
+        self.folds.append((np.asarray(y_true), np.asarray(y_pred), model_training_data_path))
+
+@pytest.fixture
+def dataset(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(60, 4))
+    y = np.stack([X[:, 0] > 0, X[:, 1] > 0, X[:, 0] + X[:, 2] > 0], axis=1).astype(np.uint8)
+    save_dataset(str(tmp_path / "merged"), X, y, None)
+    return X.astype(np.float32), y, str(tmp_path / "merged")
+
+def test_kfold_splits_cover_every_row_once_per_repeat():
+    splits = list(kfold_splits(23, repeats=2, k=5, random_state=0))
+    assert [name for name, _, _ in splits[:6]] == ["0_0", "0_1", "0_2", "0_3", "0_4", "1_0"]
+    for repeat in (splits[:5], splits[5:]):
+        assert sorted(np.concatenate([test for _, _, test in repeat])) == list(range(23))
+    assert all(len(np.intersect1d(train, test)) == 0 for _, train, test in splits)
+
+def test_group_splits_hide_whole_groups():
+    group_ids = np.array([0, 0, 1, 2, 2, 3, 4, 4, 4])
+    splits = list(group_splits(group_ids, [4, 2, 0, 1, 3], 2))
+    assert [name for name, _, _ in splits] == ["0_2", "2_5"]
+    np.testing.assert_array_equal(splits[0][2], [3, 4, 6, 7, 8])
+    np.testing.assert_array_equal(splits[1][2], [0, 1, 2, 5])
+    for _, train, test in splits:
+        assert not set(group_ids[train]) & set(group_ids[test])
+
+# Stored datasets are shared with the workers through their own files, other arrays are written to the temporary folder
+def test_memory_maps_are_shared_by_file(dataset, tmp_path):
+    _, _, folder = dataset
+    X, y, _ = load_dataset(folder)
+    spill = tmp_path / "spill"
+    spill.mkdir()
+    assert cross_validation._share(X, str(spill), "X")[0] == "memmap"
+    assert cross_validation._share(y, str(spill), "y")[1][0] == "memmap"
+    assert list(spill.iterdir()) == []
+
+    assert cross_validation._share(X[10:], str(spill), "view")[0] == "file"
+    assert cross_validation._share(np.asarray(X), str(spill), "array")[0] == "file"
+    for source, expected in ((cross_validation._share(X, str(spill), "X"), X), (cross_validation._share(X[10:], str(spill), "view"), X[10:])):
+        np.testing.assert_array_equal(cross_validation._open(source), expected)
+    opened = cross_validation._open(cross_validation._share(y, str(spill), "y"))
+    assert isinstance(opened, PackedBits)
+    np.testing.assert_array_equal(np.asarray(opened), np.asarray(y))
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_folds_match_in_process_and_on_workers(dataset, tmp_path, workers):
+    X, y, folder = dataset
+    splits = list(kfold_splits(len(X), repeats=1, k=3, random_state=0))
+    expected = Recorder()
+    cross_validate(DecisionTreeClassifier(random_state=0), X, y, splits, expected)
+
+    X_stored, y_stored, _ = load_dataset(folder)
+    recorder = Recorder()
+    paths = cross_validate(DecisionTreeClassifier(random_state=0), X_stored, y_stored, splits, recorder,
+                           output_folder=str(tmp_path / "models"), workers=workers)
+    assert [path for _, _, path in recorder.folds] == paths
+    for (y_true, y_pred, _), (expected_true, expected_pred, _) in zip(recorder.folds, expected.folds):
+        np.testing.assert_array_equal(y_true, expected_true)
+        np.testing.assert_array_equal(y_pred, expected_pred)
+
+    fold = load_fold(paths[1], X_stored, y_stored)
+    np.testing.assert_array_equal(fold["y_test"], y[splits[1][2]])
+    np.testing.assert_array_equal(fold["model"].predict(fold["X_test"]), recorder.folds[1][1])
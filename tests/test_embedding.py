@@ -0,0 +1,46 @@
+import gensim
+import numpy as np
+import pytest
+from spec2vec import SpectrumDocument
+from spec2vec.vector_operations import calc_vector
+
+from benchmarks import synthetic
+from mass_spectra.embedding import embed_documents
+
+@pytest.fixture(scope="module")
+def model(spec2vec_model_file):
+    return gensim.models.Word2Vec.load(spec2vec_model_file)
+
+# Spectra the model was not trained on, so part of their words are missing from the vocabulary
+@pytest.fixture(scope="module")
+def unseen_documents():
+    spectra, _ = synthetic.generate_spectra(30, random_state=1)
+    return [SpectrumDocument(s, n_decimals=2) for s in spectra]
+
+@pytest.mark.parametrize("intensity_weighting_power", [0, 0.5, 1])
+@pytest.mark.parametrize("allowed_missing_percentage", [0, 10, 50, 100])
+def test_matches_calc_vector(model, documents, unseen_documents, intensity_weighting_power, allowed_missing_percentage):
+    batch = documents[:20] + unseen_documents
+    embeddings = embed_documents(model, batch, intensity_weighting_power, allowed_missing_percentage, batch_size=7)
+    expected = np.array([calc_vector(model, d, intensity_weighting_power, allowed_missing_percentage) for d in batch])
+    assert embeddings.shape == (len(batch), model.vector_size)
+    np.testing.assert_allclose(embeddings, expected, rtol=1e-4, atol=1e-5)
+
+def test_documents_without_known_words_are_empty(model, documents):
+    # Words outside the m/z range of the synthetic spectra
+    unknown = SpectrumDocument(synthetic.generate_spectra(1, random_state=2)[0][0], n_decimals=2)
+    unknown.words = [f"peak@{i}.5" for i in range(2000, 2010)]
+    unknown.weights = [0.5] * 10
+    embeddings = embed_documents(model, [documents[0], unknown])
+    assert not np.any(embeddings[1])
+    assert np.any(embeddings[0])
+
+def test_writes_into_out(model, documents):
+    out = np.zeros((5, model.vector_size), dtype=np.float32)
+    assert embed_documents(model, documents[:5], out=out) is out
+    with pytest.raises(ValueError):
+        embed_documents(model, documents[:5], out=np.zeros((4, model.vector_size), dtype=np.float32))
+
+def test_rejects_invalid_allowed_missing_percentage(model, documents):
+    with pytest.raises(ValueError):
+        embed_documents(model, documents[:1], allowed_missing_percentage=101)
@@ -0,0 +1,49 @@
+import threading
+
+from mass_spectra import instrumentation
+
+def test_collect_only_sees_the_counts_of_its_thread():
+    instrumentation.reset()
+    started, done = threading.Barrier(2), []
+
+    def collecting():
+        with instrumentation.collect() as counts:
+            started.wait()
+            for _ in range(1000):
+                instrumentation.count("collected")
+        done.append(counts)
+
+    def counting():
+        started.wait()
+        for _ in range(1000):
+            instrumentation.count("process")
+
+    threads = [threading.Thread(target=collecting), threading.Thread(target=counting)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert done == [{"collected": 1000}]
+    assert instrumentation.counters() == {"process": 1000}
+
+def test_nested_collect_restores_the_outer_counter():
+    instrumentation.reset()
+    with instrumentation.collect() as outer:
+        instrumentation.count("outer")
+        with instrumentation.collect() as inner:
+            instrumentation.count("inner", 2)
+        instrumentation.merge(inner)
+        instrumentation.count("outer")
+    assert inner == {"inner": 2}
+    assert outer == {"outer": 2}
+    assert instrumentation.counters() == {"inner": 2}
+
+def test_concurrent_merges_are_not_lost():
+    instrumentation.reset()
+    threads = [threading.Thread(target=lambda: [instrumentation.merge({"merged": 1}) for _ in range(1000)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert instrumentation.counters() == {"merged": 8000}
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from mass_spectra.knn_index import CosineIndex, normalize, top_k
+
+# Clustered vectors, like embeddings of spectra of related compounds
+def clustered_vectors(n, n_clusters=20, dimensions=32, random_state=0):
+    rng = np.random.default_rng(random_state)
+    centers = rng.normal(size=(n_clusters, dimensions))
+    return centers[rng.integers(0, n_clusters, n)] + 0.3 * rng.normal(size=(n, dimensions))
+
+def test_normalize_keeps_zero_rows():
+    vectors = normalize([[3, 4], [0, 0]])
+    np.testing.assert_allclose(vectors, [[0.6, 0.8], [0, 0]])
+
+def test_top_k_is_sorted_and_clipped():
+    scores, indices = top_k(np.array([[0.1, 0.9, 0.5], [0.3, 0.2, 0.1]]), 5)
+    np.testing.assert_array_equal(indices, [[1, 2, 0], [0, 1, 2]])
+    np.testing.assert_allclose(scores, [[0.9, 0.5, 0.1], [0.3, 0.2, 0.1]])
+
+def test_exact_search_matches_brute_force():
+    references = clustered_vectors(500)
+    queries = clustered_vectors(50, random_state=1)
+    scores, indices = CosineIndex(block_size=16).fit(references).search(queries, 10)
+    expected = normalize(queries) @ normalize(references).T
+    np.testing.assert_array_equal(indices, np.argsort(-expected, axis=1, kind="stable")[:, :10])
+    np.testing.assert_allclose(scores, np.take_along_axis(expected, indices, axis=1), rtol=1e-5)
+
+@pytest.mark.parametrize("n_probe, min_recall", [(4, 0.9), (32, 1.0)])
+def test_ivf_recall_against_exact_search(n_probe, min_recall):
+    references = clustered_vectors(2000)
+    queries = clustered_vectors(200, random_state=1)
+    _, exact = CosineIndex().fit(references).search(queries, 10)
+    scores, approximate = CosineIndex(n_lists=32, n_probe=n_probe).fit(references).search(queries, 10)
+
+    recall = np.mean([len(np.intersect1d(a, e)) / 10 for a, e in zip(approximate, exact)])
+    assert recall >= min_recall
+    # scores of the returned neighbours are their exact cosine similarities
+    expected = normalize(queries) @ normalize(references).T
+    np.testing.assert_allclose(scores, np.take_along_axis(expected, approximate, axis=1), rtol=1e-5)
+
+def test_missing_neighbours_are_marked():
+    references = clustered_vectors(5)
+    scores, indices = CosineIndex().fit(references).search(references[:2], 8)
+    assert np.all(indices[:, 5:] == -1) and np.all(np.isneginf(scores[:, 5:]))
+    np.testing.assert_array_equal(indices[:, 0], [0, 1])
+
+    scores, indices = CosineIndex(n_lists=3, n_probe=1).fit(references).search(references[:2], 8)
+    assert np.all(indices[:, 0] == [0, 1])
+    assert np.all((indices >= 0) == np.isfinite(scores))
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from mass_spectra import train_spec2vec
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules of the heavy (or optional) dependencies loaded by importing a module in a fresh interpreter
+def imported_modules(module, candidates):
+    code = f"import sys, {module}; print(','.join(m for m in {candidates!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return [m for m in result.stdout.strip().split(",") if m]
+
+@pytest.mark.parametrize("module, candidates", [
+    ("mass_spectra.compound_info", ["pandas", "chembl_webresource_client", "scyjava"]),
+    ("mass_spectra.to_fingerprint", ["scyjava"]),
+    ("mass_spectra.train_spec2vec", ["matchms", "spec2vec", "gensim"]),
+    ("mass_spectra.to_spec2vec", ["pandas", "matchms", "spec2vec", "gensim"]),
+])
+def test_dependencies_are_imported_on_first_use(module, candidates):
+    assert imported_modules(module, candidates) == []
+
+def test_preprocessing_settings_are_only_a_function():
+    assert "matchms" in train_spec2vec.preprocessing_settings()
+    assert not hasattr(train_spec2vec, "PREPROCESSING_SETTINGS")
@@ -0,0 +1,150 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from benchmarks import synthetic
+from mass_spectra import to_fingerprint, to_spec2vec
+from mass_spectra.merge import DESCRIPTIVE_COLUMNS, merge
+from mass_spectra.store import load, load_dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+N_SPECTRA = 60
+
+def run_module(module, *args):
+    return subprocess.run([sys.executable, "-m", module, *args], cwd=ROOT, capture_output=True, text=True)
+
+# Embedding store written by the to_spec2vec command line tool
+@pytest.fixture(scope="module")
+def embedding_store(tmp_path_factory):
+    from spec2vec.model_building import train_new_word2vec_model
+
+    from mass_spectra.train_spec2vec import preprocess_file
+
+    folder = tmp_path_factory.mktemp("embedding")
+    mgf, _ = synthetic.write_mgf(str(folder), N_SPECTRA)
+    model_file = str(folder / "spec2vec.model")
+    train_new_word2vec_model(preprocess_file(mgf, workers=1), iterations=[2], filename=model_file, progress_logger=False,
+                             vector_size=16, workers=1, seed=0)
+    store = str(folder / "spec2vec.npy")
+    to_spec2vec.main([mgf, model_file, store])
+    return store
+
+# Fingerprint store written with the functions of the to_fingerprint command line tool, with synthetic bits instead of
+# CDK fingerprints for the InChI keys of the known compounds
+@pytest.fixture(scope="module")
+def fingerprint_store(tmp_path_factory):
+    inchikeys = [inchikey for _, inchikey, _ in synthetic.KNOWN_COMPOUNDS]
+    bits = synthetic.generate_fingerprints(np.arange(len(inchikeys)), n_bits=20)
+    packed, sizes = {"MACCSFingerprinter": np.packbits(bits, axis=1)}, {"MACCSFingerprinter": bits.shape[1]}
+    converted = np.ones(len(inchikeys), dtype=bool)
+    converted[3] = False # compound without fingerprint, its spectra are left out of the merge
+
+    fingerprints = to_fingerprint.fingerprints_to_frames(packed, sizes, converted, inchikeys)
+    index = to_fingerprint.pd.DataFrame([to_fingerprint.input_descriptors(k) for k in inchikeys], columns=DESCRIPTIVE_COLUMNS)
+    folder = tmp_path_factory.mktemp("fingerprint")
+    to_fingerprint.save_fingerprint_store(fingerprints, index, str(folder))
+    return str(folder / "MACCSFingerprinter"), bits, converted
+
+def test_stores_have_the_descriptive_columns(embedding_store, fingerprint_store):
+    for path in (embedding_store, fingerprint_store[0]):
+        _, index, _ = load(path, packed=True)
+        assert list(index.columns[:len(DESCRIPTIVE_COLUMNS)]) == DESCRIPTIVE_COLUMNS
+
+def test_cli_stores_merge(embedding_store, fingerprint_store, tmp_path):
+    fingerprint_path, bits, converted = fingerprint_store
+    result = run_module("mass_spectra.merge", embedding_store, fingerprint_path, str(tmp_path / "merged"))
+    assert result.returncode == 0, result.stderr
+
+    X, y, index = load_dataset(str(tmp_path / "merged"))
+    compound_of_key = {inchikey: i for i, (_, inchikey, _) in enumerate(synthetic.KNOWN_COMPOUNDS)}
+    compounds = np.array([compound_of_key[k] for k in index["inchi_key"]])
+    assert len(index) == N_SPECTRA - N_SPECTRA // len(synthetic.KNOWN_COMPOUNDS)
+    assert set(compounds) == set(np.flatnonzero(converted))
+    np.testing.assert_array_equal(y, bits[compounds])
+    assert X.shape == (len(index), 16)
+
+def test_merge_matches_embedding_rows(embedding_store, fingerprint_store):
+    X, _, index, _, _ = merge(embedding_store, fingerprint_store[0])
+    embeddings, embedding_index, _ = load(embedding_store)
+    for row in range(len(index)):
+        rows = np.flatnonzero(embedding_index["inchi_key"] == index["inchi_key"][row])
+        assert np.any(np.all(np.asarray(embeddings[rows]) == X[row], axis=1))
+
+# End to end with CDK fingerprints, needs scyjava (and a JVM)
+def test_fingerprint_cli_store_merges(embedding_store, tmp_path):
+    pytest.importorskip("scyjava")
+    inchis = ",".join(inchi for inchi, _, _ in synthetic.KNOWN_COMPOUNDS)
+    result = run_module("mass_spectra.to_fingerprint", inchis, "MACCSFingerprinter", "--inchi_array",
+                        "--output_folder", str(tmp_path / "fingerprint"))
+    assert result.returncode == 0, result.stderr
+    result = run_module("mass_spectra.merge", embedding_store, str(tmp_path / "fingerprint" / "MACCSFingerprinter"),
+                        str(tmp_path / "merged"))
+    assert result.returncode == 0, result.stderr
+    _, y, index = load_dataset(str(tmp_path / "merged"))
+    assert len(index) == N_SPECTRA and y.shape[1] == 166
+
+# The csv written by to_spec2vec keeps its layout (title, inchikey, then the vector), the .npy store gets the
+# descriptive columns
+def test_embedding_csv_layout(embedding_store, tmp_path):
+    folder = os.path.dirname(embedding_store)
+    mgf = os.path.join(folder, f"synthetic_{N_SPECTRA}_TBDMS_RAW.mgf")
+    csv = str(tmp_path / "spec2vec.csv")
+    to_spec2vec.main([mgf, os.path.join(folder, "spec2vec.model"), csv])
+
+    embedding_df = to_fingerprint.pd.read_csv(csv)
+    assert list(embedding_df.columns) == ["title", "inchikey"] + [str(i) for i in range(16)]
+    embeddings, index, _ = load(embedding_store)
+    np.testing.assert_array_equal(embedding_df["inchikey"], index["inchi_key"])
+    np.testing.assert_allclose(embedding_df[[str(i) for i in range(16)]].to_numpy(), np.asarray(embeddings), rtol=1e-6)
+
+# Stub CDK: every molecule is converted and has bit i % 8 set
+class StubFingerprinter:
+    def getSize(self):
+        return 8
+
+    def getBitFingerprint(self, atom_container):
+        return type("BitSet", (), {"getSetbits": lambda _: [atom_container % 8]})()
+
+@pytest.fixture
+def stub_cdk(monkeypatch):
+    described = []
+    def describe_molecule(atom_container, descriptors):
+        described.append(atom_container)
+        return {**descriptors, "smiles": f"C{atom_container}"}
+    monkeypatch.setattr(to_fingerprint, "create_fingerprinter", lambda fp: StubFingerprinter())
+    monkeypatch.setattr(to_fingerprint, "to_atom_container", lambda inchi, inchi_idx: inchi_idx)
+    monkeypatch.setattr(to_fingerprint, "describe_molecule", describe_molecule)
+    return described
+
+# Molecules are only described by CDK when the descriptive columns are requested
+def test_molecules_are_only_described_for_the_index(stub_cdk):
+    inchikeys = [inchikey for _, inchikey, _ in synthetic.KNOWN_COMPOUNDS]
+    fingerprints = to_fingerprint.generate_fingerprint(["MACCSFingerprinter"], inchikeys)
+    assert stub_cdk == []
+    np.testing.assert_array_equal(fingerprints["MACCSFingerprinter"]["bit_3"], np.arange(len(inchikeys)) % 8 == 3)
+
+    _, index = to_fingerprint.generate_fingerprint(["MACCSFingerprinter"], inchikeys, return_index=True)
+    assert stub_cdk == list(range(len(inchikeys)))
+    assert list(index["smiles"]) == [f"C{i}" for i in range(len(inchikeys))]
+    assert list(index["inchi_key"]) == inchikeys
+
+    stub_cdk.clear()
+    (_, _, _, descriptors), _ = to_fingerprint._compute_fingerprints_shard(["MACCSFingerprinter"], inchikeys[:2])
+    assert stub_cdk == [] and descriptors[0]["smiles"] is None
+    to_fingerprint._compute_fingerprints_shard(["MACCSFingerprinter"], inchikeys[:2], True)
+    assert stub_cdk == [0, 1]
+
+def test_describe_is_passed_to_the_workers(stub_cdk, monkeypatch):
+    calls = []
+    def compute_fingerprints_parallel(fingerprint_array, inchi_array, workers, describe=False):
+        calls.append(describe)
+        return to_fingerprint.compute_fingerprints(fingerprint_array, inchi_array, describe)
+    monkeypatch.setattr(to_fingerprint, "compute_fingerprints_parallel", compute_fingerprints_parallel)
+
+    inchikeys = [inchikey for _, inchikey, _ in synthetic.KNOWN_COMPOUNDS]
+    to_fingerprint.generate_fingerprint(["MACCSFingerprinter"], inchikeys, workers=2)
+    to_fingerprint.generate_fingerprint(["MACCSFingerprinter"], inchikeys, workers=2, return_index=True)
+    assert calls == [False, True]
@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+import sklearn
+import sklearn.metrics
+
+from mass_spectra import metrics
+from mass_spectra.metrics import AVERAGES, METRIC_NAMES, Y_PROB_SCORES, ConfusionCounts, Metrics, multilabel_scores
+
+# F-scores of ill-defined labels and the multi-label log_loss changed after sklearn 1.3 (the version pinned in
+# requirements.txt), the comparisons of these parts only run against the pinned version
+LEGACY_SKLEARN = tuple(int(v) for v in sklearn.__version__.split(".")[:2]) < (1, 4)
+legacy_only = pytest.mark.skipif(not LEGACY_SKLEARN, reason=f"semantics changed after scikit-learn 1.3 ({sklearn.__version__} installed)")
+
+def make_data(empty_labels=False, empty_samples=False, seed=0):
+    rng = np.random.default_rng(seed)
+    y_true = (rng.random((300, 70)) < 0.3).astype(np.uint8)
+    y_prob = np.round(rng.random((300, 70)), 2) # rounded to get tied scores
+    y_pred = (y_prob > 0.6).astype(np.uint8)
+    if empty_labels:
+        y_true[:, 0] = 0 # label without true and predicted positives
+        y_pred[:, 0] = 0
+        y_pred[:, 1] = 0 # label without predicted positives
+        y_true[:, 2] = 0 # label without true positives
+    if empty_samples:
+        y_true[:5] = 0 # samples without true positives
+        y_pred[3:8] = 0 # samples without predicted positives
+    return y_true, y_prob, y_pred
+
+DATASETS = {
+    "regular": make_data(),
+    "empty_labels": make_data(empty_labels=True),
+    "empty_samples": make_data(empty_samples=True),
+    "empty_labels_and_samples": make_data(empty_labels=True, empty_samples=True),
+}
+
+@pytest.fixture(params=list(DATASETS))
+def data(request):
+    return DATASETS[request.param]
+
+@pytest.mark.parametrize("zero_division", [0, 1, pytest.param(np.nan, marks=legacy_only)])
+@pytest.mark.parametrize("average", AVERAGES)
+@pytest.mark.parametrize("name", ["precision_score", "recall_score", "f1_score"])
+def test_averaged_scores_match_sklearn(data, name, average, zero_division):
+    y_true, _, y_pred = data
+    ours = getattr(metrics, name)(ConfusionCounts(y_true, y_pred), average, zero_division)
+    theirs = getattr(sklearn.metrics, name)(y_true, y_pred, average=average, zero_division=zero_division)
+    np.testing.assert_allclose(ours, theirs, rtol=1e-9, atol=1e-12)
+
+# sklearn does not accept zero_division=nan for jaccard_score
+@pytest.mark.parametrize("zero_division", [0, 1])
+@pytest.mark.parametrize("average", AVERAGES)
+def test_jaccard_matches_sklearn(data, average, zero_division):
+    y_true, _, y_pred = data
+    ours = metrics.jaccard_score(ConfusionCounts(y_true, y_pred), average, zero_division)
+    theirs = sklearn.metrics.jaccard_score(y_true, y_pred, average=average, zero_division=zero_division)
+    np.testing.assert_allclose(ours, theirs, rtol=1e-9, atol=1e-12)
+
+def test_sample_scores_match_sklearn(data):
+    y_true, _, y_pred = data
+    counts = ConfusionCounts(y_true, y_pred)
+    np.testing.assert_allclose(metrics.accuracy_score(counts), sklearn.metrics.accuracy_score(y_true, y_pred))
+    np.testing.assert_allclose(metrics.hamming_loss(counts), sklearn.metrics.hamming_loss(y_true, y_pred))
+
+@legacy_only
+def test_log_loss_matches_sklearn(data):
+    y_true, y_prob, y_pred = data
+    np.testing.assert_allclose(metrics.log_loss(y_true, y_pred), sklearn.metrics.log_loss(y_true, y_pred))
+    np.testing.assert_allclose(metrics.log_loss(y_true, y_prob), sklearn.metrics.log_loss(y_true, y_prob))
+
+def test_ranking_scores_match_sklearn(data):
+    y_true, y_prob, _ = data
+    np.testing.assert_allclose(metrics.label_ranking_loss(y_true, y_prob, block_size=64),
+                               sklearn.metrics.label_ranking_loss(y_true, y_prob))
+    np.testing.assert_allclose(metrics.coverage_error(y_true, y_prob), sklearn.metrics.coverage_error(y_true, y_prob))
+
+def test_roc_auc_matches_sklearn():
+    y_true, y_prob, _ = DATASETS["regular"]
+    np.testing.assert_allclose(metrics.roc_auc_score(y_true, y_prob), sklearn.metrics.roc_auc_score(y_true, y_prob))
+
+# sklearn raises for labels with only one class, the metric is NaN instead
+def test_roc_auc_of_constant_label_is_nan():
+    y_true, y_prob, _ = DATASETS["empty_labels"]
+    assert np.isnan(metrics.roc_auc_score(y_true, y_prob))
+
+# zero_division defaults to 0 as in the baseline notebook, np.nan is opt-in and leaves labels (and samples) without
+# predicted or true positives out of the averages instead of counting them as 0
+def test_nan_zero_division_skips_ill_defined_labels():
+    y_true, y_prob, y_pred = DATASETS["empty_labels"]
+    counts = ConfusionCounts(y_true, y_pred)
+    precision, recall, f_score = metrics.precision_recall_fscore(counts, average=None, zero_division=np.nan)
+    assert np.isnan(precision[[0, 1]]).all() and np.isnan(recall[[0, 2]]).all() and np.isnan(f_score[0])
+
+    scores = multilabel_scores(y_true, y_prob, y_pred, zero_division=np.nan)
+    assert scores["precision_score__macro"] == pytest.approx(np.nanmean(precision))
+    assert scores["recall_score__macro"] == pytest.approx(np.nanmean(recall))
+    assert scores["f1_score__macro"] == pytest.approx(np.nanmean(f_score))
+
+    default = multilabel_scores(y_true, y_prob, y_pred)
+    assert scores["precision_score__macro"] > default["precision_score__macro"]
+    assert scores["precision_score__macro"] == pytest.approx(np.mean(np.delete(precision, [0, 1])))
+    assert default["precision_score__macro"] == pytest.approx(np.mean(np.nan_to_num(precision)))
+    # jaccard keeps its zero_division of 0
+    assert scores["jaccard_score__macro"] == default["jaccard_score__macro"]
+
+def test_metrics_use_zero_division_of_zero_by_default():
+    y_true, y_prob, y_pred = DATASETS["empty_labels"]
+    collected = Metrics(repeats=1, folds=1)
+    collected.evaluate(y_true, y_prob, y_pred)
+    assert collected.current("precision_score__macro") == pytest.approx(
+        multilabel_scores(y_true, y_prob, y_pred, zero_division=0)["precision_score__macro"])
+
+    opted_in = Metrics(repeats=1, folds=1, zero_division=np.nan)
+    opted_in.evaluate(y_true, y_prob, y_pred)
+    assert opted_in.current("precision_score__macro") == pytest.approx(
+        multilabel_scores(y_true, y_prob, y_pred, zero_division=np.nan)["precision_score__macro"])
+    assert opted_in.current("precision_score__macro") != pytest.approx(collected.current("precision_score__macro"))
+
+# A metric that raises only sets its own score of the fold to NaN
+def test_failing_metric_keeps_the_other_scores(monkeypatch, capsys):
+    y_true, y_prob, y_pred = DATASETS["regular"]
+    expected = multilabel_scores(y_true, y_prob, y_pred)
+
+    def failing(y_true, y_prob):
+        raise ValueError("coverage failed")
+    monkeypatch.setattr(metrics, "coverage_error", failing)
+    with pytest.raises(ValueError):
+        multilabel_scores(y_true, y_prob, y_pred)
+
+    collected = Metrics(repeats=1, folds=1)
+    collected.evaluate(y_true, y_prob, y_pred)
+    assert "coverage failed" in capsys.readouterr().out
+    assert np.isnan(collected.current("coverage_error"))
+    for name in METRIC_NAMES:
+        if name != "coverage_error":
+            assert collected.current(name) == pytest.approx(expected[name])
+
+# Mismatched shapes fail the metrics of the thresholded predictions, the metrics of y_prob are still computed
+def test_mismatched_predictions_keep_the_probability_scores():
+    y_true, y_prob, y_pred = DATASETS["regular"]
+    expected = multilabel_scores(y_true, y_prob, y_pred)
+    collected = Metrics(repeats=1, folds=1)
+    collected.evaluate(y_true, y_prob, y_pred[:, :-1])
+    assert np.isnan(collected.current("accuracy_score")) and np.isnan(collected.current("f1_score__macro"))
+    for name in Y_PROB_SCORES:
+        assert collected.current(name) == pytest.approx(expected[name])
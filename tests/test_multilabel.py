@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from wrappers.multilabel import MultiLabel
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(150, 8))
+    y = (X[:, :6] > 0).astype(np.uint8)
+    y[:, 1] = 0 # constant labels are not trained
+    y[:, 4] = 1
+    return X, y
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        MultiLabel(backend="svm")
+
+def test_constant_labels_are_skipped(data):
+    X, y = data
+    model = MultiLabel(n_estimators=10, random_state=0).fit(X, y)
+    np.testing.assert_array_equal(model.trained_labels_, [0, 2, 3, 5])
+    probabilities = model.predict_proba(X)
+    assert probabilities.shape == y.shape
+    np.testing.assert_array_equal(probabilities[:, 1], 0)
+    np.testing.assert_array_equal(probabilities[:, 4], 1)
+    np.testing.assert_array_equal(model.predict(X), (probabilities > 0.5).astype(int))
+
+# A single multi-output forest, the trained labels get the probabilities of a plain sklearn forest
+def test_random_forest_matches_sklearn(data):
+    X, y = data
+    model = MultiLabel(n_estimators=10, random_state=0, thread_count=1).fit(X, y)
+    assert isinstance(model.clf, RandomForestClassifier)
+    forest = RandomForestClassifier(n_estimators=10, random_state=0, n_jobs=1).fit(X, y[:, model.trained_labels_])
+    expected = np.column_stack([p[:, 1] for p in forest.predict_proba(X)])
+    np.testing.assert_allclose(model.predict_proba(X)[:, model.trained_labels_], expected)
+
+def test_single_trained_label(data):
+    X, y = data
+    model = MultiLabel(n_estimators=10, random_state=0).fit(X, y[:, :2])
+    np.testing.assert_array_equal(model.trained_labels_, [0])
+    probabilities = model.predict_proba(X)
+    assert probabilities.shape == (len(X), 2)
+    assert np.mean((probabilities[:, 0] > 0.5) == y[:, 0]) > 0.9
+
+def test_only_constant_labels(data):
+    X, y = data
+    model = MultiLabel().fit(X, y[:, [1, 4]])
+    assert model.clf is None
+    np.testing.assert_array_equal(model.predict_proba(X[:3]), [[0, 1]] * 3)
+
+def test_catboost_multilogloss(data):
+    pytest.importorskip("catboost")
+    X, y = data
+    model = MultiLabel(backend="catboost", iterations=20, thread_count=1, random_state=0).fit(X, y)
+    assert model.clf.get_params()["loss_function"] == "MultiLogloss"
+    probabilities = model.predict_proba(X)
+    assert probabilities.shape == y.shape
+    np.testing.assert_array_equal(probabilities[:, [1, 4]], [[0, 1]] * len(X))
+    assert np.mean(model.predict(X) == y) > 0.8
+
+def test_catboost_early_stopping(data):
+    pytest.importorskip("catboost")
+    X, y = data
+    model = MultiLabel(backend="catboost", iterations=500, learning_rate=0.5, early_stopping_rounds=5, thread_count=1,
+                       random_state=0).fit(X, y)
+    assert model.clf.tree_count_ < 500
+    assert model.predict_proba(X).shape == y.shape
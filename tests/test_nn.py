@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("skorch")
+
+from wrappers.nn import NN
+
+N_FEATURES, N_LABELS = 16, 5
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(120, N_FEATURES))
+    y = (X[:, :N_LABELS] > 0).astype(np.uint8)
+    return X, y
+
+def fitted(data, **kwargs):
+    torch.manual_seed(0)
+    model = NN(N_FEATURES, N_LABELS, torch.nn.BCELoss, max_epochs=3, batch_size=16, **kwargs)
+    model.fit(*data)
+    return model
+
+@pytest.fixture(scope="module")
+def model(data):
+    return fitted(data)
+
+def test_float32_by_default(model, data):
+    assert model.model.module_.ln1.weight.dtype == torch.float32
+    probabilities = model.predict_proba(data[0])
+    assert probabilities.dtype == np.float32 and probabilities.shape == (len(data[0]), N_LABELS)
+    assert np.all((probabilities >= 0) & (probabilities <= 1))
+
+def test_float64_weights_and_predictions(data):
+    model = fitted(data, dtype="float64")
+    assert model.model.module_.ln1.weight.dtype == torch.float64
+    assert model.predict_proba(data[0]).dtype == np.float64
+
+# Batches of the inference path give the same probabilities as a single pass, dropout is off in predict_proba
+def test_batched_inference_matches_single_batch(model, data):
+    X = data[0]
+    expected = model.predict_proba(X)
+    model.inference_batch_size = 7
+    try:
+        np.testing.assert_allclose(model.predict_proba(X), expected, rtol=1e-6)
+    finally:
+        model.inference_batch_size = 4096
+    np.testing.assert_array_equal(model.predict(X), expected > 0.5)
+
+def test_empty_input(model):
+    probabilities = model.predict_proba(np.empty((0, N_FEATURES)))
+    assert probabilities.shape == (0, N_LABELS)
+
+def test_num_threads(data):
+    threads = torch.get_num_threads()
+    try:
+        fitted(data, num_threads=1)
+        assert torch.get_num_threads() == 1
+    finally:
+        torch.set_num_threads(threads)
+
+# The exported network is loaded without the wrapper and predicts the same probabilities
+def test_torchscript_export(model, data, tmp_path):
+    path = str(tmp_path / "nn.pt")
+    model.export_torchscript(path)
+    module = torch.jit.load(path)
+    with torch.inference_mode():
+        probabilities = module(torch.as_tensor(data[0], dtype=torch.float32)).numpy()
+    np.testing.assert_allclose(probabilities, model.predict_proba(data[0]), rtol=1e-6)
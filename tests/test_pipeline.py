@@ -0,0 +1,161 @@
+import json
+import os
+
+import pytest
+
+from mass_spectra import pipeline
+from mass_spectra.pipeline import STATE_FILE, Stage, State, path_digest, run_stages
+
+# Stub stages, run_stages runs them in spawned processes so they are module level functions
+# Every run is appended to the log file, the tests count the runs of every stage with it
+def upper_stage(source, target, log):
+    with open(log, "a") as f:
+        f.write(f"upper {source}\n")
+    with open(source) as f, open(target, "w") as out:
+        out.write(f.read().upper())
+
+def join_stage(sources, target, log, separator="-", fail=False):
+    with open(log, "a") as f:
+        f.write("join\n")
+    if fail:
+        raise ValueError("stage failed")
+    parts = []
+    for source in sources:
+        with open(source) as f:
+            parts.append(f.read())
+    with open(target, "w") as out:
+        out.write(separator.join(parts))
+
+def runs(log):
+    if not os.path.exists(log):
+        return []
+    with open(log) as f:
+        return f.read().splitlines()
+
+# a.txt -> A.txt and b.txt -> B.txt (independent), joined into joined.txt
+@pytest.fixture
+def folder(tmp_path):
+    (tmp_path / "a.txt").write_text("abc")
+    (tmp_path / "b.txt").write_text("def")
+    return tmp_path
+
+def build(folder, separator="-", fail=False):
+    def path(name):
+        return str(folder / name)
+    log = path("log.txt")
+    return [
+        Stage("upper_a", upper_stage, {"source": path("a.txt"), "target": path("A.txt"), "log": log},
+              [path("a.txt")], [path("A.txt")]),
+        Stage("upper_b", upper_stage, {"source": path("b.txt"), "target": path("B.txt"), "log": log},
+              [path("b.txt")], [path("B.txt")]),
+        Stage("join", join_stage, {"sources": [path("A.txt"), path("B.txt")], "target": path("joined.txt"), "log": log,
+                                   "separator": separator, "fail": fail},
+              [path("A.txt"), path("B.txt")], [path("joined.txt")], {"separator": separator}),
+    ]
+
+def run(folder, **kwargs):
+    stages = build(folder, **{k: kwargs.pop(k) for k in ("separator", "fail") if k in kwargs})
+    run_stages(stages, State(str(folder / STATE_FILE)), **kwargs)
+
+def test_dependencies(tmp_path):
+    stages = build(tmp_path)
+    assert pipeline.dependencies(stages) == {"upper_a": set(), "upper_b": set(), "join": {"upper_a", "upper_b"}}
+
+def test_unchanged_stages_are_skipped(folder):
+    run(folder)
+    assert (folder / "joined.txt").read_text() == "ABC-DEF"
+    assert sorted(runs(str(folder / "log.txt"))) == sorted([f"upper {folder / 'a.txt'}", f"upper {folder / 'b.txt'}", "join"])
+
+    run(folder)
+    assert len(runs(str(folder / "log.txt"))) == 3
+
+    # The state holds the digests of the inputs and the hash of the parameters of every stage
+    with open(folder / STATE_FILE) as f:
+        state = json.load(f)
+    assert set(state["stages"]) == {"upper_a", "upper_b", "join"}
+    signature = state["stages"]["join"]["signature"]
+    assert signature["inputs"] == {str(folder / name): path_digest(str(folder / name)) for name in ("A.txt", "B.txt")}
+    assert signature["params"] == State(str(folder / STATE_FILE)).signature(build(folder)[2])["params"]
+
+# A changed input reruns its stage, the stages after it only rerun if the output of the stage changed
+def test_changed_inputs_invalidate_stages(folder):
+    log = str(folder / "log.txt")
+    run(folder)
+
+    (folder / "a.txt").write_text("ABC") # same output A.txt
+    run(folder)
+    assert runs(log)[3:] == [f"upper {folder / 'a.txt'}"]
+
+    (folder / "a.txt").write_text("xyz")
+    run(folder)
+    assert runs(log)[4:] == [f"upper {folder / 'a.txt'}", "join"]
+    assert (folder / "joined.txt").read_text() == "XYZ-DEF"
+
+def test_changed_params_invalidate_stages(folder):
+    log = str(folder / "log.txt")
+    run(folder)
+    run(folder, separator="+")
+    assert runs(log)[3:] == ["join"]
+    assert (folder / "joined.txt").read_text() == "ABC+DEF"
+
+def test_missing_outputs_and_forced_stages_run_again(folder):
+    log = str(folder / "log.txt")
+    run(folder)
+    os.remove(folder / "joined.txt")
+    run(folder)
+    assert runs(log)[3:] == ["join"]
+
+    run(folder, force={"upper_b"})
+    assert runs(log)[4:] == [f"upper {folder / 'b.txt'}"]
+
+# A failed stage stops the run, the stages completed before are kept and skipped when the run is resumed
+def test_interrupted_run_resumes(folder):
+    log = str(folder / "log.txt")
+    with pytest.raises(ValueError, match="stage failed"):
+        run(folder, fail=True)
+    assert len(runs(log)) == 3
+    assert not (folder / "joined.txt").exists()
+    with open(folder / STATE_FILE) as f:
+        assert set(json.load(f)["stages"]) == {"upper_a", "upper_b"}
+
+    run(folder)
+    assert runs(log)[3:] == ["join"]
+    assert (folder / "joined.txt").read_text() == "ABC-DEF"
+
+# Stages that are not selected must be complete
+def test_unselected_stages_must_be_complete(folder):
+    with pytest.raises(RuntimeError, match="not selected"):
+        run(folder, selected={"join"})
+    run(folder)
+    run(folder, selected={"join"}, force={"join"})
+    assert runs(str(folder / "log.txt"))[3:] == ["join"]
+
+# Folder digests change with the content and the names of their files, file digests are cached by size and mtime
+def test_path_digest(tmp_path):
+    (tmp_path / "folder").mkdir()
+    (tmp_path / "folder" / "x").write_text("1")
+    known = {}
+    digest = path_digest(str(tmp_path / "folder"), known)
+    assert list(known) == [str(tmp_path / "folder" / "x")]
+    assert path_digest(str(tmp_path / "folder"), known) == digest
+
+    (tmp_path / "folder" / "x").rename(tmp_path / "folder" / "y")
+    assert path_digest(str(tmp_path / "folder"), known) != digest
+
+# The preprocess stage reads the spectra through train_spec2vec.load_from_mgf (with the matchms filters configured)
+def test_preprocess_stage(tmp_path, monkeypatch):
+    from benchmarks import synthetic
+    from mass_spectra import train_spec2vec
+
+    mgf, _ = synthetic.write_mgf(str(tmp_path), 20)
+    loaded = []
+    def load_from_mgf(file_path):
+        loaded.append(file_path)
+        return original(file_path)
+    original = train_spec2vec.load_from_mgf
+    monkeypatch.setattr(train_spec2vec, "load_from_mgf", load_from_mgf)
+
+    pipeline.preprocess(mgf, str(tmp_path / "preprocessed.npz"), workers=1)
+    assert loaded == [mgf]
+    documents = pipeline.load_documents(str(tmp_path / "preprocessed.npz"))
+    assert len(documents) == 20 and documents[0].metadata.get("inchikey") == synthetic.KNOWN_COMPOUNDS[0][1]
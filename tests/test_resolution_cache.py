@@ -0,0 +1,148 @@
+import json
+import re
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from mass_spectra import resolution_cache
+from mass_spectra.resolution_cache import NOT_CACHED, ResolutionCache, Resolver, create_session
+
+@pytest.fixture
+def cache():
+    cache = ResolutionCache(":memory:")
+    yield cache
+    cache.close()
+
+# Replaces the clock of the cache module, so expiry can be tested without waiting
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(resolution_cache, "time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+def text(response):
+    return response.text or None
+
+def test_cache_stores_values_and_misses(cache):
+    assert cache.get("ns", "a") is NOT_CACHED
+    cache.set_many("ns", {"a": "A", "b": None})
+    assert cache.get("ns", "a") == "A"
+    assert cache.get("ns", "b") is None
+    assert cache.get("other", "a") is NOT_CACHED
+    assert cache.get_many("ns", ["a", "b", "c", "a"]) == {"a": "A", "b": None}
+
+def test_cache_queries_more_keys_than_sqlite_parameters(cache):
+    cache.set_many("ns", {str(i): str(i) for i in range(1200)})
+    assert len(cache.get_many("ns", [str(i) for i in range(1300)])) == 1200
+
+def test_cache_persists_across_connections(tmp_path):
+    path = str(tmp_path / "cache" / "resolution.sqlite")
+    cache = ResolutionCache(path)
+    cache.set("ns", "a", "A")
+    cache.close()
+    cache = ResolutionCache(path)
+    assert cache.get("ns", "a") == "A"
+    cache.close()
+
+def test_cache_file_is_read_from_the_environment_when_opened(tmp_path, monkeypatch):
+    monkeypatch.setenv("MASS_SPECTRA_RESOLUTION_CACHE", str(tmp_path / "env.sqlite"))
+    cache = ResolutionCache()
+    assert cache.path == str(tmp_path / "env.sqlite")
+    cache.close()
+
+def test_misses_expire_after_negative_ttl(clock):
+    cache = ResolutionCache(":memory:", ttl=None, negative_ttl=60)
+    cache.set_many("ns", {"hit": "value", "miss": None})
+    clock.value += 60
+    assert cache.get_many("ns", ["hit", "miss"]) == {"hit": "value", "miss": None}
+    clock.value += 1
+    assert cache.get_many("ns", ["hit", "miss"]) == {"hit": "value"}
+
+def test_values_expire_after_ttl(clock):
+    cache = ResolutionCache(":memory:", ttl=10, negative_ttl=None)
+    cache.set_many("ns", {"hit": "value", "miss": None})
+    clock.value += 11
+    assert cache.get_many("ns", ["hit", "miss"]) == {"miss": None}
+
+def test_resolve_many_requests_only_uncached_keys(stub_server, cache):
+    stub_server.respond = lambda path: (200, path.rsplit("/", 1)[1].upper())
+    resolver = Resolver("upper", f"{stub_server.url}/key/{{key}}", text, cache=cache, session=create_session(retries=0))
+    assert resolver.resolve_many(["a", "b", "a"]) == {"a": "A", "b": "B"}
+    assert resolver.resolve_many(["b", "c"]) == {"b": "B", "c": "C"}
+    assert resolver.resolve("a") == "A"
+    assert sorted(stub_server.requests) == ["/key/a", "/key/b", "/key/c"]
+
+def test_keys_are_url_quoted(stub_server, cache):
+    stub_server.respond = lambda path: (200, path[len("/key/"):])
+    resolver = Resolver("echo", f"{stub_server.url}/key/{{key}}", text, cache=cache, session=create_session(retries=0))
+    assert resolver.resolve("InChI=1S/CH4/h1H4") == "InChI=1S/CH4/h1H4"
+
+def test_miss_statuses_are_cached_as_misses(stub_server, cache):
+    stub_server.respond = lambda path: (404, "")
+    resolver = Resolver("missing", f"{stub_server.url}/{{key}}", text, cache=cache, session=create_session(retries=0))
+    assert resolver.resolve("a") is None
+    assert resolver.resolve("a") is None
+    assert stub_server.requests == ["/a"]
+    assert cache.get("missing", "a") is None
+
+def test_failures_are_not_cached(stub_server, cache):
+    stub_server.respond = lambda path: (500, "")
+    resolver = Resolver("failing", f"{stub_server.url}/{{key}}", text, cache=cache, session=create_session(retries=0))
+    assert resolver.resolve("a") is None
+    assert cache.get("failing", "a") is NOT_CACHED
+    stub_server.respond = lambda path: (200, "A")
+    assert resolver.resolve("a") == "A"
+
+def test_rate_limited_requests_are_retried(stub_server, cache):
+    statuses = iter([429, 503, 200])
+    stub_server.respond = lambda path: (next(statuses), "A")
+    resolver = Resolver("retried", f"{stub_server.url}/{{key}}", text, cache=cache,
+                        session=create_session(retries=2, backoff_factor=0))
+    assert resolver.resolve("a") == "A"
+    assert len(stub_server.requests) == 3
+
+def test_exhausted_retries_resolve_to_none_without_caching(stub_server, cache):
+    stub_server.respond = lambda path: (503, "")
+    resolver = Resolver("unavailable", f"{stub_server.url}/{{key}}", text, cache=cache,
+                        session=create_session(retries=2, backoff_factor=0))
+    assert resolver.resolve("a") is None
+    assert len(stub_server.requests) == 3
+    assert cache.get("unavailable", "a") is NOT_CACHED
+
+def test_timeouts_resolve_to_none_without_caching(stub_server, cache):
+    def slow(path):
+        time.sleep(1)
+        return 200, "A"
+    stub_server.respond = slow
+    resolver = Resolver("slow", f"{stub_server.url}/{{key}}", text, cache=cache, session=create_session(retries=0), timeout=0.1)
+    start = time.monotonic()
+    assert resolver.resolve("a") is None
+    assert time.monotonic() - start < 1
+    assert cache.get("slow", "a") is NOT_CACHED
+
+# The hosts of the UniChem and ChemSpider lookups are read from the environment on every lookup
+def test_unichem_host_is_read_at_call_time(stub_server, monkeypatch):
+    from mass_spectra import to_fingerprint
+    monkeypatch.setattr(resolution_cache, "_default_cache", ResolutionCache(":memory:"))
+    monkeypatch.setattr(resolution_cache, "_default_session", create_session(retries=0))
+    monkeypatch.setenv("UNICHEM_HOST", stub_server.url)
+    stub_server.respond = lambda path: ((200, json.dumps([{"standardinchi": "InChI=1S/CH4/h1H4"}]))
+                                        if path == "/inchi/VNWKTOKETHGBQD-UHFFFAOYSA-N" else (404, ""))
+    assert to_fingerprint.inchikeys_to_inchi(["VNWKTOKETHGBQD-UHFFFAOYSA-N", "UNKNOWN"]) == {
+        "VNWKTOKETHGBQD-UHFFFAOYSA-N": "InChI=1S/CH4/h1H4", "UNKNOWN": None}
+    assert to_fingerprint.unichem_resolver().url_format == f"{stub_server.url}/inchi/{{key}}"
+
+def test_chemspider_host_is_read_at_call_time(stub_server, monkeypatch):
+    from helper import compound_querier
+    monkeypatch.setattr(resolution_cache, "_default_cache", ResolutionCache(":memory:"))
+    monkeypatch.setattr(resolution_cache, "_default_session", create_session(retries=0))
+    monkeypatch.setenv("CHEMSPIDER_HOST", stub_server.url)
+    def respond(path):
+        inchi = re.search(r"inchi=(.*)", path).group(1)
+        return 200, f'<string xmlns="http://www.chemspider.com/">{inchi.upper()}</string>'
+    stub_server.respond = respond
+    assert compound_querier.query("inchi_to_smiles", "InChI=1S/CH4/h1H4") == "INCHI=1S/CH4/H1H4"
+    assert compound_querier.query_many("inchi_to_inchi_key", ["a", "b"]) == {"a": "A", "b": "B"}
+    assert compound_querier.query("unknown_query", "a") is None
+    assert stub_server.requests[0].startswith("/InChI.asmx/InChIToSMILES?inchi=")
@@ -0,0 +1,124 @@
+import io
+import json
+import pickle
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from benchmarks import synthetic
+from mass_spectra.serve import FingerprintPredictor, create_server
+
+# Wraps the trained model, counting the calls and the rows of every call
+class CountingModel:
+    def __init__(self, model):
+        self.model = model
+        self.batches = []
+        self.fail = False
+        self.lock = threading.Lock()
+
+    def predict_proba(self, X):
+        with self.lock:
+            self.batches.append(len(X))
+        if self.fail:
+            raise RuntimeError("model failed")
+        return self.model.predict_proba(X)
+
+@pytest.fixture(scope="module")
+def mgf(tmp_path_factory):
+    path, _ = synthetic.write_mgf(str(tmp_path_factory.mktemp("mgf")), 40, random_state=3)
+    with open(path) as f:
+        return f.read()
+
+# A fold file as written by s3_train, the model predicts 4 random bits of the embeddings
+@pytest.fixture(scope="module")
+def model_file(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    model = RandomForestClassifier(n_estimators=5, random_state=0).fit(rng.normal(size=(50, 16)), rng.integers(0, 2, size=(50, 4)))
+    path = str(tmp_path_factory.mktemp("model") / "0_0.pkl")
+    with open(path, "wb") as f:
+        pickle.dump({"model": model, "train_index": np.arange(50), "test_index": np.arange(0)}, f)
+    return path
+
+@pytest.fixture
+def predictor(model_file, spec2vec_model_file):
+    predictor = FingerprintPredictor(model_file, spec2vec_model_file, columns=["a", "b", "c", "d"], batch_size=1000, max_wait=0.5)
+    predictor.model = CountingModel(predictor.model)
+    return predictor
+
+@pytest.fixture
+def server(predictor):
+    server = create_server(predictor, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+def post(url, body):
+    request = urllib.request.Request(f"{url}/predict", data=body.encode("utf-8"), method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def test_predicts_one_result_per_spectrum(predictor, mgf):
+    results, latency = predictor.predict_mgf(io.StringIO(mgf))
+    assert [r["index"] for r in results] == list(range(40))
+    predicted = [r for r in results if "error" not in r]
+    assert len(predicted) > 0
+    assert all(set(r["bits"]) <= {"a", "b", "c", "d"} for r in predicted)
+    assert {"loading", "preprocessing", "embedding", "prediction"} <= set(latency)
+
+def test_model_is_called_with_at_most_batch_size_rows(predictor, documents):
+    predictor.batch_size = 7
+    probabilities, _ = predictor.predict_documents(documents[:20])
+    assert probabilities.shape == (20, 4)
+    assert predictor.model.batches == [7, 7, 6]
+
+def test_concurrent_requests_share_a_model_call(server, predictor, mgf):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(lambda _: post(server, mgf), range(8)))
+    assert all(status == 200 for status, _ in responses)
+    assert all(body["predictions"] == responses[0][1]["predictions"] for _, body in responses)
+    # the requests arrive within max_wait of each other, so they are predicted in (almost) one batch
+    assert len(predictor.model.batches) < 8
+    per_request = sum(1 for r in responses[0][1]["predictions"] if "error" not in r)
+    assert sum(predictor.model.batches) == 8 * per_request
+    assert "queue" in responses[0][1]["latency"]
+
+def test_batched_results_match_direct_prediction(predictor, mgf):
+    direct, _ = predictor.predict_mgf(io.StringIO(mgf))
+    batched, _ = predictor.predict_mgf(io.StringIO(mgf), batched=True)
+    assert direct == batched
+
+@pytest.mark.parametrize("body", ["BEGIN IONS\nPEPMASS=abc\n1 2\nEND IONS\n", "BEGIN IONS\nPEPMASS=100\nx y\nEND IONS\n"])
+def test_invalid_mgf_is_a_client_error(server, predictor, body):
+    status, response = post(server, body)
+    assert status == 400 and response["error"]
+    assert predictor.model.batches == []
+
+def test_model_failure_is_a_server_error(server, predictor, mgf):
+    predictor.model.fail = True
+    status, response = post(server, mgf)
+    assert status == 500 and response["error"] == "model failed"
+    # the collector keeps serving after a failed batch
+    predictor.model.fail = False
+    assert post(server, mgf)[0] == 200
+
+def test_empty_mgf_has_no_predictions(server, predictor):
+    status, response = post(server, "")
+    assert status == 200 and response["predictions"] == []
+    assert predictor.model.batches == []
+
+def test_unknown_paths(server):
+    with urllib.request.urlopen(f"{server}/health") as response:
+        assert json.loads(response.read()) == {"status": "ok"}
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(f"{server}/other")
+    assert error.value.code == 404
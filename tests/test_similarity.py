@@ -0,0 +1,34 @@
+import gensim
+import numpy as np
+import pytest
+
+from mass_spectra.similarity import calculate_scores_blocked
+
+@pytest.fixture(scope="module")
+def model(spec2vec_model_file):
+    return gensim.models.Word2Vec.load(spec2vec_model_file)
+
+@pytest.mark.parametrize("options", [{"top_k": 3}, {"threshold": 0.5}, {"top_k": 3, "threshold": 0.5}])
+@pytest.mark.parametrize("n_references, n_queries", [(0, 5), (5, 0), (0, 0)])
+def test_empty_inputs_give_empty_scores(documents, model, options, n_references, n_queries):
+    scores = calculate_scores_blocked(documents[:n_references], documents[:n_queries], model=model, **options)
+    assert scores.matrix.shape == (n_queries, n_references)
+    assert scores.matrix.nnz == 0
+    assert scores.query_embeddings.shape == (n_queries, model.vector_size)
+    assert scores.reference_embeddings.shape == (n_references, model.vector_size)
+
+def test_empty_references_with_dense_file(documents, model, tmp_path):
+    scores = calculate_scores_blocked([], documents[:5], model=model, dense_file=str(tmp_path / "scores.npy"))
+    assert scores.matrix.shape == (5, 0)
+    assert scores.scores_by_query(0) == []
+
+def test_empty_query_all_vs_all(model):
+    scores = calculate_scores_blocked([], model=model, top_k=3)
+    assert scores.matrix.shape == (0, 0)
+
+def test_top_k_matches_dense_scores(documents, model, tmp_path):
+    dense = calculate_scores_blocked(documents, model=model, dense_file=str(tmp_path / "scores.npy"),
+                                     query_block_size=16, reference_block_size=16)
+    top = calculate_scores_blocked(documents, model=model, top_k=3, query_block_size=16, reference_block_size=16)
+    best = np.sort(np.asarray(dense.matrix), axis=1)[:, ::-1][:, :3]
+    np.testing.assert_allclose(np.sort(top.matrix.toarray(), axis=1)[:, ::-1][:, :3], best, rtol=1e-5)
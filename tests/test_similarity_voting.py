@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from spec2vec import Spec2Vec
+
+from benchmarks import synthetic
+from mass_spectra.similarity_voting import SimilarityVoting
+
+@pytest.fixture(scope="module")
+def split(documents):
+    y = synthetic.generate_fingerprints(np.arange(len(documents)) % len(synthetic.KNOWN_COMPOUNDS), n_bits=32)
+    return documents[:40], y[:40], documents[40:]
+
+# Scores of the original implementation: all-vs-all spec2vec similarities times the known targets
+def baseline_scores(voting, known, y, unknown):
+    spec2vec = Spec2Vec(model=voting.spec2vec.model, intensity_weighting_power=0.5, allowed_missing_percentage=5.0)
+    similarities = spec2vec.matrix(known, unknown).T
+    return similarities.dot(y)
+
+def test_default_reproduces_baseline_scores(spec2vec_model_file, split):
+    known, y, unknown = split
+    voting = SimilarityVoting(spec2vec_model_file).fit(known, y)
+    np.testing.assert_allclose(voting.predict_proba(unknown), baseline_scores(voting, known, y, unknown), rtol=1e-4, atol=1e-4)
+
+def test_top_k_of_all_references_reproduces_baseline_ranking(spec2vec_model_file, split):
+    known, y, unknown = split
+    voting = SimilarityVoting(spec2vec_model_file, k=len(known)).fit(known, y)
+    scores = voting.predict_proba(unknown)
+    baseline = baseline_scores(voting, known, y, unknown)
+    np.testing.assert_allclose(scores, baseline, rtol=1e-4, atol=1e-4)
+    np.testing.assert_array_equal(np.argsort(-np.round(scores, 4), axis=1, kind="stable")[:, :5],
+                                  np.argsort(-np.round(baseline, 4), axis=1, kind="stable")[:, :5])
+
+def test_mean_vote_is_a_probability(spec2vec_model_file, split):
+    known, y, unknown = split
+    proba = SimilarityVoting(spec2vec_model_file, k=5, vote="mean").fit(known, y).predict_proba(unknown)
+    assert proba.shape == (len(unknown), y.shape[1])
+    assert proba.min() >= 0 and proba.max() <= 1
+
+def test_mean_vote_of_all_references_matches_top_k(spec2vec_model_file, split):
+    known, y, unknown = split
+    dense = SimilarityVoting(spec2vec_model_file, vote="mean").fit(known, y).predict_proba(unknown)
+    top_k = SimilarityVoting(spec2vec_model_file, k=len(known), vote="mean").fit(known, y).predict_proba(unknown)
+    np.testing.assert_allclose(dense, top_k, rtol=1e-5, atol=1e-6)
+
+def test_unknown_vote_is_rejected(spec2vec_model_file):
+    with pytest.raises(ValueError):
+        SimilarityVoting(spec2vec_model_file, vote="max")
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from mass_spectra.store import (PackedBits, load, load_dataset, load_frame, save_dataset, save_embeddings,
+                                save_fingerprints)
+
+def make_index(n_rows):
+    return pd.DataFrame({"inchi_key": [f"KEY{i}" for i in range(n_rows)], "inchi": [f"InChI=1S/{i}" for i in range(n_rows)]})
+
+def test_embeddings_round_trip(tmp_path):
+    embeddings = np.random.default_rng(0).normal(size=(7, 5))
+    save_embeddings(str(tmp_path / "spec2vec"), embeddings, make_index(7))
+    matrix, index, header = load(str(tmp_path / "spec2vec.npy"))
+    assert isinstance(matrix, np.memmap) and matrix.dtype == np.float32
+    np.testing.assert_allclose(matrix, embeddings.astype(np.float32))
+    pd.testing.assert_frame_equal(index, make_index(7))
+    assert header == {"kind": "embedding", "shape": [7, 5], "columns": ["0", "1", "2", "3", "4"]}
+
+# 13 bits do not fill the last byte, the padding must not show up after loading
+@pytest.mark.parametrize("n_bits", [1, 8, 13])
+@pytest.mark.parametrize("dtype", [bool, np.uint8, np.int64, np.float64])
+def test_fingerprints_round_trip(tmp_path, n_bits, dtype):
+    bits = np.random.default_rng(n_bits).integers(0, 2, size=(6, n_bits)).astype(dtype)
+    columns = [f"fp_{i}" for i in range(n_bits)]
+    save_fingerprints(str(tmp_path / "fingerprint"), bits, make_index(6), columns)
+
+    packed, _, header = load(str(tmp_path / "fingerprint"), packed=True)
+    assert packed.shape == (6, (n_bits + 7) // 8)
+    matrix, index, header = load(str(tmp_path / "fingerprint"))
+    np.testing.assert_array_equal(matrix, bits.astype(np.uint8))
+    assert header["columns"] == columns
+    frame = load_frame(str(tmp_path / "fingerprint"))
+    assert list(frame.columns) == ["inchi_key", "inchi"] + columns
+    np.testing.assert_array_equal(frame[columns].to_numpy(), bits.astype(np.uint8))
+
+@pytest.mark.parametrize("value", [np.nan, 2, -1, 0.5])
+def test_fingerprints_reject_values_other_than_0_and_1(tmp_path, value):
+    bits = np.zeros((3, 4))
+    bits[1, 2] = value
+    with pytest.raises(ValueError, match="row 1 column bit_2"):
+        save_fingerprints(str(tmp_path / "fingerprint"), bits)
+    assert not (tmp_path / "fingerprint.npy").exists()
+
+def test_fingerprints_reject_mismatched_columns_and_index(tmp_path):
+    with pytest.raises(ValueError):
+        save_fingerprints(str(tmp_path / "fingerprint"), np.zeros((3, 4)), columns=["a", "b"])
+    with pytest.raises(ValueError):
+        save_fingerprints(str(tmp_path / "fingerprint"), np.zeros((3, 4)), make_index(2))
+
+def test_dataset_unpacks_y_per_row_selection(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(20, 3))
+    y = rng.integers(0, 2, size=(20, 11))
+    save_dataset(str(tmp_path / "merged"), X, y, make_index(20))
+
+    X_loaded, y_loaded, index = load_dataset(str(tmp_path / "merged"))
+    assert isinstance(y_loaded, PackedBits)
+    assert y_loaded.shape == (20, 11) and len(y_loaded) == 20
+    np.testing.assert_allclose(X_loaded, X.astype(np.float32))
+    rows = np.array([3, 0, 17])
+    np.testing.assert_array_equal(y_loaded[rows], y[rows])
+    np.testing.assert_array_equal(y_loaded[2:5], y[2:5])
+    np.testing.assert_array_equal(y_loaded[y[:, 0] == 1], y[y[:, 0] == 1])
+    np.testing.assert_array_equal(y_loaded[-1], y[-1])
+    np.testing.assert_array_equal(y_loaded[rows, 4], y[rows, 4])
+    np.testing.assert_array_equal(np.asarray(y_loaded), y)
+    pd.testing.assert_frame_equal(index, make_index(20))
+
+def test_store_without_index(tmp_path):
+    save_embeddings(str(tmp_path / "spec2vec"), np.ones((3, 2)))
+    matrix, index, _ = load(str(tmp_path / "spec2vec"))
+    assert matrix.shape == (3, 2)
+    assert len(index) == 3 and list(index.columns) == []
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from helper import to_arff
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CSV = (
+    'Compound Name,bit_0,bit_1,count,mass\n'
+    '"a, b",1,0,3,0.5\n'
+    'c,0,0,0,1.25\n'
+    'd,0,1,7,\n'
+    'e,1,,2,2.0\n'
+)
+HEADER = [
+    '@attribute compound_name string',
+    '@attribute bit_0 {0, 1}',
+    '@attribute bit_1 {0, 1}',
+    '@attribute count integer',
+    '@attribute mass real',
+    '@data',
+]
+DENSE_ROWS = [
+    "'a; b',1,0,3,0.5",
+    "'c',0,0,0,1.25",
+    "'d',0,1,7,?",
+    "'e',1,?,2,2.0",
+]
+SPARSE_ROWS = [
+    "{0 'a; b',1 1,3 3,4 0.5}",
+    "{0 'c',4 1.25}",
+    "{0 'd',2 1,3 7,4 ?}",
+    "{0 'e',1 1,2 ?,3 2,4 2.0}",
+]
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "small.csv"
+    path.write_text(CSV)
+    return str(path)
+
+def read_lines(path):
+    with open(path) as f:
+        return f.read().splitlines()
+
+# Types inferred over all chunks: the missing value turns bit_1 into floats in its chunk, it stays binary
+def test_infer_types(csv_file):
+    header, types, offsets = to_arff.infer_types(csv_file, chunk_size=1)
+    assert header == CSV.splitlines(keepends=True)[0].encode()
+    assert types == {'Compound Name': to_arff.STRING, 'bit_0': to_arff.BINARY, 'bit_1': to_arff.BINARY,
+                     'count': to_arff.INTEGER, 'mass': to_arff.REAL}
+    lines = CSV.encode().splitlines(keepends=True)
+    np.testing.assert_array_equal(offsets, np.cumsum([len(line) for line in lines])[:-1])
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 10000])
+def test_dense(csv_file, tmp_path, chunk_size):
+    arff_file = str(tmp_path / "small.arff")
+    to_arff.convert(csv_file, arff_file, chunk_size=chunk_size)
+    assert read_lines(arff_file) == ['@relation small'] + HEADER + DENSE_ROWS
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 10000])
+def test_sparse(csv_file, tmp_path, chunk_size):
+    arff_file = str(tmp_path / "small.arff")
+    to_arff.convert(csv_file, arff_file, relation="fingerprints", sparse=True, chunk_size=chunk_size)
+    assert read_lines(arff_file) == ['@relation fingerprints'] + HEADER + SPARSE_ROWS
+
+# Shuffled rows are the rows of the csv in the order of the seeded permutation
+@pytest.mark.parametrize("chunk_size", [1, 3, 10000])
+def test_shuffled(csv_file, tmp_path, chunk_size):
+    arff_file = str(tmp_path / "small.arff")
+    to_arff.convert(csv_file, arff_file, shuffle=True, chunk_size=chunk_size, random_state=0)
+    order = np.random.default_rng(0).permutation(len(DENSE_ROWS))
+    assert read_lines(arff_file) == ['@relation small'] + HEADER + [DENSE_ROWS[i] for i in order]
+
+def test_cli(csv_file, tmp_path):
+    arff_file = str(tmp_path / "small.arff")
+    result = subprocess.run([sys.executable, "-m", "helper.to_arff", csv_file, arff_file, "--sparse", "--chunk_size", "2"],
+                            cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert read_lines(arff_file) == ['@relation small'] + HEADER + SPARSE_ROWS
@@ -0,0 +1,80 @@
+import os
+import subprocess
+import sys
+
+import gensim
+from spec2vec import SpectrumDocument
+
+from benchmarks import synthetic
+from mass_spectra import preprocessing_cache
+from mass_spectra.train_spec2vec import (checkpoint_iterations, continue_word2vec_training, load_manifest,
+                                         preprocessing_settings, save_manifest)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def train(*args):
+    result = subprocess.run([sys.executable, "-m", "mass_spectra.train_spec2vec", *args, "--workers", "1"],
+                            cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def test_checkpoint_iterations():
+    assert checkpoint_iterations(10) == [10]
+    assert checkpoint_iterations(10, 3) == [3, 6, 9, 10]
+    assert checkpoint_iterations(10, 5) == [5, 10]
+
+def test_manifest_round_trip(tmp_path):
+    model_file = str(tmp_path / "spec2vec.model")
+    assert load_manifest(model_file) == {}
+    save_manifest(model_file, {"key": "file.mgf"})
+    assert load_manifest(model_file) == {"key": "file.mgf"}
+
+# New words are added to the vocabulary and the vectors of the old words keep their shape
+def test_continue_training_extends_the_vocabulary(spec2vec_model_file, tmp_path):
+    model = gensim.models.Word2Vec.load(spec2vec_model_file)
+    old_words = set(model.wv.key_to_index)
+    spectra, _ = synthetic.generate_spectra(30, random_state=5)
+    documents = [SpectrumDocument(s, n_decimals=2) for s in spectra]
+    new_words = {w for d in documents for w in d.words} - old_words
+    assert len(new_words) > 0
+
+    filename = str(tmp_path / "resumed.model")
+    model = continue_word2vec_training(model, documents, epochs=4, workers=1, filename=filename, checkpoint_every=2,
+                                       progress_logger=False)
+    assert old_words | new_words <= set(model.wv.key_to_index)
+    assert model.wv.vectors.shape == (len(model.wv.key_to_index), 16)
+    assert os.path.exists(str(tmp_path / "resumed_iter_2.model"))
+
+def test_resume_trains_only_on_new_files(tmp_path):
+    dataset = tmp_path / "dataset"
+    dataset.mkdir()
+    first, _ = synthetic.write_mgf(str(dataset), 40, random_state=0)
+    model_file = str(tmp_path / "models" / "first.model")
+    cache = str(tmp_path / "preprocessed")
+    train(str(dataset), model_file, "--epochs", "2", "--preprocessed_dataset_folder", cache)
+    key = preprocessing_cache.cache_key(first, preprocessing_settings())
+    assert load_manifest(model_file) == {key: os.path.basename(first)}
+    assert os.path.exists(preprocessing_cache.cache_path(cache, key))
+
+    second, _ = synthetic.write_mgf(str(dataset), 50, random_state=1)
+    resumed_file = str(tmp_path / "models" / "resumed.model")
+    output = train(str(dataset), resumed_file, "--epochs", "4", "--checkpoint_every", "2", "--resume_from", model_file,
+                   "--replay_fraction", "0.5", "--preprocessed_dataset_folder", cache)
+    assert f"Using cached preprocessing of {os.path.basename(first)}" in output
+    assert f"Loading {os.path.basename(first)} (replay)" in output
+    manifest = load_manifest(resumed_file)
+    assert sorted(manifest.values()) == sorted([os.path.basename(first), os.path.basename(second)])
+    assert os.path.exists(str(tmp_path / "models" / "resumed_iter_2.model"))
+    assert len(gensim.models.Word2Vec.load(resumed_file).wv) > len(gensim.models.Word2Vec.load(model_file).wv)
+
+    # Nothing new to train on
+    output = train(str(dataset), str(tmp_path / "models" / "again.model"), "--resume_from", resumed_file,
+                   "--replay_fraction", "0", "--preprocessed_dataset_folder", cache)
+    assert f"No new files to train {resumed_file} on" in output
+
+def test_deprecated_flags_are_accepted(tmp_path):
+    synthetic.write_mgf(str(tmp_path), 30)
+    output = train(str(tmp_path), str(tmp_path / "spec2vec.model"), "--epochs", "1", "--use_preprocessed_dataset",
+                   "--use_documents_pickle", "--preprocessed_dataset_folder", str(tmp_path / "preprocessed"))
+    assert "deprecated" in output
+    assert not os.path.exists(str(tmp_path / "preprocessed" / "documents.pickle"))
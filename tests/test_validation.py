@@ -0,0 +1,84 @@
+import re
+import time
+
+import pandas as pd
+import pytest
+
+from helper import compound_querier, validation
+from mass_spectra import resolution_cache
+from mass_spectra.resolution_cache import ResolutionCache
+
+COMPOUNDS = pd.DataFrame([
+    {"smiles": "C", "inchi": "InChI=1S/CH4/h1H4", "inchi_key": "VNWKTOKETHGBQD-UHFFFAOYSA-N"},
+    {"smiles": "CC", "inchi": "InChI=1S/C2H6/c1-2/h1-2H3", "inchi_key": "OTMSDBZUPAUEDD-UHFFFAOYSA-N"},
+    {"smiles": "CCC", "inchi": "InChI=1S/C3H8/c1-3-2/h3H2,1-2H3", "inchi_key": "ATUOYWHBWRKTHZ-UHFFFAOYSA-N"},
+    {"smiles": "CCCC", "inchi": "InChI=1S/C4H10/c1-3-4-2/h3-4H2,1-2H3", "inchi_key": "IJDNQMDRQITEOD-UHFFFAOYSA-N"},
+], index=[10, 11, 12, 13])
+
+# ChemSpider stub answering from COMPOUNDS, the SMILES of ethane is reported wrong and lookups of butane hang
+@pytest.fixture
+def chemspider(stub_server, monkeypatch):
+    answers = {}
+    for _, c in COMPOUNDS.iterrows():
+        answers[("InChIKeyToInChI", c["inchi_key"])] = c["inchi"]
+        answers[("InChIToInChIKey", c["inchi"])] = c["inchi_key"]
+        answers[("InChIToSMILES", c["inchi"])] = c["smiles"]
+        answers[("SMILESToInChI", c["smiles"])] = c["inchi"]
+    answers[("InChIToSMILES", "InChI=1S/C2H6/c1-2/h1-2H3")] = "C=C"
+
+    def respond(path):
+        method, value = re.match(r"/InChI.asmx/(\w+)\?\w+=(.*)", path).groups()
+        if "C4H10" in value or value in ("CCCC", "IJDNQMDRQITEOD-UHFFFAOYSA-N"):
+            time.sleep(2)
+        if (method, value) not in answers:
+            return 500, ""
+        return 200, f'<string xmlns="http://www.chemspider.com/">{answers[(method, value)]}</string>'
+
+    stub_server.respond = respond
+    monkeypatch.setenv("CHEMSPIDER_HOST", stub_server.url)
+    monkeypatch.setattr(resolution_cache, "_default_cache", ResolutionCache(":memory:"))
+    return stub_server
+
+def test_compare_ignores_missing_results():
+    row = COMPOUNDS.loc[10]
+    results = {"inchi_key_to_inchi": None, "inchi_to_inchi_key": row["inchi_key"], "inchi_to_smiles": "CC", "smiles_to_inchi": None}
+    assert validation.compare(row, results) == {"inchi_key_valid": True, "inchi_valid": True, "smiles_valid": False}
+
+def test_reports_mismatches_and_bounds_timeouts(chemspider):
+    start = time.monotonic()
+    invalid = compound_querier.validate(COMPOUNDS, concurrency=8, timeout=0.2, retries=0)
+    # the hanging lookups of butane are given up after the timeout instead of waiting for the server
+    assert time.monotonic() - start < 2
+    assert list(invalid["index"]) == [11]
+    assert invalid.loc[0, "inchi_to_smiles"] == "C=C" and not invalid.loc[0, "smiles_valid"]
+    assert len(chemspider.requests) == 4 * len(COMPOUNDS)
+
+def test_timed_out_lookups_are_not_cached(chemspider):
+    compound_querier.validate(COMPOUNDS.loc[[13]], timeout=0.2, retries=0)
+    compound_querier.validate(COMPOUNDS.loc[[13]], timeout=0.2, retries=0)
+    assert len(chemspider.requests) == 8
+
+def test_resumes_from_checkpoint(chemspider, tmp_path, monkeypatch):
+    checkpoint = str(tmp_path / "validation.csv")
+    rows = COMPOUNDS.loc[[10, 11, 12]]
+    first = validation.run(validation.validate_async(compound_querier.query, rows, samples=2, checkpoint=checkpoint, random_state=0))
+    done = pd.read_csv(checkpoint)
+    assert len(done) == 2
+
+    # A fresh cache, so every lookup of the second run reaches the server
+    monkeypatch.setattr(resolution_cache, "_default_cache", ResolutionCache(":memory:"))
+    monkeypatch.setattr(compound_querier, "resolvers", {})
+    requests_before = len(chemspider.requests)
+    invalid = validation.run(validation.validate_async(compound_querier.query, rows, checkpoint=checkpoint))
+    assert len(chemspider.requests) - requests_before == 4
+    assert sorted(pd.read_csv(checkpoint)["index"]) == [10, 11, 12]
+    assert list(invalid["index"]) == [11]
+    assert set(first["index"]) <= {11}
+
+def test_rate_limits_the_lookups():
+    def query(url_format, value):
+        return None
+    start = time.monotonic()
+    validation.run(validation.validate_async(query, COMPOUNDS.loc[[10, 11]], rate=20))
+    # 8 lookups spaced 1/20 s apart
+    assert time.monotonic() - start >= 7 / 20
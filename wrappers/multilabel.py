@@ -0,0 +1,67 @@
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+
+
+# One natively multi-output model for all labels instead of one model per label
+# backend 'random_forest' trains a single multi-output sklearn forest, 'catboost' a CatBoost model with MultiLogloss
+# Labels with the same value in every training row are not trained, they are predicted as that value
+# thread_count is the number of threads used for training and prediction (-1 for all CPUs)
+# early_stopping_rounds (catboost only) holds out eval_fraction of the training rows and stops once the loss on them
+# did not improve for that many iterations
+# Other keyword arguments are passed to the model (e.g. n_estimators, max_depth, iterations, learning_rate)
+class MultiLabel():
+    def __init__(self, backend='random_forest', thread_count=-1, early_stopping_rounds=None, eval_fraction=0.1, random_state=None, **kwargs):
+        if backend not in ('random_forest', 'catboost'):
+            raise ValueError(f'Unknown backend {backend}, use random_forest or catboost')
+        self.backend = backend
+        self.thread_count = thread_count
+        self.early_stopping_rounds = early_stopping_rounds
+        self.eval_fraction = eval_fraction
+        self.random_state = random_state
+        self.kwargs = kwargs
+
+    def _fit_random_forest(self, X, y):
+        clf = RandomForestClassifier(n_jobs=self.thread_count, random_state=self.random_state, **self.kwargs)
+        return clf.fit(X, y[:, 0] if y.shape[1] == 1 else y)
+
+    def _fit_catboost(self, X, y):
+        from catboost import CatBoostClassifier
+
+        clf = CatBoostClassifier(loss_function='MultiLogloss' if y.shape[1] > 1 else 'Logloss', thread_count=self.thread_count,
+                                 random_seed=self.random_state, verbose=False, **self.kwargs)
+        y = y if y.shape[1] > 1 else y[:, 0]
+        if self.early_stopping_rounds is None:
+            return clf.fit(X, y)
+        X_train, X_eval, y_train, y_eval = train_test_split(X, y, test_size=self.eval_fraction, random_state=self.random_state)
+        return clf.fit(X_train, y_train, eval_set=(X_eval, y_eval), early_stopping_rounds=self.early_stopping_rounds)
+
+    def fit(self, X, y):
+        y = np.asarray(y)
+        self.n_labels_ = y.shape[1]
+        self.constant_ = np.all(y == y[0], axis=0)
+        self.constant_values_ = y[0].astype(np.float64)
+        self.trained_labels_ = np.flatnonzero(~self.constant_)
+
+        self.clf = None
+        if len(self.trained_labels_) > 0:
+            fit = self._fit_random_forest if self.backend == 'random_forest' else self._fit_catboost
+            self.clf = fit(X, y[:, self.trained_labels_])
+        return self
+
+    def predict_proba(self, X):
+        # Matrix with shape (n_samples, n_labels), constant labels have probability 0 or 1
+        probabilities = np.tile(self.constant_values_, (len(X), 1))
+        if self.clf is None:
+            return probabilities
+
+        trained = self.clf.predict_proba(X)
+        if isinstance(trained, list): # multi-output forest, one (n_samples, 2) array per label
+            trained = np.column_stack([p[:, 1] for p in trained])
+        elif len(self.trained_labels_) == 1: # single label, (n_samples, 2) array
+            trained = trained[:, 1:]
+        probabilities[:, self.trained_labels_] = trained
+        return probabilities
+
+    def predict(self, X):
+        return (self.predict_proba(X) > 0.5).astype(int)
@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -6,18 +7,18 @@ from skorch import NeuralNet
 
 # Underlying neural network in pytorch
 class _NN(nn.Module):
-    def __init__(self, input_size, output_size, dropout=0.5):
+    def __init__(self, input_size, output_size, dropout=0.5, dtype=torch.float32):
         super().__init__()
         # First layer
-        self.ln1 = nn.Linear(input_size, input_size // 2).double()
+        self.ln1 = nn.Linear(input_size, input_size // 2, dtype=dtype)
         nn.init.kaiming_uniform_(self.ln1.weight, mode='fan_in', nonlinearity='relu') # He Initialization for ReLU
         self.dropout1 = nn.Dropout(p=dropout)
-        self.activation1 = nn.ReLU().double()
+        self.activation1 = nn.ReLU()
 
         # Second layer
-        self.ln2 = nn.Linear(input_size // 2, output_size).double()
+        self.ln2 = nn.Linear(input_size // 2, output_size, dtype=dtype)
         nn.init.xavier_uniform_(self.ln2.weight)  # Xavier/Glorot Initialization
-        self.activation2 = nn.Sigmoid().double()
+        self.activation2 = nn.Sigmoid()
 
     def forward(self, x):
         x = self.ln1(x)
@@ -28,13 +29,21 @@ class _NN(nn.Module):
         return x
 
 # Wrapper class for skorch
+# dtype is the floating point type of the weights and inputs ('float32' or 'float64')
+# num_threads limits the number of CPU threads torch uses (process wide), None keeps the torch default
+# inference_batch_size is the number of rows passed through the network at once in predict_proba
 class NN():
-    def __init__(self, input_size, output_size, criterion, max_epochs=10, batch_size=32, lr=0.1, dropout=0.5, device='cpu', iterator_train__shuffle=True):
+    def __init__(self, input_size, output_size, criterion, max_epochs=10, batch_size=32, lr=0.1, dropout=0.5, device='cpu', iterator_train__shuffle=True,
+                 dtype='float32', num_threads=None, inference_batch_size=4096):
+        self.dtype = np.dtype(dtype)
+        self.num_threads = num_threads
+        self.inference_batch_size = inference_batch_size
         self.model = NeuralNet(
             module=_NN,
             module__input_size=input_size,
             module__output_size=output_size,
             module__dropout=dropout,
+            module__dtype=getattr(torch, self.dtype.name),
             criterion=criterion,
             max_epochs=max_epochs,
             lr=lr,
@@ -45,11 +54,30 @@ class NN():
             predict_nonlinearity=None,
         )
 
+    def _set_threads(self):
+        if self.num_threads is not None:
+            torch.set_num_threads(self.num_threads)
+
     def fit(self, X, y):
-        self.model.fit(X, y)
+        self._set_threads()
+        self.model.fit(np.asarray(X, dtype=self.dtype), np.asarray(y, dtype=self.dtype))
 
     def predict_proba(self, X):
-        return self.model.predict_proba(X)
-    
+        self._set_threads()
+        module = self.model.module_
+        module.eval()
+        probabilities = []
+        with torch.inference_mode():
+            for start in range(0, len(X), self.inference_batch_size):
+                batch = torch.as_tensor(np.asarray(X[start:start + self.inference_batch_size], dtype=self.dtype), device=self.model.device)
+                probabilities.append(module(batch).cpu().numpy())
+        return np.concatenate(probabilities) if probabilities else np.empty((0, module.ln2.out_features), dtype=self.dtype)
+
     def predict(self, X):
-        return self.predict_proba(X) > 0.5
\ No newline at end of file
+        return self.predict_proba(X) > 0.5
+
+    # Save the trained network as TorchScript, it can be loaded without this code with torch.jit.load(path)
+    def export_torchscript(self, path):
+        module = self.model.module_
+        module.eval()
+        torch.jit.script(module).save(path)